@@ -86,7 +86,11 @@ parser.add_argument('--pretrained', dest='pretrained', action='store_true', defa
 parser.add_argument('--seed', default=None, type=int,
                     help='seed for initializing training')
 parser.add_argument('--gpu', default=0, type=int,
-                    help='GPU ID to use (default: 0)')
+                    help='GPU ID to use (default: 0, or CPU if CUDA is unavailable)')
+parser.add_argument('--amp', action='store_true',
+                    help='use automatic mixed precision (FP16) training on the GPU')
+parser.add_argument('--channels-last', action='store_true',
+                    help='use the channels-last (NHWC) memory format for the model and images')
 
 args = parser.parse_args()
 
@@ -115,8 +119,16 @@ def main(args):
                       'You may see unexpected behavior when restarting '
                       'from checkpoints.')
 
+    if args.gpu is not None and not torch.cuda.is_available():
+        print(f"=> CUDA is unavailable, using CPU")
+        args.gpu = None
+        
     if args.gpu is not None:
         print(f"=> using GPU {args.gpu} ({torch.cuda.get_device_name(args.gpu)})")
+    
+    if args.amp and args.gpu is None:
+        print(f"=> mixed precision is only supported on GPU, disabling --amp")
+        args.amp = False
 
     # setup data transformations
     normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406],
@@ -187,6 +199,12 @@ def main(args):
         model = model.cuda(args.gpu)
         criterion = criterion.cuda(args.gpu)
 
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+        
+    # scales the loss to prevent FP16 gradients from underflowing (disabled unless --amp)
+    scaler = torch.cuda.amp.GradScaler(enabled=args.amp)
+
     # optionally resume from a checkpoint
     if args.resume:
         if os.path.isfile(args.resume):
@@ -198,6 +216,8 @@ def main(args):
             #    best_accuracy = best_accuracy.to(args.gpu)   # best_accuracy may be from a checkpoint from a different GPU
             model.load_state_dict(checkpoint['state_dict'])
             optimizer.load_state_dict(checkpoint['optimizer'])
+            if 'scaler' in checkpoint:
+                scaler.load_state_dict(checkpoint['scaler'])
             print(f"=> loaded checkpoint '{args.resume}' (epoch {checkpoint['epoch']})")
         else:
             print(f"=> no checkpoint found at '{args.resume}'")
@@ -215,7 +235,7 @@ def main(args):
         adjust_learning_rate(optimizer, epoch)
 
         # train for one epoch
-        train_loss, train_acc = train(train_loader, model, criterion, optimizer, epoch)
+        train_loss, train_acc = train(train_loader, model, criterion, optimizer, scaler, epoch)
 
         # evaluate on validation set
         val_loss, val_acc = validate(val_loader, model, criterion, epoch)
@@ -241,12 +261,16 @@ def main(args):
             'accuracy': {'train': train_acc, 'val': val_acc},
             'loss' : {'train': train_loss, 'val': val_loss},
             'optimizer' : optimizer.state_dict(),
+            'scaler' : scaler.state_dict(),
         }, is_best)
 
 
-def train(train_loader, model, criterion, optimizer, epoch):
+def train(train_loader, model, criterion, optimizer, scaler, epoch):
     """
     Train one epoch over the dataset
+    
+    The loss and accuracy are accumulated on the device, so they only get 
+    synchronized with the CPU when the progress is printed.
     """
     batch_time = AverageMeter('Time', ':6.3f')
     data_time = AverageMeter('Data', ':6.3f')
@@ -270,22 +294,22 @@ def train(train_loader, model, criterion, optimizer, epoch):
         # measure data loading time
         data_time.update(time.time() - end)
 
-        if args.gpu is not None:
-            images = images.cuda(args.gpu, non_blocking=True)
-            target = target.cuda(args.gpu, non_blocking=True)
+        images, target = to_device(images, target)
 
         # compute output
-        output = model(images)
-        loss = criterion(output, target)
+        with torch.autocast(device_type='cuda' if args.gpu is not None else 'cpu', enabled=args.amp):
+            output = model(images)
+            loss = criterion(output, target)
 
         # record loss and measure accuracy
-        losses.update(loss.item(), images.size(0))
+        losses.update(loss.detach(), images.size(0))
         acc.update(accuracy(output, target), images.size(0))
 
         # compute gradient and do SGD step
         optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
 
         # measure elapsed time
         batch_time.update(time.time() - end)
@@ -296,10 +320,10 @@ def train(train_loader, model, criterion, optimizer, epoch):
     
     print(f"Epoch: [{epoch}] completed, elapsed time {time.time() - epoch_start:6.3f} seconds")
 
-    tensorboard.add_scalar('Loss/train', losses.avg, epoch)
-    tensorboard.add_scalar('Accuracy/train', acc.avg, epoch)
+    tensorboard.add_scalar('Loss/train', float(losses.avg), epoch)
+    tensorboard.add_scalar('Accuracy/train', float(acc.avg), epoch)
 
-    return losses.avg, acc.avg
+    return float(losses.avg), float(acc.avg)
     
 
 def validate(val_loader, model, criterion, epoch):
@@ -321,16 +345,15 @@ def validate(val_loader, model, criterion, epoch):
     with torch.no_grad():
         end = time.time()
         for i, (images, target) in enumerate(val_loader):
-            if args.gpu is not None:
-                images = images.cuda(args.gpu, non_blocking=True)
-                target = target.cuda(args.gpu, non_blocking=True)
+            images, target = to_device(images, target)
 
             # compute output
-            output = model(images)
-            loss = criterion(output, target)
+            with torch.autocast(device_type='cuda' if args.gpu is not None else 'cpu', enabled=args.amp):
+                output = model(images)
+                loss = criterion(output, target)
 
             # record loss and measure accuracy
-            losses.update(loss.item(), images.size(0))
+            losses.update(loss, images.size(0))
             acc.update(accuracy(output, target), images.size(0))
             
             # measure elapsed time
@@ -340,10 +363,24 @@ def validate(val_loader, model, criterion, epoch):
             if i % args.print_freq == 0 or i == len(val_loader)-1:
                 progress.display(i)
 
-    tensorboard.add_scalar('Loss/val', losses.avg, epoch)
-    tensorboard.add_scalar('Accuracy/val', acc.avg, epoch)
+    tensorboard.add_scalar('Loss/val', float(losses.avg), epoch)
+    tensorboard.add_scalar('Accuracy/val', float(acc.avg), epoch)
     
-    return losses.avg, acc.avg
+    return float(losses.avg), float(acc.avg)
+
+
+def to_device(images, target):
+    """
+    Transfer a batch to the GPU (if one is being used) and apply the memory format
+    """
+    if args.gpu is not None:
+        images = images.cuda(args.gpu, non_blocking=True)
+        target = target.cuda(args.gpu, non_blocking=True)
+        
+    if args.channels_last:
+        images = images.contiguous(memory_format=torch.channels_last)
+        
+    return images, target
 
 
 def save_checkpoint(state, is_best, filename='checkpoint.pth.tar', best_filename='model_best.pth.tar', labels_filename='labels.txt'):
@@ -390,6 +427,7 @@ def adjust_learning_rate(optimizer, epoch):
 def accuracy(output, target):
     """
     Computes the accuracy of predictions vs groundtruth
+    (returned as a tensor on the same device, so it doesn't cause a sync)
     """
     with torch.no_grad():
         if args.multi_label:
@@ -405,12 +443,13 @@ def accuracy(output, target):
             _, preds = torch.max(output, dim=-1)
             preds = (preds == target)
             
-        return preds.float().mean().cpu().item() * 100.0
+        return preds.float().mean() * 100.0
         
         
 class AverageMeter(object):
     """
     Computes and stores the average and current value
+    (the values can be tensors, which only get synchronized when printed)
     """
     def __init__(self, name, fmt=':f'):
         self.name = name
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+#
+# benchmark the training steps/sec of train_ssd.py's training loop against the previous loop
+# (FP32, sort-based hard negative mining, syncing the losses with the CPU every step, and
+# re-spawning the data loader workers each epoch without pinned memory)
+#
+import sys
+import math
+import time
+import logging
+import argparse
+import torch
+import torch.nn.functional as F
+
+from torch.utils.data import DataLoader
+
+from vision.ssd.ssd import MatchPrior
+from vision.ssd.vgg_ssd import create_vgg_ssd
+from vision.ssd.mobilenetv1_ssd import create_mobilenetv1_ssd
+from vision.ssd.mobilenetv1_ssd_lite import create_mobilenetv1_ssd_lite
+from vision.ssd.mobilenet_v2_ssd_lite import create_mobilenetv2_ssd_lite
+from vision.nn.multibox_loss import MultiboxLoss
+from vision.utils.misc import loader_args, train_step
+from vision.ssd.config import vgg_ssd_config
+from vision.ssd.config import mobilenetv1_ssd_config
+
+
+parser = argparse.ArgumentParser(description='Benchmark the SSD training loop')
+
+parser.add_argument('--net', default="mb1-ssd",
+                    help="The network architecture, it can be mb1-ssd, mb1-ssd-lite, mb2-ssd-lite or vgg16-ssd.")
+parser.add_argument('--resolution', type=int, default=300,
+                    help="the NxN pixel resolution of the model (can be changed for mb1-ssd only)")
+parser.add_argument('--num-classes', type=int, default=21, help='The number of classes (including BACKGROUND)')
+parser.add_argument('--batch-size', default=4, type=int, help='Batch size for training')
+parser.add_argument('--steps', default=50, type=int, help='The number of steps to time for each loop')
+parser.add_argument('--warmup', default=5, type=int, help='The number of steps to run before timing')
+parser.add_argument('--epoch-size', default=10, type=int, help='The number of batches in each epoch of the synthetic dataset')
+parser.add_argument('--num-workers', '--workers', default=2, type=int, help='Number of workers used in dataloading')
+parser.add_argument('--prefetch-factor', default=2, type=int, help='Number of batches loaded in advance by each worker')
+parser.add_argument('--debug-steps', default=10, type=int, help='How often the new loop syncs the losses (like train_ssd.py)')
+parser.add_argument('--amp', action='store_true', help='Use automatic mixed precision in the new loop (CUDA only)')
+parser.add_argument('--use-cuda', default=True, action='store_true', help='Use CUDA to train model')
+
+args = parser.parse_args()
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                    format='%(asctime)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
+
+DEVICE = torch.device("cuda:0" if torch.cuda.is_available() and args.use_cuda else "cpu")
+
+
+def sort_hard_negative_mining(loss, labels, neg_pos_ratio):
+    """
+    The previous version of box_utils.hard_negative_mining, which sorts all of the priors twice.
+    """
+    pos_mask = labels > 0
+    num_pos = pos_mask.long().sum(dim=1, keepdim=True)
+    num_neg = num_pos * neg_pos_ratio
+
+    loss[pos_mask] = -math.inf
+    _, indexes = loss.sort(dim=1, descending=True)
+    _, orders = indexes.sort(dim=1)
+    neg_mask = orders < num_neg
+    return pos_mask | neg_mask
+
+
+def legacy_loss(confidence, predicted_locations, labels, gt_locations, neg_pos_ratio=3):
+    """
+    The previous version of MultiboxLoss, which indexes the selected priors (syncing with the device).
+    """
+    num_classes = confidence.size(2)
+    with torch.no_grad():
+        loss = -F.log_softmax(confidence, dim=2)[:, :, 0]
+        mask = sort_hard_negative_mining(loss, labels, neg_pos_ratio)
+
+    confidence = confidence[mask, :]
+    classification_loss = F.cross_entropy(confidence.reshape(-1, num_classes), labels[mask], reduction='sum')
+    pos_mask = labels > 0
+    predicted_locations = predicted_locations[pos_mask, :].reshape(-1, 4)
+    gt_locations = gt_locations[pos_mask, :].reshape(-1, 4)
+    smooth_l1_loss = F.smooth_l1_loss(predicted_locations, gt_locations, reduction='sum')
+    num_pos = gt_locations.size(0)
+    return smooth_l1_loss/num_pos, classification_loss/num_pos
+
+
+class SyntheticDataset(torch.utils.data.Dataset):
+    """
+    Random images and boxes (already transformed), with the priors matched in the data loader workers like train_ssd.py
+    """
+    def __init__(self, size, config, num_classes):
+        self.size = size
+        self.image_size = config.image_size
+        self.num_classes = num_classes
+        self.matcher = MatchPrior(config.priors, config.center_variance, config.size_variance, 0.5)
+
+    def __getitem__(self, index):
+        generator = torch.Generator().manual_seed(index)
+        centers = torch.rand(5, 2, generator=generator) * 0.6 + 0.2
+        sizes = torch.rand(5, 2, generator=generator) * 0.3 + 0.05
+        boxes, labels = self.matcher(torch.cat([centers - sizes / 2, centers + sizes / 2], dim=1),
+                                     torch.randint(1, self.num_classes, (5,), generator=generator))
+        return torch.randn(3, self.image_size, self.image_size, generator=generator), boxes, labels
+
+    def __len__(self):
+        return self.size
+
+
+def iterate(loader, steps):
+    """
+    Yield the given number of batches from the loader (running it for as many epochs as needed).
+    """
+    while steps > 0:
+        for batch in loader:
+            yield batch
+            steps -= 1
+
+            if steps <= 0:
+                return
+
+
+def legacy_loop(net, loader, optimizer, steps):
+    """
+    The previous training loop - FP32, blocking copies, and six host syncs per step for the losses.
+    """
+    train_loss = 0.0
+    train_regression_loss = 0.0
+    train_classification_loss = 0.0
+
+    running_loss = 0.0
+    running_regression_loss = 0.0
+    running_classification_loss = 0.0
+
+    for images, boxes, labels in iterate(loader, steps):
+        images = images.to(DEVICE)
+        boxes = boxes.to(DEVICE)
+        labels = labels.to(DEVICE)
+
+        optimizer.zero_grad()
+        confidence, locations = net(images)
+        regression_loss, classification_loss = legacy_loss(confidence, locations, labels, boxes)
+        loss = regression_loss + classification_loss
+        loss.backward()
+        optimizer.step()
+
+        train_loss += loss.item()
+        train_regression_loss += regression_loss.item()
+        train_classification_loss += classification_loss.item()
+
+        running_loss += loss.item()
+        running_regression_loss += regression_loss.item()
+        running_classification_loss += classification_loss.item()
+
+
+def current_loop(net, loader, optimizer, steps, criterion, scaler=None):
+    """
+    The current training loop from train_ssd.py - its train_step() (mixed precision, top-k hard
+    negative mining), with the losses accumulated on the device and synced every debug_steps.
+    """
+    running_loss = torch.zeros(3, device=DEVICE)
+
+    for i, (images, boxes, labels) in enumerate(iterate(loader, steps)):
+        running_loss += train_step(net, criterion, optimizer, images, boxes, labels, DEVICE, scaler=scaler)
+
+        if i and i % args.debug_steps == 0:
+            running_loss.tolist()
+            running_loss.zero_()
+
+    running_loss.tolist()
+
+
+def benchmark(name, loop):
+    """
+    Run the warmup steps, and then return the steps/sec of the loop (which gets called with the number of steps).
+    """
+    loop(args.warmup)
+
+    if DEVICE.type == 'cuda':
+        torch.cuda.synchronize()
+
+    start = time.perf_counter()
+    loop(args.steps)
+
+    if DEVICE.type == 'cuda':
+        torch.cuda.synchronize()
+
+    steps_per_sec = args.steps / (time.perf_counter() - start)
+    logging.info(f"{name} loop:  {steps_per_sec:.2f} steps/sec ({args.batch_size * steps_per_sec:.1f} images/sec)")
+    return steps_per_sec
+
+
+if __name__ == '__main__':
+    if args.net == 'vgg16-ssd':
+        create_net = create_vgg_ssd
+        config = vgg_ssd_config
+    elif args.net == 'mb1-ssd':
+        create_net = create_mobilenetv1_ssd
+        config = mobilenetv1_ssd_config
+        config.set_image_size(args.resolution)
+    elif args.net == 'mb1-ssd-lite':
+        create_net = create_mobilenetv1_ssd_lite
+        config = mobilenetv1_ssd_config
+    elif args.net == 'mb2-ssd-lite':
+        create_net = create_mobilenetv2_ssd_lite
+        config = mobilenetv1_ssd_config
+    else:
+        logging.fatal("The net type is wrong.")
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    if args.amp and DEVICE.type != 'cuda':
+        logging.warning("--amp is only supported with CUDA, benchmarking in FP32")
+        args.amp = False
+
+    logging.info(f"benchmarking {args.net} on {DEVICE} (batch size {args.batch_size}, {args.steps} steps)")
+
+    # the data gets loaded from a synthetic dataset through the same loader settings as train_ssd.py
+    dataset = SyntheticDataset(args.epoch_size * args.batch_size, config, args.num_classes)
+
+    criterion = MultiboxLoss(config.priors, iou_threshold=0.5, neg_pos_ratio=3,
+                             center_variance=0.1, size_variance=0.2, device=DEVICE)
+
+    results = []
+
+    for name in ('previous', 'current'):
+        torch.manual_seed(0)
+        net = create_net(args.num_classes).to(DEVICE)
+        net.train(True)
+        optimizer = torch.optim.SGD(net.parameters(), lr=0.001, momentum=0.9, weight_decay=5e-4)
+
+        if name == 'previous':
+            loader = DataLoader(dataset, args.batch_size, shuffle=True, num_workers=args.num_workers)
+            results.append(benchmark(name, lambda steps: legacy_loop(net, loader, optimizer, steps)))
+        else:
+            loader = DataLoader(dataset, args.batch_size, shuffle=True, **loader_args(DEVICE, args.num_workers, args.prefetch_factor))
+            scaler = torch.cuda.amp.GradScaler() if args.amp else None
+            results.append(benchmark(name, lambda steps: current_loop(net, loader, optimizer, steps, criterion, scaler)))
+
+    logging.info(f"speedup:  {results[1] / results[0]:.2f}x")
@@ -5,14 +5,17 @@ from vision.ssd.mobilenetv1_ssd_lite import create_mobilenetv1_ssd_lite, create_
 from vision.ssd.squeezenet_ssd_lite import create_squeezenet_ssd_lite, create_squeezenet_ssd_lite_predictor
 from vision.datasets.voc_dataset import VOCDataset
 from vision.datasets.open_images import OpenImagesDataset
-from vision.utils import box_utils, measurements
+from vision.datasets.packed_dataset import PackedDataset
+from vision.utils import box_utils, box_utils_numpy, measurements
 from vision.utils.misc import str2bool, Timer
 import argparse
 import pathlib
+import multiprocessing
 import numpy as np
 import logging
 import sys
 from vision.ssd.mobilenet_v2_ssd_lite import create_mobilenetv2_ssd_lite, create_mobilenetv2_ssd_lite_predictor
+from vision.ssd.predictor import PredictionDataset
 
 
 class MeanAPEvaluator:
@@ -20,15 +23,19 @@ class MeanAPEvaluator:
     Mean Average Precision (mAP) evaluator
     """
     def __init__(self, dataset, net, arch='mb1-ssd', eval_dir='models/eval_results', 
-                 nms_method='hard', iou_threshold=0.5, use_2007_metric=True, device='cuda:0'):
+                 nms_method='hard', iou_threshold=0.5, use_2007_metric=True, device='cuda:0',
+                 batch_size=8, num_workers=0, num_processes=0, export_results=False):
                  
         self.dataset = dataset
         self.net = net
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.num_processes = num_processes
+        self.export_results = export_results
         self.iou_threshold = iou_threshold
         self.use_2007_metric = use_2007_metric
 
         self.eval_path = pathlib.Path(eval_dir)
-        self.eval_path.mkdir(exist_ok=True)
     
         self.true_case_stat, self.all_gb_boxes, self.all_difficult_cases = self.group_annotation_by_class(self.dataset)
         
@@ -51,51 +58,77 @@ class MeanAPEvaluator:
         
         results = []
 
-        for i in range(len(self.dataset)):
-            logging.debug(f"evaluating average precision   image {i} / {len(self.dataset)}")
-            image = self.dataset.get_image(i)
-            boxes, labels, probs = self.predictor.predict(image)
-            indexes = torch.ones(labels.size(0), 1, dtype=torch.float32) * i
-            results.append(torch.cat([
-                indexes.reshape(-1, 1),
-                labels.reshape(-1, 1).float(),
-                probs.reshape(-1, 1),
-                boxes + 1.0  # matlab's indexes start from 1
-            ], dim=1))
+        # the images get loaded and transformed by the DataLoader workers, and run through the network in batches
+        loader = torch.utils.data.DataLoader(
+            PredictionDataset(self.dataset, self.predictor.transform),
+            batch_size=self.batch_size, num_workers=self.num_workers,
+            pin_memory=self.predictor.device != torch.device('cpu'))
+            
+        for image_indexes, images, sizes in loader:
+            logging.debug(f"evaluating average precision   image {image_indexes[-1]} / {len(self.dataset)}")
+            
+            for i, (boxes, labels, probs) in zip(image_indexes.tolist(), self.predictor.predict_batch(images, sizes=sizes)):
+                if labels.size(0) == 0:
+                    continue
+                    
+                # columns:  image index, label, prob, x1, y1, x2, y2
+                results.append(np.concatenate([
+                    np.full((labels.size(0), 1), i, dtype=np.float32),
+                    labels.reshape(-1, 1).numpy().astype(np.float32),
+                    probs.reshape(-1, 1).numpy(),
+                    boxes.numpy()
+                ], axis=1))
             
-        results = torch.cat(results)
+        results = np.concatenate(results) if results else np.zeros((0, 7), dtype=np.float32)
         self.net.is_test = is_test
         
-        for class_index, class_name in enumerate(self.dataset.class_names):
-            if class_index == 0: continue  # ignore background
-            prediction_path = self.eval_path / f"det_test_{class_name}.txt"
-            with open(prediction_path, "w") as f:
-                sub = results[results[:, 1] == class_index, :]
-                for i in range(sub.size(0)):
-                    prob_box = sub[i, 2:].numpy()
-                    image_id = self.dataset.ids[int(sub[i, 0])]
-                    print(
-                        image_id + "\t" + " ".join([str(v) for v in prob_box]).replace(" ", "\t"),
-                        file=f
-                    )
-        aps = []
+        if self.export_results:
+            self.export(results)
+            
+        tasks = []
         
         for class_index, class_name in enumerate(self.dataset.class_names):
             if class_index == 0:
                 continue
-            prediction_path = self.eval_path / f"det_test_{class_name}.txt"
-            ap = self.compute_average_precision_per_class(
+            sub = results[results[:, 1] == class_index, :]
+            tasks.append((
                 self.true_case_stat[class_index],
                 self.all_gb_boxes[class_index],
                 self.all_difficult_cases[class_index],
-                prediction_path,
+                sub[:, 0].astype(np.int64),
+                sub[:, 2],
+                sub[:, 3:],
                 self.iou_threshold,
                 self.use_2007_metric
-            )
-            aps.append(ap)
+            ))
+            
+        if self.num_processes > 0:
+            with multiprocessing.Pool(self.num_processes) as pool:
+                aps = pool.starmap(self.compute_average_precision_per_class, tasks)
+        else:
+            aps = [self.compute_average_precision_per_class(*task) for task in tasks]
 
         return sum(aps)/len(aps), aps
       
+    def export(self, results):
+        """
+        Save the detections to det_test_<class>.txt files under eval_dir (in the VOC devkit format)
+        """
+        self.eval_path.mkdir(exist_ok=True)
+        
+        for class_index, class_name in enumerate(self.dataset.class_names):
+            if class_index == 0: continue  # ignore background
+            prediction_path = self.eval_path / f"det_test_{class_name}.txt"
+            with open(prediction_path, "w") as f:
+                sub = results[results[:, 1] == class_index, :]
+                for i in range(sub.shape[0]):
+                    prob_box = np.concatenate([sub[i, 2:3], sub[i, 3:] + 1.0])  # matlab's indexes start from 1
+                    image_id = self.dataset.ids[int(sub[i, 0])]
+                    print(
+                        image_id + "\t" + " ".join([str(v) for v in prob_box]).replace(" ", "\t"),
+                        file=f
+                    )
+                    
     def log_results(self, mean_ap, class_ap, prefix=''):
         logging.info(f"{prefix}Average Precision Per-class:")
         
@@ -105,78 +138,67 @@ class MeanAPEvaluator:
         logging.info(f"{prefix}Mean Average Precision (mAP):  {mean_ap}")
         
     def group_annotation_by_class(self, dataset):
+        """
+        Returns the number of non-difficult ground truth boxes of each class, along with dicts of
+        class => {image index => gt boxes (N, 4)} and class => {image index => difficult flags (N)}
+        """
         true_case_stat = {}
         all_gt_boxes = {}
         all_difficult_cases = {}
         for i in range(len(dataset)):
             image_id, annotation = dataset.get_annotation(i)
             gt_boxes, classes, is_difficult = annotation
-            gt_boxes = torch.from_numpy(gt_boxes)
-            for i, difficult in enumerate(is_difficult):
-                class_index = int(classes[i])
-                gt_box = gt_boxes[i]
-                if not difficult:
-                    true_case_stat[class_index] = true_case_stat.get(class_index, 0) + 1
-
-                if class_index not in all_gt_boxes:
-                    all_gt_boxes[class_index] = {}
-                if image_id not in all_gt_boxes[class_index]:
-                    all_gt_boxes[class_index][image_id] = []
-                all_gt_boxes[class_index][image_id].append(gt_box)
-                if class_index not in all_difficult_cases:
-                    all_difficult_cases[class_index]={}
-                if image_id not in all_difficult_cases[class_index]:
-                    all_difficult_cases[class_index][image_id] = []
-                all_difficult_cases[class_index][image_id].append(difficult)
-
-        for class_index in all_gt_boxes:
-            for image_id in all_gt_boxes[class_index]:
-                all_gt_boxes[class_index][image_id] = torch.stack(all_gt_boxes[class_index][image_id])
-        for class_index in all_difficult_cases:
-            for image_id in all_difficult_cases[class_index]:
-                all_gt_boxes[class_index][image_id] = all_gt_boxes[class_index][image_id].clone().detach() #torch.tensor(all_gt_boxes[class_index][image_id])
+            gt_boxes = np.asarray(gt_boxes, dtype=np.float32).reshape(-1, 4)
+            classes = np.asarray(classes).reshape(-1).astype(np.int64)
+            is_difficult = np.asarray(is_difficult).reshape(-1).astype(bool)
+            for class_index in np.unique(classes).tolist():
+                mask = classes == class_index
+                true_case_stat[class_index] = true_case_stat.get(class_index, 0) + int(np.sum(mask & ~is_difficult))
+                all_gt_boxes.setdefault(class_index, {})[i] = gt_boxes[mask]
+                all_difficult_cases.setdefault(class_index, {})[i] = is_difficult[mask]
         return true_case_stat, all_gt_boxes, all_difficult_cases
 
-
-    def compute_average_precision_per_class(self, num_true_cases, gt_boxes, difficult_cases,
-                                            prediction_file, iou_threshold, use_2007_metric):
-        with open(prediction_file) as f:
-            image_ids = []
-            boxes = []
-            scores = []
-            for line in f:
-                t = line.rstrip().split("\t")
-                image_ids.append(t[0])
-                scores.append(float(t[1]))
-                box = torch.tensor([float(v) for v in t[2:]]).unsqueeze(0)
-                box -= 1.0  # convert to python format where indexes start from 0
-                boxes.append(box)
-            scores = np.array(scores)
-            sorted_indexes = np.argsort(-scores)
-            boxes = [boxes[i] for i in sorted_indexes]
-            image_ids = [image_ids[i] for i in sorted_indexes]
-            true_positive = np.zeros(len(image_ids))
-            false_positive = np.zeros(len(image_ids))
-            matched = set()
-            for i, image_id in enumerate(image_ids):
-                box = boxes[i]
-                if image_id not in gt_boxes:
-                    false_positive[i] = 1
-                    continue
-
-                gt_box = gt_boxes[image_id]
-                ious = box_utils.iou_of(box, gt_box)
-                max_iou = torch.max(ious).item()
-                max_arg = torch.argmax(ious).item()
-                if max_iou > iou_threshold:
-                    if difficult_cases[image_id][max_arg] == 0:
-                        if (image_id, max_arg) not in matched:
-                            true_positive[i] = 1
-                            matched.add((image_id, max_arg))
-                        else:
-                            false_positive[i] = 1
-                else:
-                    false_positive[i] = 1
+    @staticmethod
+    def compute_average_precision_per_class(num_true_cases, gt_boxes, difficult_cases,
+                                            image_indexes, scores, boxes, iou_threshold, use_2007_metric):
+        """
+        Compute the average precision of one class, given the image index, score, and box of each prediction
+        (as arrays) and dicts of the ground truth boxes and difficult flags (keyed by image index).
+        
+        Predictions are matched greedily in order of descending score to the ground truth box that they
+        overlap the most - the first match of a box is a true positive, and the rest are false positives.
+        """
+        sorted_indexes = np.argsort(-scores)
+        image_indexes = image_indexes[sorted_indexes]
+        boxes = boxes[sorted_indexes]
+        
+        num_predictions = len(image_indexes)
+        max_iou = np.zeros(num_predictions, dtype=np.float32)
+        max_arg = np.zeros(num_predictions, dtype=np.int64)
+        difficult = np.zeros(num_predictions, dtype=bool)
+        
+        # compute the IoU matrix between the predictions and ground truth of each image
+        image_order = np.argsort(image_indexes, kind='stable')
+        images, image_starts = np.unique(image_indexes[image_order], return_index=True)
+        
+        for image_index, predictions in zip(images.tolist(), np.split(image_order, image_starts[1:])):
+            if image_index not in gt_boxes:
+                continue
+            ious = box_utils_numpy.iou_of(boxes[predictions, np.newaxis, :], gt_boxes[image_index][np.newaxis, :, :])
+            max_arg[predictions] = np.argmax(ious, axis=1)
+            max_iou[predictions] = ious[np.arange(len(predictions)), max_arg[predictions]]
+            difficult[predictions] = difficult_cases[image_index][max_arg[predictions]]
+            
+        matched = max_iou > iou_threshold
+        candidates = matched & ~difficult   # matches to difficult boxes are ignored
+        
+        # the first (highest-scoring) match to each ground truth box is the true positive
+        candidate_indexes = np.flatnonzero(candidates)
+        _, first = np.unique(np.stack([image_indexes[candidate_indexes], max_arg[candidate_indexes]], axis=1), axis=0, return_index=True)
+        
+        true_positive = np.zeros(num_predictions)
+        true_positive[candidate_indexes[first]] = 1
+        false_positive = (~matched | candidates).astype(np.float64) - true_positive
 
         true_positive = true_positive.cumsum()
         false_positive = false_positive.cumsum()
@@ -192,7 +214,7 @@ if __name__ == '__main__':
     
     parser.add_argument('--net', default="vgg16-ssd", help="The network architecture, it should be of mb1-ssd, mb1-ssd-lite, mb2-ssd-lite or vgg16-ssd.")
     parser.add_argument("--model", type=str, help="Path to the trained PyTorch checkpoint")
-    parser.add_argument("--dataset_type", default="voc", type=str, help="Specify dataset type. Currently support voc and open_images.")
+    parser.add_argument("--dataset_type", default="voc", type=str, help="Specify dataset type. Currently support voc, open_images, and packed.")
     parser.add_argument("--dataset", type=str, help="The root directory of the VOC dataset or Open Images dataset.")
     parser.add_argument("--label_file", type=str, help="The label file path.")
     parser.add_argument("--use_cuda", type=str2bool, default=True)
@@ -200,6 +222,11 @@ if __name__ == '__main__':
     parser.add_argument("--nms_method", type=str, default="hard")
     parser.add_argument("--iou_threshold", type=float, default=0.5, help="The threshold of Intersection over Union.")
     parser.add_argument("--eval_dir", default="models/eval_results", type=str, help="The directory to store evaluation results.")
+    parser.add_argument("--batch_size", default=8, type=int, help="The number of images to run through the network at once.")
+    parser.add_argument("--num_workers", default=2, type=int, help="The number of workers used for loading the images.")
+    parser.add_argument("--rebuild_index", action='store_true', help="Rebuild the cached annotations index of a VOC dataset (needed after editing annotations in-place).")
+    parser.add_argument("--num_processes", default=0, type=int, help="The number of processes used for computing the per-class AP (0 to compute them in this process).")
+    parser.add_argument("--export_results", type=str2bool, default=True, help="Save the detections of each class to text files under eval_dir.")
     parser.add_argument('--mb2_width_mult', default=1.0, type=float,
                         help='Width Multiplifier for MobilenetV2')
                         
@@ -209,9 +236,11 @@ if __name__ == '__main__':
                     
     # load the dataset
     if args.dataset_type == "voc":
-        dataset = VOCDataset(args.dataset, is_test=True)
+        dataset = VOCDataset(args.dataset, is_test=True, rebuild_index=args.rebuild_index)
     elif args.dataset_type == 'open_images':
         dataset = OpenImagesDataset(args.dataset, dataset_type="test")
+    elif args.dataset_type == 'packed':
+        dataset = PackedDataset(args.dataset, dataset_type="test")
 
     # create the network
     if args.net == 'vgg16-ssd':
@@ -238,7 +267,9 @@ if __name__ == '__main__':
     # eval the mAP
     eval = MeanAPEvaluator(dataset, net, arch=args.net, eval_dir=args.eval_dir, 
                            nms_method=args.nms_method, iou_threshold=args.iou_threshold,
-                           use_2007_metric=args.use_2007_metric, device=DEVICE)
+                           use_2007_metric=args.use_2007_metric, device=DEVICE,
+                           batch_size=args.batch_size, num_workers=args.num_workers,
+                           num_processes=args.num_processes, export_results=args.export_results)
                                  
     mean_ap, class_ap = eval.compute()
     eval.log_results(mean_ap, class_ap)
@@ -1,27 +1,13 @@
 #!/usr/bin/env python3
 import os
 import sys
-import time
-import boto3
-import botocore
 import logging
 import argparse
-import functools
-import packaging
 
 import pandas as pd
 import numpy as np
 
-from urllib import request
-from random import sample 
-
-from botocore import UNSIGNED
-from botocore.config import Config
-
-from multiprocessing import Pool, Manager
-
-
-s3 = boto3.client('s3', config=Config(signature_version=UNSIGNED))
+from vision.utils.download import DownloadManifest, Downloader
 
 
 def parse_args():
@@ -30,8 +16,12 @@ def parse_args():
     parser.add_argument("--root", "--data", type=str, default="data", help="The root directory that you want to store the image data.")
     parser.add_argument("--include-depiction", action="store_true", help="Do you want to include drawings or depictions?")
     parser.add_argument("--class-names", type=str, help="Comma-separated list of classes you want to download.")
-    parser.add_argument("--num-workers", type=int, default=10, help="the number of worker threads used to download images.")
+    parser.add_argument("--num-workers", type=int, default=32, help="the number of concurrent downloads.")
     parser.add_argument("--retry", type=int, default=10, help="retry times when downloading.")
+    parser.add_argument("--verify", action="store_true", help="check the MD5 checksums of the files that were already downloaded, instead of only their size.")
+    parser.add_argument("--s3-endpoint", type=str, default=None, help="the S3 endpoint URL to download the images from (the default is AWS).")
+    parser.add_argument("--bucket", type=str, default="open-images-dataset", help="the S3 bucket to download the images from.")
+    parser.add_argument("--annotations-url", type=str, default="https://storage.googleapis.com/openimages/2018_04", help="the base URL to download the class descriptions and annotations from.")
     parser.add_argument('--remove-overlapped', action='store_true', help="Remove single boxes covered by group boxes.")
     parser.add_argument('--max-images', type=int, default=-1, help='limit the total number of images downloaded across the whole dataset.  The default is to use all available data.')
     parser.add_argument('--max-annotations-per-class', type=int, default=-1, help='limit the number of bounding-box annotations per class.  Each class will be able to have up to this many annotations.  The default is to use all annotations per class.')
@@ -40,47 +30,14 @@ def parse_args():
     return parser.parse_args()
 
 
-def download(bucket, root, retry, counter, lock, path):
-    i = 0
-    src = path
-    dest = f"{root}/{path}"
-    while i < retry:
-        try:
-            if not os.path.exists(dest):
-                s3.download_file(bucket, src, dest)
-            else:
-                logging.info(f"{dest} already exists.")
-            with lock:
-                counter.value += 1
-                if counter.value % 100 == 0:
-                    logging.warning(f"Downloaded {counter.value} images.")
-            return
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == "404":
-                logging.warning(f"The file s3://{bucket}/{src} does not exist.")
-                return
-            i += 1
-            logging.warning(f"Sleep {i} and try again.")
-            time.sleep(i)
-    logging.warning(f"Failed to download the file s3://{bucket}/{src}. Exception: {e}")
-
-
-def batch_download(bucket, file_paths, root, num_workers=10, retry=10):
-    with Pool(num_workers) as p:
-        m = Manager()
-        counter = m.Value('i', 0)
-        lock = m.Lock()
-        download_ = functools.partial(download, bucket, root, retry, counter, lock)
-        p.map(download_, file_paths)
-
-
-def http_download(url, path):
-    with request.urlopen(url) as f:
-        with open(path, "wb") as fout:
-            buf = f.read(1024)
-            while buf:
-                fout.write(buf)
-                buf = f.read(1024)
+def download(downloader, manifest, paths):
+    """
+    Download the files from the manifest, and raise an exception if any of them failed.
+    """
+    downloaded, skipped, failed = downloader.download(manifest, paths)
+
+    if len(failed) > 0:
+        raise IOError(f"failed to download {len(failed)} files ({', '.join(failed[:5])})")
 
 
 def log_counts(values):
@@ -99,7 +56,6 @@ if __name__ == '__main__':
                         format='%(asctime)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
 
     args = parse_args()
-    bucket = "open-images-dataset"
     
     # split the --class_names argument into an array
     class_names = [e.strip() for e in args.class_names.split(",")]
@@ -109,13 +65,16 @@ if __name__ == '__main__':
     if not os.path.exists(args.root):
         os.makedirs(args.root)
 
+    # the manifest keeps track of the files that were downloaded, so that it can be resumed
+    manifest = DownloadManifest(os.path.join(args.root, "download-manifest.json"))
+    downloader = Downloader(args.root, num_workers=args.num_workers, retry=args.retry,
+                            verify=args.verify, s3_endpoint=args.s3_endpoint)
+                            
     # download the class description list
     class_description_file = os.path.join(args.root, "class-descriptions-boxable.csv")
     
-    if not os.path.isfile(class_description_file):
-        url = "https://storage.googleapis.com/openimages/2018_04/class-descriptions-boxable.csv"
-        logging.warning(f"Download {url}.")
-        http_download(url, class_description_file)
+    manifest.add("class-descriptions-boxable.csv", f"{args.annotations_url}/class-descriptions-boxable.csv")
+    download(downloader, manifest, ["class-descriptions-boxable.csv"])
 
     # load the class descriptions and filter by the requested classes
     class_descriptions = pd.read_csv(class_description_file, names=["id", "ClassName"])
@@ -134,8 +93,17 @@ if __name__ == '__main__':
                 
         raise Exception("Couldn't find classes '{:s}' in the Open Images dataset.  Please confirm that the --class_names argument contains valid classes.".format(','.join(missing_classes)))
         
-    # download and parse the annotations
+    # download the annotations for train/val/test
     dataset_types = ["train", "validation", "test"]
+    annotation_files = []
+    
+    for dataset_type in dataset_types:
+        annotation_files.append(f"{dataset_type}-annotations-bbox.csv")
+        manifest.add(annotation_files[-1], f"{args.annotations_url}/{dataset_type}/{annotation_files[-1]}")
+        
+    download(downloader, manifest, annotation_files)
+    
+    # parse the annotations
     annotations = {}
     images = {}
     
@@ -144,14 +112,7 @@ if __name__ == '__main__':
         image_dir = os.path.join(args.root, dataset_type)
         os.makedirs(image_dir, exist_ok=True)
 
-        # download the annotations for train/val/test
         annotation_file = f"{args.root}/{dataset_type}-annotations-bbox.csv"
-        
-        if not os.path.exists(annotation_file):
-            url = f"https://storage.googleapis.com/openimages/2018_04/{dataset_type}/{dataset_type}-annotations-bbox.csv"
-            logging.warning(f"Download {url}.")
-            http_download(url, annotation_file)
-            
         logging.warning(f"Read annotation file {annotation_file}")
         
         # parse the annotations and filter by the class names
@@ -202,7 +163,7 @@ if __name__ == '__main__':
                 limited_images.append(class_images)
                 limited_annotations.append(class_annotations)
                 
-            images[d] = np.concatenate(limited_images)
+            images[d] = pd.unique(np.concatenate(limited_images))  # images with multiple classes can be in several lists
             annotations[d] = pd.concat(limited_annotations)
             
         total_images, total_annotations = get_totals(dataset_types, images, annotations)
@@ -228,16 +189,24 @@ if __name__ == '__main__':
     if args.stats_only:
         sys.exit(0)
         
-    # save our selected annotations and build the image list
+    # save our selected annotations and add the images to the manifest
     image_files = []
     
     for dataset_type in dataset_types:
         sub_annotation_file = f"{args.root}/sub-{dataset_type}-annotations-bbox.csv"
         logging.warning(f"Saving '{dataset_type}' data to {sub_annotation_file}.")
         annotations[dataset_type].to_csv(sub_annotation_file, index=False)
-        image_files.extend(f"{dataset_type}/{id}.jpg" for id in images[dataset_type])
         
+        for id in images[dataset_type]:
+            path = f"{dataset_type}/{id}.jpg"
+            manifest.add(path, f"s3://{args.bucket}/{path}")
+            image_files.append(path)
+            
+    manifest.save()
+    
     logging.warning(f"Starting to download {len(image_files)} images.")
-    batch_download(bucket, image_files, args.root, args.num_workers, args.retry)
+    downloaded, skipped, failed = downloader.download(manifest, image_files)
+    
+    logging.warning(f"Downloaded {len(downloaded)} images, skipped {len(skipped)} that were already downloaded, {len(failed)} failed.")
     logging.warning("Task Done.")
     
\ No newline at end of file
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+#
+# pack a Pascal VOC or Open Images dataset into large shard files that can be read
+# sequentially with memory mapping (use it with train_ssd.py --dataset-type=packed)
+#
+import os
+import sys
+import cv2
+import logging
+import argparse
+import numpy as np
+
+from PIL import Image
+
+from vision.datasets.voc_dataset import VOCDataset
+from vision.datasets.open_images import OpenImagesDataset
+from vision.datasets.packed_dataset import ShardWriter
+
+
+parser = argparse.ArgumentParser(description='Pack a detection dataset into shards for training with train_ssd.py')
+
+parser.add_argument("--dataset-type", default="open_images", type=str,
+                    help='Specify dataset type. Currently supports voc and open_images.')
+parser.add_argument('--data', '--dataset', type=str, default='data', help='Dataset directory path')
+parser.add_argument('--output', type=str, required=True, help='Directory to save the packed dataset to')
+parser.add_argument('--resize', type=int, default=0,
+                    help='Downscale the images so that their longest side is at most this many pixels (0 to keep the original images)')
+parser.add_argument('--quality', type=int, default=90, help='The JPEG quality of the resized images (1-100)')
+parser.add_argument('--shard-size', type=int, default=256, help='The max size of each shard file (in MB)')
+parser.add_argument('--no-shuffle', action='store_true', help="Keep the images in their original order instead of shuffling them")
+parser.add_argument('--seed', type=int, default=0, help='The random seed used for shuffling the images')
+
+args = parser.parse_args()
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                    format='%(asctime)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
+
+
+def voc_images(root, is_test):
+    """
+    Yield (image_id, image_file, image_size, boxes, labels, is_difficult) for a VOC image set
+    """
+    dataset = VOCDataset(root, is_test=is_test, keep_difficult=True)
+
+    for index in range(len(dataset)):
+        image_id, (boxes, labels, is_difficult) = dataset.get_annotation(index)
+        image_file = os.path.join(root, 'JPEGImages', dataset.image_files[index])
+        yield image_id, image_file, dataset.get_image_size(index), boxes, labels, is_difficult
+
+
+def open_images(dataset, class_names):
+    """
+    Yield (image_id, image_file, image_size, boxes, labels, is_difficult) for an Open Images split,
+    with the labels remapped to the given class names (the splits can have different classes)
+    """
+    class_dict = {class_name: i for i, class_name in enumerate(class_names)}
+    class_map = np.array([class_dict.get(class_name, -1) for class_name in dataset.class_names], dtype=np.int64)
+
+    for info in dataset.data:
+        labels = class_map[info['labels']]
+
+        if np.all(labels < 0):
+            continue
+
+        image_file = os.path.join(dataset.root, dataset.dataset_type, info['image_id'] + '.jpg')
+
+        with Image.open(image_file) as image:
+            width, height = image.size
+
+        boxes = info['boxes'] * np.array([width, height, width, height], dtype=np.float32)  # the boxes are relative
+        yield info['image_id'], image_file, (height, width), boxes[labels >= 0], labels[labels >= 0], None
+
+
+def encode_image(image_file, image_size, boxes):
+    """
+    Return the encoded image (downscaled if needed), along with its size and the scaled boxes
+    """
+    height, width = image_size
+    scale = args.resize / max(height, width) if args.resize > 0 else 1.0
+
+    if scale >= 1.0:
+        with open(image_file, 'rb') as file:
+            return file.read(), image_size, boxes
+
+    image = cv2.imread(image_file, cv2.IMREAD_COLOR)
+
+    if image is None:
+        raise IOError(f"invalid/corrupt image {image_file}")
+
+    height, width = image.shape[:2]
+    resized = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+    image = cv2.resize(image, resized, interpolation=cv2.INTER_AREA)
+
+    ok, data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, args.quality])
+
+    if not ok:
+        raise IOError(f"failed to encode image {image_file}")
+
+    boxes = boxes * np.array([resized[0] / width, resized[1] / height] * 2, dtype=np.float32)
+    return data.tobytes(), (resized[1], resized[0]), boxes
+
+
+def pack(dataset_type, images, class_names):
+    """
+    Write the images of one split to the packed dataset
+    """
+    images = list(images)
+
+    if not args.no_shuffle:
+        images = [images[i] for i in np.random.default_rng(args.seed).permutation(len(images))]
+
+    logging.info(f"packing {len(images)} {dataset_type} images to {args.output}")
+
+    with ShardWriter(args.output, dataset_type, class_names, shard_size=args.shard_size * 1024 * 1024) as writer:
+        for n, (image_id, image_file, image_size, boxes, labels, is_difficult) in enumerate(images):
+            data, image_size, boxes = encode_image(image_file, image_size, boxes)
+            writer.write(image_id, data, image_size, boxes, labels, is_difficult)
+
+            if n % 1000 == 0:
+                logging.info(f"packed {n} / {len(images)} {dataset_type} images")
+
+
+# pack each of the splits that the dataset has
+if args.dataset_type == 'voc':
+    class_names = VOCDataset(args.data, is_test=False).class_names
+
+    pack('train', voc_images(args.data, is_test=False), class_names)
+    pack('test', voc_images(args.data, is_test=True), class_names)
+
+elif args.dataset_type == 'open_images':
+    class_names = None
+
+    for dataset_type in ('train', 'validation', 'test'):
+        if not os.path.isfile(os.path.join(args.data, f"sub-{dataset_type}-annotations-bbox.csv")):
+            logging.warning(f"skipping the {dataset_type} split (missing sub-{dataset_type}-annotations-bbox.csv)")
+            continue
+
+        subset = OpenImagesDataset(args.data, dataset_type=dataset_type)
+
+        if class_names is None:
+            class_names = subset.class_names   # use the classes from the first split (normally train)
+
+        pack(dataset_type, open_images(subset, class_names), class_names)
+
+else:
+    raise ValueError(f"Dataset type {args.dataset_type} is not supported.")
+
+logging.info(f"saved packed dataset to {args.output}")
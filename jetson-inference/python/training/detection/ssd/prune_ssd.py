@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+#
+# prune the channels of a trained SSD model in rounds (fine-tuning it in-between), and report
+# the parameters, FLOPs, CPU latency, and mAP after each round to pick the speed/accuracy tradeoff
+#
+import os
+import sys
+import copy
+import logging
+import argparse
+import torch
+
+from torch.utils.data import DataLoader, ConcatDataset
+
+from vision.utils.misc import store_labels
+from vision.ssd.ssd import MatchPrior
+from vision.ssd.vgg_ssd import create_vgg_ssd
+from vision.ssd.mobilenetv1_ssd import create_mobilenetv1_ssd
+from vision.ssd.mobilenetv1_ssd_lite import create_mobilenetv1_ssd_lite
+from vision.ssd.mobilenet_v2_ssd_lite import create_mobilenetv2_ssd_lite
+from vision.ssd.squeezenet_ssd_lite import create_squeezenet_ssd_lite
+from vision.datasets.voc_dataset import VOCDataset
+from vision.datasets.open_images import OpenImagesDataset
+from vision.datasets.packed_dataset import PackedDataset
+from vision.nn.multibox_loss import MultiboxLoss
+from vision.ssd.config import vgg_ssd_config
+from vision.ssd.config import mobilenetv1_ssd_config
+from vision.ssd.config import squeezenet_ssd_config
+from vision.ssd.data_preprocessing import TrainAugmentation
+from vision.prunning.channel_prunner import ChannelPrunner, count_parameters, count_flops, measure_latency
+
+from eval_ssd import MeanAPEvaluator
+
+
+parser = argparse.ArgumentParser(description='Prune the channels of a trained SSD model')
+
+parser.add_argument("--dataset-type", default="open_images", type=str,
+                    help='Specify dataset type. Currently supports voc, open_images, and packed (see pack_dataset.py).')
+parser.add_argument('--datasets', '--data', nargs='+', default=["data"], help='Dataset directory path')
+parser.add_argument('--net', default="mb1-ssd",
+                    help="The network architecture, it can be mb1-ssd, mb1-ssd-lite, mb2-ssd-lite or vgg16-ssd.")
+parser.add_argument('--resolution', type=int, default=300,
+                    help="the NxN pixel resolution of the model (can be changed for mb1-ssd only)")
+parser.add_argument('--model', '--input', type=str, required=True, help='The trained model checkpoint (.pth) to prune')
+parser.add_argument('--checkpoint-folder', '--model-dir', default='models/',
+                    help='Directory for saving the pruned models and the report')
+
+# Params for pruning
+parser.add_argument('--rounds', default=5, type=int, help='The number of pruning rounds')
+parser.add_argument('--prune-ratio', default=0.1, type=float,
+                    help='The fraction of the original prunable channels to remove in each round')
+parser.add_argument('--min-channels', default=0.25, type=float,
+                    help='The minimum fraction of the original channels to keep in each layer')
+parser.add_argument('--round-to', default=8, type=int,
+                    help='Keep the number of channels in each layer a multiple of this (for faster kernels)')
+parser.add_argument('--rank-batches', default=32, type=int,
+                    help='The number of batches used to estimate the importance of the channels')
+
+# Params for fine-tuning
+parser.add_argument('--finetune-epochs', default=1, type=int, help='The number of epochs to fine-tune after each round')
+parser.add_argument('--lr', '--learning-rate', default=0.001, type=float, help='The learning rate for fine-tuning')
+parser.add_argument('--momentum', default=0.9, type=float, help='Momentum value for optim')
+parser.add_argument('--weight-decay', default=5e-4, type=float, help='Weight decay for SGD')
+parser.add_argument('--batch-size', default=4, type=int, help='Batch size for training')
+parser.add_argument('--num-workers', '--workers', default=2, type=int, help='Number of workers used in dataloading')
+parser.add_argument('--debug-steps', default=10, type=int, help='Set the debug log output frequency.')
+
+# Params for the report
+parser.add_argument('--latency-threads', default=4, type=int,
+                    help='The number of CPU threads used to measure the latency (the Jetson Nano has 4 cores)')
+parser.add_argument('--latency-runs', default=50, type=int, help='The number of runs to measure the latency over')
+parser.add_argument('--no-onnx', action='store_true', help="Don't export the pruned models to ONNX")
+parser.add_argument('--use-cuda', default=True, action='store_true', help='Use CUDA to fine-tune the model')
+
+args = parser.parse_args()
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                    format='%(asctime)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
+
+DEVICE = torch.device("cuda:0" if torch.cuda.is_available() and args.use_cuda else "cpu")
+
+
+def rank(loader, net, criterion, prunner, device, num_batches):
+    """
+    Accumulate the importance of the channels from the loss gradients over a number of batches.
+    """
+    net.train(True)
+    prunner.reset_importance()
+
+    for i, (images, boxes, labels) in enumerate(loader):
+        if i >= num_batches:
+            break
+
+        net.zero_grad()
+        confidence, locations = net(images.to(device))
+        regression_loss, classification_loss = criterion(confidence, locations, labels.to(device), boxes.to(device))
+        (regression_loss + classification_loss).backward()
+        prunner.accumulate_importance()
+
+    net.zero_grad()
+
+
+def finetune(loader, net, criterion, optimizer, device, debug_steps=100, epoch=-1):
+    """
+    Fine-tune the pruned model for an epoch, and return the average loss.
+    """
+    net.train(True)
+    total_loss = torch.zeros(1, device=device)
+    running_loss = torch.zeros(1, device=device)
+
+    for i, (images, boxes, labels) in enumerate(loader):
+        optimizer.zero_grad()
+        confidence, locations = net(images.to(device))
+        regression_loss, classification_loss = criterion(confidence, locations, labels.to(device), boxes.to(device))
+        loss = regression_loss + classification_loss
+        loss.backward()
+        optimizer.step()
+
+        total_loss += loss.detach()
+        running_loss += loss.detach()
+
+        if i and i % debug_steps == 0:
+            logging.info(f"Fine-tune Epoch: {epoch}, Step: {i}/{len(loader)}, Avg Loss: {running_loss.item() / debug_steps:.4f}")
+            running_loss.zero_()
+
+    return total_loss.item() / max(len(loader), 1)
+
+
+def cpu_copy(net):
+    """
+    Return a copy of the model on the CPU, that outputs the scores and boxes (like when it's deployed)
+    """
+    cpu_net = copy.deepcopy(net, memo={id(net.config): net.config}).cpu()  # the config is a module (which can't be copied)
+    cpu_net.priors = cpu_net.priors.cpu()
+    cpu_net.is_test = True
+    cpu_net.eval()
+    return cpu_net
+
+
+def measure(net, prunner, evaluator, config, round):
+    """
+    Return the report row for the model - the channels, parameters, FLOPs, CPU latency, and mAP.
+    """
+    input_size = (1, 3, config.image_size, config.image_size)
+    cpu_net = cpu_copy(net)
+
+    threads = torch.get_num_threads()
+    torch.set_num_threads(args.latency_threads)
+    latency = measure_latency(cpu_net, input_size, runs=args.latency_runs)
+    torch.set_num_threads(threads)
+
+    mean_ap, _ = evaluator.compute()
+
+    return {
+        'round': round,
+        'channels': sum(prunner.num_channels(group) for group in prunner.groups),
+        'params (M)': count_parameters(net) / 1e6,
+        'GFLOPs': count_flops(cpu_net, input_size) / 1e9,
+        'latency (ms)': latency,
+        'mAP': mean_ap
+    }
+
+
+def log_report(rows):
+    """
+    Print the report table (with the change of each round relative to the original model), and save it to CSV.
+    """
+    columns = list(rows[0].keys())
+    table = [columns]
+
+    for row in rows:
+        cells = [str(row['round']), str(row['channels'])]
+        for column in columns[2:]:
+            change = (row[column] / rows[0][column] - 1) * 100 if rows[0][column] else 0.0
+            cells.append(f"{row[column]:.3f} ({change:+.1f}%)")
+        table.append(cells)
+
+    widths = [max(len(cells[i]) for cells in table) for i in range(len(columns))]
+    lines = [' | '.join(cell.rjust(width) for cell, width in zip(cells, widths)) for cells in table]
+    lines.insert(1, '-+-'.join('-' * width for width in widths))
+
+    logging.info("Pruning report:\n\n" + '\n'.join(lines) + '\n')
+
+    with open(os.path.join(args.checkpoint_folder, 'pruning-report.csv'), 'w') as file:
+        file.write(','.join(columns) + '\n')
+        for row in rows:
+            file.write(','.join(str(row[column]) for column in columns) + '\n')
+
+
+def export_onnx(net, config, path):
+    """
+    Export the model to ONNX (the same as onnx_export.py)
+    """
+    cpu_net = cpu_copy(net)
+
+    try:
+        torch.onnx.export(cpu_net, torch.randn(1, 3, config.image_size, config.image_size), path,
+                          input_names=['input_0'], output_names=['scores', 'boxes'])
+        logging.info(f"Exported ONNX model {path}")
+    except Exception as error:
+        logging.warning(f"Failed to export ONNX model {path} ({error})")
+
+
+if __name__ == '__main__':
+    logging.info(args)
+
+    if args.checkpoint_folder:
+        args.checkpoint_folder = os.path.expanduser(args.checkpoint_folder)
+        os.makedirs(args.checkpoint_folder, exist_ok=True)
+
+    # select the network architecture and config
+    if args.net == 'vgg16-ssd':
+        create_net = create_vgg_ssd
+        config = vgg_ssd_config
+    elif args.net == 'mb1-ssd':
+        create_net = create_mobilenetv1_ssd
+        config = mobilenetv1_ssd_config
+        config.set_image_size(args.resolution)
+    elif args.net == 'mb1-ssd-lite':
+        create_net = create_mobilenetv1_ssd_lite
+        config = mobilenetv1_ssd_config
+    elif args.net == 'sq-ssd-lite':
+        create_net = create_squeezenet_ssd_lite
+        config = squeezenet_ssd_config
+    elif args.net == 'mb2-ssd-lite':
+        create_net = create_mobilenetv2_ssd_lite
+        config = mobilenetv1_ssd_config
+    else:
+        logging.fatal("The net type is wrong.")
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    # load the datasets (the train split for ranking/fine-tuning, and the test split for mAP)
+    train_transform = TrainAugmentation(config.image_size, config.image_mean, config.image_std)
+    target_transform = MatchPrior(config.priors, config.center_variance, config.size_variance, 0.5)
+    datasets = []
+
+    for dataset_path in args.datasets:
+        if args.dataset_type == 'voc':
+            dataset = VOCDataset(dataset_path, transform=train_transform, target_transform=target_transform)
+        elif args.dataset_type == 'open_images':
+            dataset = OpenImagesDataset(dataset_path, transform=train_transform,
+                                        target_transform=target_transform, dataset_type="train")
+        elif args.dataset_type == 'packed':
+            dataset = PackedDataset(dataset_path, transform=train_transform,
+                                    target_transform=target_transform, dataset_type="train")
+        else:
+            raise ValueError(f"Dataset type {args.dataset_type} is not supported.")
+        datasets.append(dataset)
+
+    class_names = datasets[0].class_names
+    store_labels(os.path.join(args.checkpoint_folder, "labels.txt"), class_names)
+
+    train_loader = DataLoader(ConcatDataset(datasets), args.batch_size,
+                              num_workers=args.num_workers, shuffle=True)
+
+    if args.dataset_type == "voc":
+        eval_dataset = VOCDataset(dataset_path, is_test=True)
+    elif args.dataset_type == 'open_images':
+        eval_dataset = OpenImagesDataset(dataset_path, dataset_type="test")
+    elif args.dataset_type == 'packed':
+        eval_dataset = PackedDataset(dataset_path, dataset_type="test")
+
+    # load the model
+    net = create_net(len(class_names))
+    net.load(args.model)
+    net.to(DEVICE)
+
+    logging.info(f"Loaded model {args.model}")
+
+    criterion = MultiboxLoss(config.priors, iou_threshold=0.5, neg_pos_ratio=3,
+                             center_variance=0.1, size_variance=0.2, device=DEVICE)
+
+    evaluator = MeanAPEvaluator(eval_dataset, net, arch=args.net, eval_dir=os.path.join(args.checkpoint_folder, 'eval_results'),
+                                device=DEVICE, batch_size=args.batch_size, num_workers=args.num_workers)
+
+    prunner = ChannelPrunner(net, concrete_args={'get_feature_map_size': False},
+                             round_to=args.round_to, min_channels=args.min_channels)
+
+    logging.info(f"Found {len(prunner.groups)} prunable channel groups ({sum(prunner.original_channels)} channels)")
+
+    # the channels of these layers get saved with the model, so that SSD.load() can resize them
+    net.pruned_layers = sorted(set(net.pruned_layers or []) | {name for group in prunner.groups for name, kind in group.members})
+
+    rows = [measure(net, prunner, evaluator, config, 0)]
+    log_report(rows)
+
+    # prune and fine-tune the model in rounds
+    for round in range(1, args.rounds + 1):
+        rank(train_loader, net, criterion, prunner, DEVICE, args.rank_batches)
+        num_pruned = prunner.prune(args.prune_ratio)
+
+        logging.info(f"Round {round}: pruned {num_pruned} channels")
+
+        # the pruned layers have new parameters, so the optimizer needs to be re-created
+        optimizer = torch.optim.SGD(net.parameters(), lr=args.lr, momentum=args.momentum,
+                                    weight_decay=args.weight_decay)
+
+        for epoch in range(args.finetune_epochs):
+            loss = finetune(train_loader, net, criterion, optimizer, DEVICE, debug_steps=args.debug_steps, epoch=epoch)
+            logging.info(f"Round {round}, Fine-tune Epoch: {epoch}, Training Loss: {loss:.4f}")
+
+        rows.append(measure(net, prunner, evaluator, config, round))
+        log_report(rows)
+
+        model_path = os.path.join(args.checkpoint_folder, f"{args.net}-pruned-{round}.pth")
+        net.save(model_path)
+        logging.info(f"Saved model {model_path}")
+
+        if not args.no_onnx:
+            export_onnx(net, config, os.path.join(args.checkpoint_folder, f"{args.net}-pruned-{round}.onnx"))
+
+    logging.info("Task done, exiting program.")
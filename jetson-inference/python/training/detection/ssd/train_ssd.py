@@ -15,7 +15,7 @@ from torch.utils.data import DataLoader, ConcatDataset
 from torch.utils.tensorboard import SummaryWriter
 from torch.optim.lr_scheduler import CosineAnnealingLR, MultiStepLR
 
-from vision.utils.misc import Timer, freeze_net_layers, store_labels
+from vision.utils.misc import Timer, freeze_net_layers, store_labels, loader_args, train_step
 from vision.ssd.ssd import MatchPrior
 from vision.ssd.vgg_ssd import create_vgg_ssd
 from vision.ssd.mobilenetv1_ssd import create_mobilenetv1_ssd
@@ -24,11 +24,14 @@ from vision.ssd.mobilenet_v2_ssd_lite import create_mobilenetv2_ssd_lite
 from vision.ssd.squeezenet_ssd_lite import create_squeezenet_ssd_lite
 from vision.datasets.voc_dataset import VOCDataset
 from vision.datasets.open_images import OpenImagesDataset
+from vision.datasets.packed_dataset import PackedDataset, ShardSampler
+from vision.datasets.collation import padded_detection_collate, batch_augmentation_collate
 from vision.nn.multibox_loss import MultiboxLoss
 from vision.ssd.config import vgg_ssd_config
 from vision.ssd.config import mobilenetv1_ssd_config
 from vision.ssd.config import squeezenet_ssd_config
 from vision.ssd.data_preprocessing import TrainAugmentation, TestTransform
+from vision.transforms.batch_transforms import BatchTrainAugmentation
 
 from eval_ssd import MeanAPEvaluator
 
@@ -41,10 +44,16 @@ parser = argparse.ArgumentParser(
 
 # Params for datasets
 parser.add_argument("--dataset-type", default="open_images", type=str,
-                    help='Specify dataset type. Currently supports voc and open_images.')
+                    help='Specify dataset type. Currently supports voc, open_images, and packed (see pack_dataset.py).')
 parser.add_argument('--datasets', '--data', nargs='+', default=["data"], help='Dataset directory path')
 parser.add_argument('--balance-data', action='store_true',
                     help="Balance training data by down-sampling more frequent labels.")
+parser.add_argument('--batch-matching', action='store_true',
+                    help="Match the ground truth boxes to the priors for whole batches on the training device, instead of per-image in the data loader workers")
+parser.add_argument('--batch-augmentation', action='store_true',
+                    help="Apply the training augmentations to whole batches on the training device, instead of per-image in the data loader workers (implies --batch-matching)")
+parser.add_argument('--rebuild-index', action='store_true',
+                    help="Rebuild the cached annotations index of VOC datasets (needed after editing annotations in-place)")
 
 # Params for network
 parser.add_argument('--net', default="mb1-ssd",
@@ -96,6 +105,10 @@ parser.add_argument('--num-epochs', '--epochs', default=30, type=int,
                     help='the number epochs')
 parser.add_argument('--num-workers', '--workers', default=2, type=int,
                     help='Number of workers used in dataloading')
+parser.add_argument('--prefetch-factor', default=2, type=int,
+                    help='Number of batches loaded in advance by each worker')
+parser.add_argument('--amp', action='store_true',
+                    help='Use automatic mixed precision (FP16) training on CUDA')
 parser.add_argument('--validation-epochs', default=1, type=int,
                     help='the number epochs between running validation')
 parser.add_argument('--validation-mean-ap', action='store_true',
@@ -123,59 +136,37 @@ if args.use_cuda and torch.cuda.is_available():
     logging.info("Using CUDA...")
 
 
-def train(loader, net, criterion, optimizer, device, debug_steps=100, epoch=-1):
+def train(loader, net, criterion, optimizer, device, debug_steps=100, epoch=-1, matcher=None, augmentation=None, scaler=None):
     net.train(True)
     
-    train_loss = 0.0
-    train_regression_loss = 0.0
-    train_classification_loss = 0.0
-    
-    running_loss = 0.0
-    running_regression_loss = 0.0
-    running_classification_loss = 0.0
+    # the losses are accumulated on the device as (loss, regression loss, classification loss),
+    # so that they only need to be synced with the CPU when they get logged
+    train_loss = torch.zeros(3, device=device)
+    running_loss = torch.zeros(3, device=device)
     
     num_batches = 0
     
     for i, data in enumerate(loader):
         images, boxes, labels = data
-        images = images.to(device)
-        boxes = boxes.to(device)
-        labels = labels.to(device)
-
-        optimizer.zero_grad()
-        confidence, locations = net(images)
-        regression_loss, classification_loss = criterion(confidence, locations, labels, boxes)
-        loss = regression_loss + classification_loss
-        loss.backward()
-        optimizer.step()
-
-        train_loss += loss.item()
-        train_regression_loss += regression_loss.item()
-        train_classification_loss += classification_loss.item()
         
-        running_loss += loss.item()
-        running_regression_loss += regression_loss.item()
-        running_classification_loss += classification_loss.item()
+        losses = train_step(net, criterion, optimizer, images, boxes, labels, device,
+                            matcher=matcher, augmentation=augmentation, scaler=scaler)
+        train_loss += losses
+        running_loss += losses
 
         if i and i % debug_steps == 0:
-            avg_loss = running_loss / debug_steps
-            avg_reg_loss = running_regression_loss / debug_steps
-            avg_clf_loss = running_classification_loss / debug_steps
+            avg_loss, avg_reg_loss, avg_clf_loss = (running_loss / debug_steps).tolist()
             logging.info(
                 f"Epoch: {epoch}, Step: {i}/{len(loader)}, " +
                 f"Avg Loss: {avg_loss:.4f}, " +
                 f"Avg Regression Loss {avg_reg_loss:.4f}, " +
                 f"Avg Classification Loss: {avg_clf_loss:.4f}"
             )
-            running_loss = 0.0
-            running_regression_loss = 0.0
-            running_classification_loss = 0.0
+            running_loss.zero_()
 
         num_batches += 1
         
-    train_loss /= num_batches
-    train_regression_loss /= num_batches
-    train_classification_loss /= num_batches
+    train_loss, train_regression_loss, train_classification_loss = (train_loss / num_batches).tolist()
     
     logging.info(
         f"Epoch: {epoch}, " +
@@ -188,29 +179,28 @@ def train(loader, net, criterion, optimizer, device, debug_steps=100, epoch=-1):
     tensorboard.add_scalar('Regression Loss/train', train_regression_loss, epoch)
     tensorboard.add_scalar('Classification Loss/train', train_classification_loss, epoch)
 
-def test(loader, net, criterion, device):
+def test(loader, net, criterion, device, matcher=None, amp=False):
     net.eval()
-    running_loss = 0.0
-    running_regression_loss = 0.0
-    running_classification_loss = 0.0
+    running_loss = torch.zeros(3, device=device)
     num = 0
     for _, data in enumerate(loader):
         images, boxes, labels = data
-        images = images.to(device)
-        boxes = boxes.to(device)
-        labels = labels.to(device)
+        images = images.to(device, non_blocking=True)
+        boxes = boxes.to(device, non_blocking=True)
+        labels = labels.to(device, non_blocking=True)
+        
+        if matcher is not None:
+            boxes, labels = matcher.match_batch(boxes, labels)
         num += 1
 
-        with torch.no_grad():
+        with torch.no_grad(), torch.autocast(device.type, enabled=amp):
             confidence, locations = net(images)
-            regression_loss, classification_loss = criterion(confidence, locations, labels, boxes)
+            regression_loss, classification_loss = criterion(confidence.float(), locations.float(), labels, boxes)
             loss = regression_loss + classification_loss
 
-        running_loss += loss.item()
-        running_regression_loss += regression_loss.item()
-        running_classification_loss += classification_loss.item()
+        running_loss += torch.stack([loss, regression_loss, classification_loss])
     
-    return running_loss / num, running_regression_loss / num, running_classification_loss / num
+    return tuple((running_loss / num).tolist())
 
 
 if __name__ == '__main__':
@@ -248,10 +238,27 @@ if __name__ == '__main__':
         sys.exit(1)
         
     # create data transforms for train/test/val
-    train_transform = TrainAugmentation(config.image_size, config.image_mean, config.image_std)
+    if args.batch_augmentation:
+        augmentation = BatchTrainAugmentation(config.image_size, config.image_mean, config.image_std)
+        train_transform = augmentation.load  # only resize the images in the data loader
+        args.batch_matching = True
+    else:
+        augmentation = None
+        train_transform = TrainAugmentation(config.image_size, config.image_mean, config.image_std)
+        
     target_transform = MatchPrior(config.priors, config.center_variance,
                                   config.size_variance, 0.5)
 
+    if args.batch_matching:
+        matcher = target_transform  # match the priors in the training loop instead of the data loader
+        target_transform = None
+        collate_fn = padded_detection_collate
+        train_collate_fn = batch_augmentation_collate if args.batch_augmentation else collate_fn
+    else:
+        matcher = None
+        collate_fn = None
+        train_collate_fn = None
+
     test_transform = TestTransform(config.image_size, config.image_mean, config.image_std)
 
     # load datasets (could be multiple)
@@ -260,7 +267,7 @@ if __name__ == '__main__':
     for dataset_path in args.datasets:
         if args.dataset_type == 'voc':
             dataset = VOCDataset(dataset_path, transform=train_transform,
-                                 target_transform=target_transform)
+                                 target_transform=target_transform, rebuild_index=args.rebuild_index)
             label_file = os.path.join(args.checkpoint_folder, "labels.txt")
             store_labels(label_file, dataset.class_names)
             num_classes = len(dataset.class_names)
@@ -273,6 +280,13 @@ if __name__ == '__main__':
             logging.info(dataset)
             num_classes = len(dataset.class_names)
 
+        elif args.dataset_type == 'packed':
+            dataset = PackedDataset(dataset_path, transform=train_transform,
+                                    target_transform=target_transform, dataset_type="train")
+            label_file = os.path.join(args.checkpoint_folder, "labels.txt")
+            store_labels(label_file, dataset.class_names)
+            num_classes = len(dataset.class_names)
+
         else:
             raise ValueError(f"Dataset type {args.dataset_type} is not supported.")
         datasets.append(dataset)
@@ -281,25 +295,40 @@ if __name__ == '__main__':
     logging.info(f"Stored labels into file {label_file}.")
     train_dataset = ConcatDataset(datasets)
     logging.info("Train dataset size: {}".format(len(train_dataset)))
+    
+    if args.dataset_type == 'packed':
+        train_sampler = ShardSampler(train_dataset)  # shuffle by shard and then by record, to keep the reads sequential
+    else:
+        train_sampler = None
+        
+    # keep the workers alive between epochs, and load the batches into pinned memory for async copies
+    data_loader_args = loader_args(DEVICE, args.num_workers, args.prefetch_factor)
+        
     train_loader = DataLoader(train_dataset, args.batch_size,
-                              num_workers=args.num_workers,
-                              shuffle=True)
+                              shuffle=train_sampler is None,
+                              sampler=train_sampler,
+                              collate_fn=train_collate_fn,
+                              **data_loader_args)
                            
     # create validation dataset                           
     logging.info("Prepare Validation datasets.")
     if args.dataset_type == "voc":
         val_dataset = VOCDataset(dataset_path, transform=test_transform,
-                                 target_transform=target_transform, is_test=True)
+                                 target_transform=target_transform, is_test=True, rebuild_index=args.rebuild_index)
     elif args.dataset_type == 'open_images':
         val_dataset = OpenImagesDataset(dataset_path,
                                         transform=test_transform, target_transform=target_transform,
                                         dataset_type="test")
         logging.info(val_dataset)
+    elif args.dataset_type == 'packed':
+        val_dataset = PackedDataset(dataset_path, transform=test_transform,
+                                    target_transform=target_transform, dataset_type="test")
     logging.info("Validation dataset size: {}".format(len(val_dataset)))
 
     val_loader = DataLoader(val_dataset, args.batch_size,
-                            num_workers=args.num_workers,
-                            shuffle=False)
+                            shuffle=False,
+                            collate_fn=collate_fn,
+                            **data_loader_args)
                       
     # create the network
     logging.info("Build network.")
@@ -313,7 +342,10 @@ if __name__ == '__main__':
             eval_dataset = VOCDataset(dataset_path, is_test=True)
         elif args.dataset_type == 'open_images':
             eval_dataset = OpenImagesDataset(dataset_path, dataset_type="test")
-        eval = MeanAPEvaluator(eval_dataset, net, arch=args.net, eval_dir=os.path.join(args.checkpoint_folder, 'eval_results'))
+        elif args.dataset_type == 'packed':
+            eval_dataset = PackedDataset(dataset_path, dataset_type="test")
+        eval = MeanAPEvaluator(eval_dataset, net, arch=args.net, eval_dir=os.path.join(args.checkpoint_folder, 'eval_results'),
+                               batch_size=args.batch_size, num_workers=args.num_workers)
         
     # freeze certain layers (if requested)
     base_net_lr = args.base_net_lr if args.base_net_lr is not None else args.lr
@@ -385,6 +417,13 @@ if __name__ == '__main__':
     logging.info(f"Learning rate: {args.lr}, Base net learning rate: {base_net_lr}, "
                  + f"Extra Layers learning rate: {extra_layers_lr}.")
 
+    # enable mixed precision (if requested)
+    if args.amp and DEVICE.type != 'cuda':
+        logging.warning("--amp is only supported with CUDA, training in FP32")
+        args.amp = False
+        
+    scaler = torch.cuda.amp.GradScaler() if args.amp else None
+    
     # set learning rate policy
     if args.scheduler == 'multi-step':
         logging.info("Uses MultiStepLR scheduler.")
@@ -403,11 +442,11 @@ if __name__ == '__main__':
     logging.info(f"Start training from epoch {last_epoch + 1}.")
     
     for epoch in range(last_epoch + 1, args.num_epochs):
-        train(train_loader, net, criterion, optimizer, device=DEVICE, debug_steps=args.debug_steps, epoch=epoch)
+        train(train_loader, net, criterion, optimizer, device=DEVICE, debug_steps=args.debug_steps, epoch=epoch, matcher=matcher, augmentation=augmentation, scaler=scaler)
         scheduler.step()
         
         if epoch % args.validation_epochs == 0 or epoch == args.num_epochs - 1:
-            val_loss, val_regression_loss, val_classification_loss = test(val_loader, net, criterion, DEVICE)
+            val_loss, val_regression_loss, val_classification_loss = test(val_loader, net, criterion, DEVICE, matcher, amp=args.amp)
             
             logging.info(
                 f"Epoch: {epoch}, " +
@@ -28,4 +28,32 @@ def object_detection_collate(batch):
             gt_labels.append(labels)
         else:
             raise TypeError(f"Labels should be tensor or np.ndarray, but got {label_type}.")
-    return torch.stack(images), gt_boxes, gt_labels
\ No newline at end of file
+    return torch.stack(images), gt_boxes, gt_labels
+
+
+def padded_detection_collate(batch):
+    """
+    Collate the images into a batch, along with the ground truth boxes and labels padded to the
+    max number of boxes in the batch - gt_boxes (batch_size, num_targets, 4) and gt_labels
+    (batch_size, num_targets), where the padding has label 0 (i.e. BACKGROUND).
+    """
+    images, gt_boxes, gt_labels = object_detection_collate(batch)
+    num_targets = max([len(labels) for labels in gt_labels] + [1])
+    padded_boxes = torch.zeros(len(batch), num_targets, 4, dtype=torch.float32)
+    padded_labels = torch.zeros(len(batch), num_targets, dtype=torch.int64)
+    for i, (boxes, labels) in enumerate(zip(gt_boxes, gt_labels)):
+        padded_boxes[i, :len(labels)] = boxes
+        padded_labels[i, :len(labels)] = labels
+    return images, padded_boxes, padded_labels
+
+
+def batch_augmentation_collate(batch):
+    """
+    Collate the samples from BatchTrainAugmentation.load into ((images, image_sizes), gt_boxes, gt_labels),
+    where the images are uint8 (batch_size, 3, H, W), the image sizes are the original (height, width),
+    and the boxes and labels are padded like padded_detection_collate.
+    """
+    images = torch.stack([image for (image, image_size), boxes, labels in batch])
+    image_sizes = torch.tensor([image_size for (image, image_size), boxes, labels in batch], dtype=torch.float32)
+    _, gt_boxes, gt_labels = padded_detection_collate([(image, boxes, labels) for (image, image_size), boxes, labels in batch])
+    return (images, image_sizes), gt_boxes, gt_labels
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import os
+import json
+import numpy as np
+
+
+INDEX_VERSION = 1
+INDEX_MAGIC = b'SSDINDEX'
+
+
+def write_index(path, header, arrays):
+    """
+    Save an index file:  the magic, the length of the JSON header, the header (with the
+    layout of the arrays added to it), and then the raw arrays (8-byte aligned).
+    """
+    header = dict(header, version=INDEX_VERSION, arrays=[])
+    offset = 0
+
+    for array in arrays:
+        header['arrays'].append({'dtype': array.dtype.str, 'shape': array.shape, 'offset': offset})
+        offset += (array.nbytes + 7) // 8 * 8
+
+    header = json.dumps(header).encode()
+    header += b' ' * (-len(header) % 8)
+
+    with open(path + '.tmp', 'wb') as file:
+        file.write(INDEX_MAGIC)
+        file.write(np.uint64(len(header)).tobytes())
+        file.write(header)
+
+        for array in arrays:
+            file.write(np.ascontiguousarray(array).tobytes())
+            file.write(b'\0' * (-array.nbytes % 8))
+
+    os.replace(path + '.tmp', path)
+
+
+def read_index(path):
+    """
+    Memory-map an index file, and return its header and arrays.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+
+    if data[:8].tobytes() != INDEX_MAGIC:
+        raise IOError(f"{path} isn't an index file")
+
+    header_size = int(data[8:16].view(np.uint64)[0])
+    header = json.loads(data[16:16+header_size].tobytes())
+
+    if header['version'] != INDEX_VERSION:
+        raise IOError(f"{path} has version {header['version']} (expected version {INDEX_VERSION})")
+
+    arrays = []
+
+    for array in header['arrays']:
+        dtype = np.dtype(array['dtype'])
+        count = int(np.prod(array['shape']))
+        offset = 16 + header_size + array['offset']
+        arrays.append(data[offset:offset + count * dtype.itemsize].view(dtype).reshape(array['shape']))
+
+    return header, arrays
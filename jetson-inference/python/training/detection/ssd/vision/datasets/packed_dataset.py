@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+import os
+import cv2
+import torch
+import logging
+import numpy as np
+
+from .index import read_index, write_index
+
+
+class PackedDataset(torch.utils.data.Dataset):
+    """
+    Object detection dataset that was packed with pack_dataset.py
+
+    The encoded images are stored back-to-back in large shard files, which get memory-mapped
+    and decoded straight from the mapping - so reading a sample doesn't need to open a file.
+    The annotations and the location of each image in the shards are kept in an index file:
+
+        <root>/<dataset_type>.index
+        <root>/<dataset_type>-00000.shard
+        <root>/<dataset_type>-00001.shard
+        ...
+
+    The boxes are stored in absolute pixel coordinates of the packed images (like VOCDataset).
+    """
+    def __init__(self, root, transform=None, target_transform=None, dataset_type='train', keep_difficult=False):
+        """
+        Parameters:
+            root (string) -- the directory that the dataset was packed to
+            dataset_type (string) -- the split to load (e.g. train, validation, test)
+            keep_difficult (bool) -- if false, the objects that are marked as difficult are skipped
+        """
+        self.root = root
+        self.transform = transform
+        self.target_transform = target_transform
+        self.dataset_type = dataset_type.lower()
+        self.keep_difficult = keep_difficult
+
+        index_path = os.path.join(self.root, f"{self.dataset_type}.index")
+
+        if not os.path.isfile(index_path):
+            raise IOError(f"missing packed dataset index {index_path}")
+
+        header, arrays = read_index(index_path)
+
+        if header.get('format') != 'packed':
+            raise IOError(f"{index_path} isn't a packed dataset index")
+
+        self.ids = header['ids']
+        self.class_names = tuple(header['class_names'])
+        self.class_dict = {class_name: i for i, class_name in enumerate(self.class_names)}
+        self.shard_files = [os.path.join(self.root, shard) for shard in header['shards']]
+        self.records, self.offsets, self.image_sizes, self.boxes, self.labels, self.is_difficult = arrays
+        self.shards = [None] * len(self.shard_files)   # these get mapped on first use (in each worker)
+
+        logging.info(f"loaded packed dataset {index_path} ({len(self.ids)} images, {len(self.shard_files)} shards)")
+
+    def __getitem__(self, index):
+        boxes, labels, is_difficult = self._get_annotation(index)
+
+        if not self.keep_difficult:
+            boxes = boxes[is_difficult == 0]
+            labels = labels[is_difficult == 0]
+
+        image = self._read_image(index)
+
+        if self.transform:
+            image, boxes, labels = self.transform(image, boxes, labels)
+        if self.target_transform:
+            boxes, labels = self.target_transform(boxes, labels)
+
+        return image, boxes, labels
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shards'] = [None] * len(self.shard_files)   # re-map the shards instead of pickling them
+        return state
+
+    def get_image(self, index):
+        image = self._read_image(index)
+        if self.transform:
+            image, _ = self.transform(image)
+        return image
+
+    def get_annotation(self, index):
+        return self.ids[index], self._get_annotation(index)
+
+    def get_image_size(self, index):
+        """
+        Return the (height, width) of an image, without loading it.
+        """
+        return tuple(self.image_sizes[index].tolist())
+
+    def get_shard_records(self):
+        """
+        Return a list with the indexes of the records in each shard (in the order they're stored).
+        """
+        return np.split(np.arange(len(self.ids)), np.flatnonzero(np.diff(self.records[:, 0])) + 1)
+
+    def _get_annotation(self, index):
+        begin, end = self.offsets[index], self.offsets[index+1]
+
+        # copy them out of the index, because the transforms modify them in-place
+        return (np.array(self.boxes[begin:end]),
+                np.array(self.labels[begin:end]),
+                np.array(self.is_difficult[begin:end]))
+
+    def _read_image(self, index):
+        shard, offset, size = self.records[index].tolist()
+
+        if self.shards[shard] is None:
+            self.shards[shard] = np.memmap(self.shard_files[shard], dtype=np.uint8, mode='r')
+
+        image = cv2.imdecode(self.shards[shard][offset:offset+size], cv2.IMREAD_COLOR)
+
+        if image is None:
+            raise IOError(f"invalid/corrupt image {self.ids[index]} in {self.shard_files[shard]}")
+
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class ShardSampler(torch.utils.data.Sampler):
+    """
+    Sampler that shuffles the order of the shards and the order of the records within each shard,
+    so that the reads stay local to one shard at a time instead of seeking all over the dataset.
+
+    The dataset can be a PackedDataset, or a ConcatDataset of them.
+    """
+    def __init__(self, dataset, shuffle=True, seed=0):
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.blocks = []
+
+        datasets = dataset.datasets if isinstance(dataset, torch.utils.data.ConcatDataset) else [dataset]
+        offset = 0
+
+        for subset in datasets:
+            self.blocks.extend([records + offset for records in subset.get_shard_records()])
+            offset += len(subset)
+
+        self.num_samples = offset
+
+    def __iter__(self):
+        if not self.shuffle:
+            return iter(range(self.num_samples))
+
+        rng = np.random.default_rng((self.seed, self.epoch))
+        self.epoch += 1
+
+        blocks = [rng.permutation(self.blocks[block]) for block in rng.permutation(len(self.blocks))]
+        return iter(np.concatenate(blocks).tolist() if blocks else [])
+
+    def __len__(self):
+        return self.num_samples
+
+
+class ShardWriter:
+    """
+    Writes encoded images and their annotations to a packed dataset (see PackedDataset)
+    """
+    def __init__(self, root, dataset_type, class_names, shard_size=256*1024*1024):
+        """
+        Parameters:
+            root (string) -- the directory to write the dataset to
+            dataset_type (string) -- the name of the split (e.g. train, validation, test)
+            class_names (list[string]) -- the class names (including BACKGROUND)
+            shard_size (int) -- the number of bytes after which a new shard gets started
+        """
+        self.root = root
+        self.dataset_type = dataset_type.lower()
+        self.class_names = list(class_names)
+        self.shard_size = shard_size
+
+        self.ids = []
+        self.shards = []
+        self.records = []
+        self.offsets = [0]
+        self.image_sizes = []
+        self.boxes = []
+        self.labels = []
+        self.is_difficult = []
+
+        self.file = None
+
+        os.makedirs(self.root, exist_ok=True)
+
+    def write(self, image_id, data, image_size, boxes, labels, is_difficult=None):
+        """
+        Add an image to the dataset.
+
+        Parameters:
+            image_id (string) -- the ID of the image
+            data (bytes) -- the encoded image (JPEG or PNG)
+            image_size (tuple) -- the (height, width) of the image
+            boxes (np.ndarray) -- (N, 4) boxes in absolute pixel coordinates
+            labels (np.ndarray) -- (N) class indexes
+            is_difficult (np.ndarray) -- (N) difficult flags (or None if there aren't any)
+        """
+        if self.file is None or self.file.tell() + len(data) > self.shard_size:
+            self.next_shard()
+
+        self.records.append((len(self.shards) - 1, self.file.tell(), len(data)))
+        self.file.write(data)
+
+        if is_difficult is None:
+            is_difficult = np.zeros(len(labels), dtype=np.uint8)
+
+        self.ids.append(image_id)
+        self.image_sizes.append(image_size)
+        self.boxes.append(np.asarray(boxes, dtype=np.float32).reshape(-1, 4))
+        self.labels.append(np.asarray(labels, dtype=np.int64))
+        self.is_difficult.append(np.asarray(is_difficult, dtype=np.uint8))
+        self.offsets.append(self.offsets[-1] + len(labels))
+
+    def next_shard(self):
+        """
+        Close the current shard file and start a new one.
+        """
+        if self.file is not None:
+            self.file.close()
+
+        self.shards.append(f"{self.dataset_type}-{len(self.shards):05d}.shard")
+        self.file = open(os.path.join(self.root, self.shards[-1]), 'wb')
+
+    def close(self):
+        """
+        Close the last shard and write the index.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        header = {
+            'format': 'packed',
+            'ids': self.ids,
+            'class_names': self.class_names,
+            'shards': self.shards
+        }
+
+        arrays = (np.array(self.records, dtype=np.int64).reshape(-1, 3),
+                  np.array(self.offsets, dtype=np.int64),
+                  np.array(self.image_sizes, dtype=np.int32).reshape(-1, 2),
+                  np.concatenate(self.boxes) if self.boxes else np.zeros((0, 4), dtype=np.float32),
+                  np.concatenate(self.labels) if self.labels else np.zeros(0, dtype=np.int64),
+                  np.concatenate(self.is_difficult) if self.is_difficult else np.zeros(0, dtype=np.uint8))
+
+        write_index(os.path.join(self.root, f"{self.dataset_type}.index"), header, arrays)
+        logging.info(f"packed {len(self.ids)} images into {len(self.shards)} shards under {self.root}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
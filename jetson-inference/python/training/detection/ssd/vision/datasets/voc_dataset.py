@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import os
+import json
+import hashlib
 import logging
 
 import torch
@@ -8,12 +10,14 @@ import xml.etree.ElementTree as ET
 
 from PIL import Image
 
+from .index import read_index, write_index
+
 
 class VOCDataset(torch.utils.data.Dataset):
     """
     Object detection dataset for Pascal VOC (http://host.robots.ox.ac.uk/pascal/VOC/)
     """
-    def __init__(self, root, transform=None, target_transform=None, is_test=False, keep_difficult=False, label_file=None):
+    def __init__(self, root, transform=None, target_transform=None, is_test=False, keep_difficult=False, label_file=None, cache_annotations=True, rebuild_index=False):
         """
         Dataset for VOC data.
         
@@ -24,6 +28,14 @@ class VOCDataset(torch.utils.data.Dataset):
             is_test (bool) -- if true, then use the data subset from `ImageSets/Main/test.txt`
                               if false, then use the data subset from `ImageSets/Main/trainval.txt`
                               if these files don't exist, then `ImageSets/Main/default.txt` will be used
+                              
+            cache_annotations (bool) -- if true, the parsed annotations get saved to a binary index file under
+                                        the root directory, which gets memory-mapped the next time the dataset
+                                        is loaded (it's rebuilt if the image set or labels change, or if files get
+                                        added/removed in the Annotations or JPEGImages directories)
+                                        
+            rebuild_index (bool) -- if true, the cached index is ignored and rebuilt (use this after editing
+                                    annotations in-place, because that doesn't change the directory mtimes)
         """
         self.root = root
         self.transform = transform
@@ -43,8 +55,6 @@ class VOCDataset(torch.utils.data.Dataset):
             else:
                 raise IOError(f"missing ImageSet file {image_sets_file}")
 
-        # read the image set ID's
-        self.ids = self._read_image_ids(image_sets_file)
         self.keep_difficult = keep_difficult
 
         # if the labels file exists, read in the class names
@@ -76,9 +86,12 @@ class VOCDataset(torch.utils.data.Dataset):
 
         self.class_dict = {class_name: i for i, class_name in enumerate(self.class_names)}
 
+        # load the annotations index for the image set
+        self._load_index(image_sets_file, cache_annotations, rebuild_index)
+
     def __getitem__(self, index):
         image_id = self.ids[index]
-        boxes, labels, is_difficult = self._get_annotation(image_id)
+        boxes, labels, is_difficult = self._get_annotation(index)
         
         if not self.keep_difficult:
             boxes = boxes[is_difficult == 0]
@@ -87,7 +100,7 @@ class VOCDataset(torch.utils.data.Dataset):
         if logging.root.level is logging.DEBUG:
             logging.debug(f"voc_dataset image_id={image_id}" + ' \n    boxes=' + str(boxes) + ' \n    labels=' + str(labels))
 
-        image = self._read_image(image_id)
+        image = self._read_image(index)
         
         if self.transform:
             image, boxes, labels = self.transform(image, boxes, labels)
@@ -97,45 +110,165 @@ class VOCDataset(torch.utils.data.Dataset):
         return image, boxes, labels
 
     def get_image(self, index):
-        image_id = self.ids[index]
-        image = self._read_image(image_id)
+        image = self._read_image(index)
         if self.transform:
             image, _ = self.transform(image)
         return image
 
     def get_annotation(self, index):
-        image_id = self.ids[index]
-        return image_id, self._get_annotation(image_id)
+        return self.ids[index], self._get_annotation(index)
+
+    def get_image_size(self, index):
+        """
+        Return the (height, width) of an image, without loading it.
+        """
+        return tuple(self.image_sizes[index].tolist())
 
     def __len__(self):
         return len(self.ids)
 
+    INDEX_VERSION = 1
+
+    def _load_index(self, image_sets_file, cache_annotations=True, rebuild_index=False):
+        """
+        Load the annotations index (boxes, labels, difficult flags, image files, and image sizes) for the
+        image set, either by memory-mapping the cached index file or by parsing the XML annotations.
+        """
+        ids = self._read_image_ids(image_sets_file)
+
+        cache_path = os.path.join(self.root, f".{os.path.splitext(os.path.basename(image_sets_file))[0]}.index")
+        cache_key = self._index_key(ids)
+
+        if cache_annotations and not rebuild_index and self._read_index(cache_path, cache_key):
+            logging.info(f"loaded annotations index from {cache_path} ({len(self.ids)} images, {len(self.labels)} boxes)")
+            return
+
+        header, arrays = self._build_index(ids)
+
+        self.ids = header['ids']
+        self.image_files = header['image_files']
+        self.offsets, self.image_sizes, self.boxes, self.labels, self.is_difficult = arrays
+
+        if cache_annotations:
+            self._write_index(cache_path, cache_key, header, arrays)
+
     def _read_image_ids(self, image_sets_file):
         ids = []
         with open(image_sets_file) as f:
             for line in f:
                 image_id = line.rstrip()
-                
+
                 if len(image_id) <= 0:
                     print('warning - found empty line in {:s}, skipping line'.format(str(image_sets_file)))
                     continue
-                    
-                if self._get_num_annotations(image_id) > 0:
-                    if self._find_image(image_id) is not None:
-                        ids.append(line.rstrip())
-                    else:
-                        print('warning - could not find image {:s} - ignoring from dataset'.format(image_id))
-                else:
-                    print('warning - image {:s} has no box/labels annotations, ignoring from dataset'.format(image_id))
-                    
+
+                ids.append(image_id)
+
         return ids
 
-    def _get_num_annotations(self, image_id):
-        annotation_file = os.path.join(self.root, f'Annotations/{image_id}.xml')
-        objects = ET.parse(annotation_file).findall("object")
-        return len(objects)
-        
-    def _get_annotation(self, image_id):
+    def _index_key(self, ids):
+        """
+        Hash the state that the index depends on - the image set, class names, and the mtimes of the
+        annotations and images directories.  Only the directories get stat'd (not every annotation), so
+        files that get edited in-place (rather than replaced) need rebuild_index to be picked up.
+        """
+        key = hashlib.sha1()
+        key.update(json.dumps([self.INDEX_VERSION, ids, self.class_names]).encode())
+
+        for subdir in ('Annotations', 'JPEGImages'):
+            path = os.path.join(self.root, subdir)
+            if os.path.isdir(path):
+                key.update(f"{subdir} {os.stat(path).st_mtime_ns}\n".encode())
+
+        return key.hexdigest()
+
+    def _build_index(self, ids):
+        """
+        Parse the annotations of the image set, and return the index header and arrays.
+        """
+        logging.info(f"parsing annotations for {len(ids)} images under {self.root}")
+
+        header = {'ids': [], 'image_files': []}
+        offsets = [0]
+        image_sizes = []
+        boxes = []
+        labels = []
+        is_difficult = []
+
+        for image_id in ids:
+            annotation = self._parse_annotation(image_id)
+
+            if len(annotation[1]) == 0:
+                print('warning - image {:s} has no box/labels annotations, ignoring from dataset'.format(image_id))
+                continue
+
+            image_file = self._find_image(image_id)
+
+            if image_file is None:
+                print('warning - could not find image {:s} - ignoring from dataset'.format(image_id))
+                continue
+
+            with Image.open(image_file) as image:
+                image_sizes.append((image.height, image.width))
+
+            header['ids'].append(image_id)
+            header['image_files'].append(os.path.basename(image_file))
+
+            boxes.append(annotation[0])
+            labels.append(annotation[1])
+            is_difficult.append(annotation[2])
+            offsets.append(offsets[-1] + len(annotation[1]))
+
+        arrays = (np.array(offsets, dtype=np.int64),
+                  np.array(image_sizes, dtype=np.int32).reshape(-1, 2),
+                  np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype=np.float32),
+                  np.concatenate(labels) if labels else np.zeros(0, dtype=np.int64),
+                  np.concatenate(is_difficult) if is_difficult else np.zeros(0, dtype=np.uint8))
+
+        return header, arrays
+
+    def _write_index(self, path, key, header, arrays):
+        """
+        Save the index to a binary file (see vision/datasets/index.py for the format)
+        """
+        try:
+            write_index(path, dict(header, key=key), arrays)
+            logging.info(f"saved annotations index to {path}")
+        except OSError as error:
+            logging.warning(f"failed to save annotations index to {path} ({error})")
+
+    def _read_index(self, path, key):
+        """
+        Memory-map the index file, returning false if it doesn't exist or is out of date.
+        """
+        if not os.path.isfile(path):
+            return False
+
+        try:
+            header, arrays = read_index(path)
+        except (OSError, ValueError, KeyError) as error:
+            logging.warning(f"failed to load annotations index from {path} ({error})")
+            return False
+
+        if header.get('key') != key:
+            logging.info(f"annotations index {path} is out of date")
+            return False
+
+        self.ids = header['ids']
+        self.image_files = header['image_files']
+        self.offsets, self.image_sizes, self.boxes, self.labels, self.is_difficult = arrays
+
+        return True
+
+    def _get_annotation(self, index):
+        begin, end = self.offsets[index], self.offsets[index+1]
+
+        # copy them out of the index, because the transforms modify them in-place
+        return (np.array(self.boxes[begin:end]),
+                np.array(self.labels[begin:end]),
+                np.array(self.is_difficult[begin:end]))
+
+    def _parse_annotation(self, image_id):
         annotation_file = os.path.join(self.root, f'Annotations/{image_id}.xml')
         objects = ET.parse(annotation_file).findall("object")
         boxes = []
@@ -167,7 +300,7 @@ class VOCDataset(torch.utils.data.Dataset):
             else:
                 print(f"warning - image {image_id} has object with unknown class '{class_name}'")
 
-        return (np.array(boxes, dtype=np.float32),
+        return (np.array(boxes, dtype=np.float32).reshape(-1, 4),
                 np.array(labels, dtype=np.int64),
                 np.array(is_difficult, dtype=np.uint8))
 
@@ -182,12 +315,9 @@ class VOCDataset(torch.utils.data.Dataset):
             
         return None
         
-    def _read_image(self, image_id):
-        image_file = self._find_image(image_id)
+    def _read_image(self, index):
+        image_file = os.path.join(self.root, 'JPEGImages', self.image_files[index])
         
-        if image_file is None:
-            raise IOError(f"failed to find {image_file}")
-            
         image = Image.open(image_file).convert('RGB')
         
         if image is None or image.size == 0:
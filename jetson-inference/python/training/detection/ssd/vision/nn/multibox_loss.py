@@ -37,11 +37,11 @@ class MultiboxLoss(nn.Module):
             loss = -F.log_softmax(confidence, dim=2)[:, :, 0]
             mask = box_utils.hard_negative_mining(loss, labels, self.neg_pos_ratio)
 
-        confidence = confidence[mask, :]
-        classification_loss = F.cross_entropy(confidence.reshape(-1, num_classes), labels[mask], size_average=False)
+        # mask the losses instead of indexing the selected priors, which would sync with the device
+        classification_loss = F.cross_entropy(confidence.reshape(-1, num_classes), labels.reshape(-1), reduction='none')
+        classification_loss = torch.where(mask.reshape(-1), classification_loss, torch.zeros_like(classification_loss)).sum()
         pos_mask = labels > 0
-        predicted_locations = predicted_locations[pos_mask, :].reshape(-1, 4)
-        gt_locations = gt_locations[pos_mask, :].reshape(-1, 4)
-        smooth_l1_loss = F.smooth_l1_loss(predicted_locations, gt_locations, size_average=False)
-        num_pos = gt_locations.size(0)
+        smooth_l1_loss = F.smooth_l1_loss(predicted_locations, gt_locations, reduction='none').sum(dim=2)
+        smooth_l1_loss = torch.where(pos_mask, smooth_l1_loss, torch.zeros_like(smooth_l1_loss)).sum()
+        num_pos = pos_mask.sum()
         return smooth_l1_loss/num_pos, classification_loss/num_pos
@@ -0,0 +1,313 @@
+import time
+import logging
+import operator
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.fx
+
+
+# modules and functions that operate on each channel independently (so they don't change the channels)
+CHANNELWISE_MODULES = (nn.ReLU, nn.ReLU6, nn.LeakyReLU, nn.Hardswish, nn.Sigmoid, nn.Dropout, nn.Dropout2d,
+                       nn.MaxPool2d, nn.AvgPool2d, nn.Identity)
+CHANNELWISE_FUNCTIONS = (F.relu, F.relu6, torch.relu, torch.sigmoid, F.max_pool2d, F.avg_pool2d, F.dropout)
+ELEMENTWISE_FUNCTIONS = (operator.add, operator.iadd, operator.mul, torch.add, torch.mul)
+
+
+class ChannelGroup:
+    """
+    A set of channels that are coupled across layers, and have to be pruned together - the output
+    channels of the convs that produce them, the batch norms and depthwise convs that they pass
+    through, and the input channels of the convs that consume them.  Convs whose outputs get added
+    together (like residual connections) end up in the same group.
+    """
+    def __init__(self):
+        self.members = []     # (module name, kind) where kind is 'out', 'in', 'depthwise', or 'bn'
+        self.blocked = False  # true if the channels reach an op that prevents them from being pruned
+
+    @property
+    def producers(self):
+        return [name for name, kind in self.members if kind == 'out']
+
+    def __repr__(self):
+        return f"ChannelGroup({', '.join(f'{name}:{kind}' for name, kind in self.members)})"
+
+
+class ChannelPrunner:
+    """
+    Structured channel pruning, that removes whole channels from the coupled layers of a model
+    (so the pruned model is smaller and faster, without needing sparse kernels).
+
+    The model gets traced with torch.fx to find the channel groups, and the channels are ranked
+    by the first-order Taylor estimate of their contribution to the loss (summed over the weights
+    of all the layers in each group), which is described in https://arxiv.org/abs/1906.10771
+    The lowest ranked channels across the whole model then get removed at once.
+    """
+    def __init__(self, model, concrete_args=None, round_to=8, min_channels=0.25):
+        """
+        Parameters:
+            model (nn.Module) -- the model to prune (which gets modified in-place)
+            concrete_args (dict) -- the non-tensor arguments to trace the model's forward() with
+            round_to (int) -- keep the number of channels in each group a multiple of this
+            min_channels (float) -- the minimum fraction of each group's original channels to keep
+        """
+        self.model = model
+        self.concrete_args = concrete_args
+        self.round_to = round_to
+        self.min_channels = min_channels
+        self.groups = self.trace()
+        self.original_channels = [self.num_channels(group) for group in self.groups]
+        self.importance = None
+
+    def trace(self):
+        """
+        Trace the model, and return the channel groups that can be pruned.
+        """
+        graph = torch.fx.symbolic_trace(self.model, concrete_args=self.concrete_args).graph
+        parents = {}   # union-find of the groups (for ops that merge them)
+        spaces = {}    # the group of each node's output channels
+
+        def find(group):
+            while parents.get(group, group) is not group:
+                group = parents[group]
+            return group
+
+        def union(groups):
+            root = find(groups[0])
+            for group in groups[1:]:
+                group = find(group)
+                if group is not root:
+                    root.members.extend(group.members)
+                    root.blocked |= group.blocked
+                    parents[group] = root
+            return root
+
+        def new_group(blocked=False):
+            group = ChannelGroup()
+            group.blocked = blocked
+            return group
+
+        def input_groups(node):
+            return [find(spaces[arg]) for arg in node.all_input_nodes if arg in spaces]
+
+        for node in graph.nodes:
+            inputs = input_groups(node)
+
+            if node.op == 'call_module':
+                module = self.model.get_submodule(node.target)
+
+                if isinstance(module, nn.Conv2d) and len(inputs) == 1:
+                    if module.groups == 1:
+                        inputs[0].members.append((node.target, 'in'))
+                        group = new_group()
+                        group.members.append((node.target, 'out'))
+                        spaces[node] = group
+                    elif module.groups == module.in_channels == module.out_channels:
+                        inputs[0].members.append((node.target, 'depthwise'))
+                        spaces[node] = inputs[0]
+                    else:
+                        inputs[0].blocked = True
+                        spaces[node] = new_group(blocked=True)
+                elif isinstance(module, nn.BatchNorm2d) and len(inputs) == 1:
+                    inputs[0].members.append((node.target, 'bn'))
+                    spaces[node] = inputs[0]
+                elif isinstance(module, CHANNELWISE_MODULES) and len(inputs) == 1:
+                    spaces[node] = inputs[0]
+                else:
+                    self.block(inputs)
+                    spaces[node] = new_group(blocked=True)
+            elif node.op == 'call_function' and node.target in CHANNELWISE_FUNCTIONS and len(inputs) == 1:
+                spaces[node] = inputs[0]
+            elif node.op == 'call_function' and node.target in ELEMENTWISE_FUNCTIONS and len(inputs) > 0:
+                spaces[node] = union(inputs)   # the channels of the inputs have to line up
+            else:
+                self.block(inputs)
+                spaces[node] = new_group(blocked=True)
+
+        groups = []
+
+        for group in {id(find(group)): find(group) for group in spaces.values()}.values():
+            if not group.blocked and len(group.producers) > 0:
+                groups.append(group)
+
+        return groups
+
+    @staticmethod
+    def block(groups):
+        for group in groups:
+            group.blocked = True
+
+    def num_channels(self, group):
+        return self.model.get_submodule(group.producers[0]).out_channels
+
+    def reset_importance(self):
+        self.importance = [torch.zeros(self.num_channels(group)) for group in self.groups]
+
+    def accumulate_importance(self):
+        """
+        Add the Taylor importance of each channel, from the gradients of the last backward pass.
+        """
+        if self.importance is None:
+            self.reset_importance()
+
+        for group, importance in zip(self.groups, self.importance):
+            taylor = 0
+
+            for name, kind in group.members:
+                module = self.model.get_submodule(name)
+                dim = 1 if kind == 'in' else 0
+
+                for param in (module.weight, module.bias):
+                    if param is None or param.grad is None:
+                        continue
+                    if param is module.bias and kind == 'in':
+                        continue
+                    taylor = taylor + (param * param.grad).detach().transpose(0, dim).reshape(param.size(dim), -1).sum(dim=1)
+
+            if torch.is_tensor(taylor):
+                importance += taylor.float().pow(2).cpu()
+
+    def prune(self, ratio):
+        """
+        Remove the given fraction of the prunable channels, with the lowest importance across all the
+        groups (which gets normalized within each group).  Returns the number of channels removed.
+        """
+        if self.importance is None:
+            raise RuntimeError("the channel importance needs to be accumulated before pruning")
+
+        candidates = []
+
+        for index, (group, importance) in enumerate(zip(self.groups, self.importance)):
+            importance = importance / (importance.norm() + 1e-12)
+            candidates.extend((value, index, channel) for channel, value in enumerate(importance.tolist()))
+
+        num_prune = int(ratio * sum(self.original_channels))
+        removals = [[] for _ in self.groups]
+
+        for value, index, channel in sorted(candidates):
+            if num_prune <= 0:
+                break
+
+            num_channels = len(self.importance[index]) - len(removals[index])
+            min_channels = max(int(self.original_channels[index] * self.min_channels), self.round_to, 1)
+
+            if num_channels - 1 < min_channels:
+                continue
+
+            removals[index].append(channel)
+            num_prune -= 1
+
+        num_removed = 0
+
+        for group, importance, removed in zip(self.groups, self.importance, removals):
+            # keep a multiple of round_to channels (by pruning fewer of them)
+            num_keep = len(importance) - len(removed)
+            num_keep = min(-(-num_keep // self.round_to) * self.round_to, len(importance))
+            removed = removed[:len(importance) - num_keep]
+
+            if len(removed) == 0:
+                continue
+
+            mask = torch.ones(len(importance), dtype=torch.bool)
+            mask[removed] = False
+            keep = torch.nonzero(mask).squeeze(1)
+
+            self.prune_group(group, keep)
+            num_removed += len(removed)
+
+        self.importance = None
+        return num_removed
+
+    def prune_group(self, group, keep):
+        """
+        Keep only the given channels of a group, in all of its layers.
+        """
+        for name, kind in group.members:
+            module = self.model.get_submodule(name)
+            index = keep.to(next(module.buffers(), next(module.parameters(), None)).device)
+
+            if kind == 'in':
+                module.weight = nn.Parameter(module.weight.data.index_select(1, index).clone())
+                module.in_channels = len(keep)
+                continue
+
+            if module.weight is not None:
+                module.weight = nn.Parameter(module.weight.data.index_select(0, index).clone())
+            if module.bias is not None:
+                module.bias = nn.Parameter(module.bias.data.index_select(0, index).clone())
+
+            if kind == 'out':
+                module.out_channels = len(keep)
+            elif kind == 'depthwise':
+                module.in_channels = module.out_channels = module.groups = len(keep)
+            elif kind == 'bn':
+                module.running_mean = module.running_mean.index_select(0, index).clone()
+                module.running_var = module.running_var.index_select(0, index).clone()
+                module.num_features = len(keep)
+
+        logging.debug(f"pruned {group} to {len(keep)} channels")
+
+
+def count_parameters(model):
+    """
+    Return the number of parameters in a model.
+    """
+    return sum(param.numel() for param in model.parameters())
+
+
+def count_flops(model, input_size):
+    """
+    Return the number of FLOPs (2x the multiply-accumulates) of the convolution and linear layers
+    for one forward pass with the given input size, e.g. (1, 3, 300, 300)
+    """
+    flops = []
+
+    def hook(module, input, output):
+        if isinstance(module, nn.Conv2d):
+            kernel_size = module.kernel_size[0] * module.kernel_size[1] * module.in_channels // module.groups
+            flops.append(2 * output.numel() * kernel_size)
+        elif isinstance(module, nn.Linear):
+            flops.append(2 * output.numel() * module.in_features)
+
+    handles = [module.register_forward_hook(hook) for module in model.modules() if isinstance(module, (nn.Conv2d, nn.Linear))]
+    device = next(model.parameters()).device
+    training = model.training
+
+    try:
+        model.eval()
+        with torch.no_grad():
+            model(torch.zeros(input_size, device=device))
+    finally:
+        model.train(training)
+        for handle in handles:
+            handle.remove()
+
+    return sum(flops)
+
+
+def measure_latency(model, input_size, runs=50, warmup=5):
+    """
+    Return the median latency (in milliseconds) of the model's forward pass with the given input size.
+    """
+    device = next(model.parameters()).device
+    input = torch.randn(input_size, device=device)
+    training = model.training
+    latencies = []
+
+    model.eval()
+
+    with torch.no_grad():
+        for n in range(warmup + runs):
+            start = time.perf_counter()
+            model(input)
+
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    model.train(training)
+
+    latencies = sorted(latencies[warmup:])
+    return latencies[len(latencies) // 2]
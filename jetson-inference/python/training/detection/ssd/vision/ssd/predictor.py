@@ -25,7 +25,6 @@ class Predictor:
         self.timer = Timer()
 
     def predict(self, image, top_k=-1, prob_threshold=None):
-        cpu_device = torch.device("cpu")
         height, width, _ = image.shape
         
         image  = self.transform(image)
@@ -39,13 +38,92 @@ class Predictor:
             scores, boxes = self.net.forward(images)
             #print("Inference time: ", self.timer.end())
             
-        boxes = boxes[0]
-        scores = scores[0]
+        return self.postprocess(scores[0], boxes[0], width, height, top_k, prob_threshold)
+        
+    def predict_batch(self, images, top_k=-1, prob_threshold=None, sizes=None):
+        """
+        Run detection on a batch of images, and return a list of (boxes, labels, probs) for each image.
+        
+        The images can either be a list of HxWxC numpy arrays (which get transformed here), or
+        a (N, C, H, W) tensor that was already transformed (for example by a DataLoader using
+        PredictionDataset), in which case the original (height, width) of each image are in sizes.
+        """
+        if sizes is None:
+            sizes = [image.shape[:2] for image in images]
+            images = torch.stack([self.transform(image) for image in images])
+            
+        images = images.to(self.device)
+        
+        self.net.eval()
+        
+        with torch.no_grad():
+            self.timer.start()
+            scores, boxes = self.net.forward(images)
+            
+        return self.postprocess_batch(scores, boxes, sizes, top_k, prob_threshold)
+        
+    def postprocess_batch(self, scores, boxes, sizes, top_k=-1, prob_threshold=None):
+        """
+        Apply postprocess() to a batch of (N, num_priors, num_classes) scores and (N, num_priors, 4) boxes,
+        where sizes is the (height, width) of each image.  With hard NMS, the whole batch gets one NMS call.
+        """
+        cpu_device = torch.device("cpu")
+        
+        if self.nms_method == "soft":
+            return [self.postprocess(scores[n], boxes[n], int(width), int(height), top_k, prob_threshold)
+                    for n, (height, width) in enumerate(sizes)]
+                    
+        if not prob_threshold:
+            prob_threshold = self.filter_threshold
+            
+        num_images, _, num_classes = scores.shape
+        
+        # offset the labels of each image so that boxes from different images get suppressed separately
+        image_indexes, box_indexes, labels = (scores[:, :, 1:] > prob_threshold).nonzero(as_tuple=True)
+        labels = labels + 1
+        probs = scores[image_indexes, box_indexes, labels]
+        boxes = boxes[image_indexes, box_indexes]
+        
+        picked = box_utils.batched_hard_nms(boxes, probs, image_indexes * num_classes + labels,
+                                            iou_threshold=self.iou_threshold,
+                                            top_k=top_k,
+                                            candidate_size=self.candidate_size)
+        
+        # the picked boxes are ordered by image, then by class
+        image_indexes = image_indexes[picked]
+        sizes = torch.as_tensor(sizes, dtype=boxes.dtype, device=boxes.device).reshape(num_images, 2)
+        scale = sizes[image_indexes][:, [1, 0, 1, 0]]
+        
+        boxes = (boxes[picked] * scale).to(cpu_device)
+        labels = labels[picked].to(cpu_device)
+        probs = probs[picked].to(cpu_device)
+        counts = torch.bincount(image_indexes, minlength=num_images).tolist()
+        
+        results = []
+        
+        for image_boxes, image_labels, image_probs in zip(boxes.split(counts), labels.split(counts), probs.split(counts)):
+            if image_boxes.size(0) == 0:
+                results.append((torch.tensor([]), torch.tensor([]), torch.tensor([])))
+            else:
+                results.append((image_boxes, image_labels, image_probs))
+                
+        return results
+        
+    def postprocess(self, scores, boxes, width, height, top_k=-1, prob_threshold=None):
+        """
+        Filter the boxes of one image by probability and apply NMS, returning (boxes, labels, probs)
+        where the boxes are scaled to the image size.
+        """
+        cpu_device = torch.device("cpu")
         
         if not prob_threshold:
             prob_threshold = self.filter_threshold
             
-        # this version of nms is slower on GPU, so we move data to CPU.
+        if self.nms_method != "soft":
+            # batched NMS over all the classes at once (this runs on the same device as the model)
+            return self.postprocess_batch(scores.unsqueeze(0), boxes.unsqueeze(0), [(height, width)], top_k, prob_threshold)[0]
+            
+        # soft-nms is slower on GPU, so we move data to CPU.
         boxes = boxes.to(cpu_device)
         scores = scores.to(cpu_device)
         picked_box_probs = []
@@ -80,3 +158,20 @@ class Predictor:
         picked_box_probs[:, 3] *= height
         
         return picked_box_probs[:, :4], torch.tensor(picked_labels), picked_box_probs[:, 4]
+
+
+class PredictionDataset(torch.utils.data.Dataset):
+    """
+    Wraps a detection dataset (with get_image) to load and transform the images for Predictor.predict_batch()
+    on DataLoader workers.  Each item is (index, image tensor, original (height, width)).
+    """
+    def __init__(self, dataset, transform):
+        self.dataset = dataset
+        self.transform = transform
+        
+    def __len__(self):
+        return len(self.dataset)
+        
+    def __getitem__(self, index):
+        image = self.dataset.get_image(index)
+        return index, self.transform(image), torch.tensor(image.shape[:2])
@@ -41,6 +41,7 @@ class SSD(nn.Module):
 
         self.config = config
         self.priors = config.priors.to(self.device)
+        self.pruned_layers = None   # the layers that had channels pruned (see prune_ssd.py), their shapes get saved with the model
             
     def forward(self, x: torch.Tensor, get_feature_map_size: bool=False) -> Tuple[torch.Tensor, torch.Tensor]:
         confidences = []
@@ -146,10 +147,22 @@ class SSD(nn.Module):
         self.regression_headers.apply(_xavier_init_)
 
     def load(self, model):
-        self.load_state_dict(torch.load(model, map_location=lambda storage, loc: storage))
+        state_dict = torch.load(model, map_location=lambda storage, loc: storage)
+        pruned_layers = getattr(state_dict, '_metadata', {}).get('', {}).get('pruned_layers')
+
+        if pruned_layers:  # the model had channels pruned (see prune_ssd.py)
+            _resize_to_state_dict(self, state_dict, pruned_layers)
+            self.pruned_layers = list(pruned_layers)
+
+        self.load_state_dict(state_dict)
 
     def save(self, model_path):
-        torch.save(self.state_dict(), model_path)
+        state_dict = self.state_dict()
+
+        if self.pruned_layers:
+            state_dict._metadata['']['pruned_layers'] = {name: list(self.get_submodule(name).weight.shape) for name in self.pruned_layers}
+
+        torch.save(state_dict, model_path)
 
 
 class MatchPrior(object):
@@ -171,7 +184,60 @@ class MatchPrior(object):
         locations = box_utils.convert_boxes_to_locations(boxes, self.center_form_priors, self.center_variance, self.size_variance)
         return locations, labels
 
+    def match_batch(self, gt_boxes, gt_labels):
+        """
+        Match a padded batch of ground truth (see padded_detection_collate) to the priors at once,
+        on the device that the ground truth is on.  Returns the locations and labels for the batch.
+        """
+        if self.corner_form_priors.device != gt_boxes.device:
+            self.center_form_priors = self.center_form_priors.to(gt_boxes.device)
+            self.corner_form_priors = self.corner_form_priors.to(gt_boxes.device)
+        boxes, labels = box_utils.assign_priors_batch(gt_boxes, gt_labels,
+                                                      self.corner_form_priors, self.iou_threshold)
+        boxes = box_utils.corner_form_to_center_form(boxes)
+        locations = box_utils.convert_boxes_to_locations(boxes, self.center_form_priors, self.center_variance, self.size_variance)
+        return locations, labels
+
 
 def _xavier_init_(m: nn.Module):
     if isinstance(m, nn.Conv2d):
         nn.init.xavier_uniform_(m.weight)
+
+
+def _resize_to_state_dict(net: nn.Module, state_dict, layers):
+    """
+    Resize the given conv and batch norm layers to the number of channels that they have in the state_dict.
+    The outputs of the headers are never resized, because they depend on the number of classes.
+    """
+    header_outputs = [[m for m in header.modules() if isinstance(m, nn.Conv2d)][-1]
+                      for header in (*net.classification_headers, *net.regression_headers)]
+
+    for name in layers:
+        m = net.get_submodule(name)
+        weight = state_dict.get(f"{name}.weight")
+
+        if weight is None or not isinstance(m, (nn.Conv2d, nn.BatchNorm2d)) or weight.shape == m.weight.shape:
+            continue
+
+        if any(m is output for output in header_outputs) and weight.size(0) != m.out_channels:
+            raise ValueError(f"{name} has {weight.size(0)} outputs in the model, but {m.out_channels} were expected "
+                             f"(does the number of classes match the model?)")
+
+        num_channels = weight.size(0)
+        device = m.weight.device
+
+        if isinstance(m, nn.Conv2d):
+            if m.groups > 1 and m.groups == m.in_channels == m.out_channels:
+                m.in_channels = m.groups = num_channels
+            else:
+                m.in_channels = weight.size(1) * m.groups
+            m.out_channels = num_channels
+        else:
+            m.num_features = num_channels
+            m.running_mean = torch.zeros(num_channels, device=device)
+            m.running_var = torch.ones(num_channels, device=device)
+
+        m.weight = nn.Parameter(torch.empty(weight.shape, device=device))
+
+        if m.bias is not None:
+            m.bias = nn.Parameter(torch.empty(num_channels, device=device))
@@ -0,0 +1,136 @@
+from ..transforms.batch_transforms import rgb_to_hsv, hsv_to_rgb, BatchTrainAugmentation
+from ..ssd.data_preprocessing import TrainAugmentation
+from ..datasets.collation import batch_augmentation_collate
+
+import cv2
+import torch
+import numpy as np
+
+
+def test_hsv_matches_cv2():
+    image = np.random.default_rng(0).uniform(0, 255, (32, 32, 3)).astype(np.float32)
+    expected = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+
+    hsv = rgb_to_hsv(torch.from_numpy(image).permute(2, 0, 1).unsqueeze(0))
+    np.testing.assert_allclose(hsv[0].permute(1, 2, 0).numpy(), expected, atol=1e-3)
+
+    rgb = hsv_to_rgb(torch.from_numpy(expected).permute(2, 0, 1).unsqueeze(0))
+    np.testing.assert_allclose(rgb[0].permute(1, 2, 0).numpy(), cv2.cvtColor(expected, cv2.COLOR_HSV2RGB), atol=1e-2)
+
+
+def test_batch_train_augmentation():
+    torch.manual_seed(0)
+    rng = np.random.default_rng(0)
+    augmentation = BatchTrainAugmentation(32, mean=127, std=128.0)
+    batch = []
+
+    for n in range(16):
+        height, width = rng.integers(40, 120, size=2)
+        image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        boxes = np.array([[0.1 * width, 0.2 * height, 0.5 * width, 0.6 * height],
+                          [0.4 * width, 0.3 * height, 0.9 * width, 0.8 * height]], dtype=np.float32)
+        batch.append(augmentation.load(image, boxes, np.array([1, 2], dtype=np.int64)))
+
+    images, boxes, labels = augmentation(*batch_augmentation_collate(batch))
+
+    assert images.shape == (16, 3, 32, 32)
+    assert boxes.shape == (16, 2, 4) and labels.shape == (16, 2)
+    assert torch.isfinite(images).all()
+
+    kept = labels > 0
+    assert kept.any(dim=1).all()   # every image keeps at least one box
+    assert (labels[kept] == torch.tensor([1, 2]).expand(16, 2)[kept]).all()
+
+    boxes = boxes[kept]
+    assert (boxes >= 0).all() and (boxes <= 1).all()
+    assert (boxes[:, 2:] > boxes[:, :2]).all()
+
+
+def make_ramp_images(count, seed=0):
+    """
+    Return a list of (image, boxes, labels) with random sizes, where each channel increases from left to right
+    (so that mirroring can be detected from the output, even after the photometric distortions)
+    """
+    rng = np.random.default_rng(seed)
+    samples = []
+
+    for n in range(count):
+        height, width = rng.integers(40, 120, size=2)
+        x = np.linspace(0, 1, width, dtype=np.float32)
+        ramp = np.stack([40 + 160 * x, 90 + 80 * x, 120 + 20 * x], axis=1)
+        image = np.broadcast_to(ramp, (height, width, 3)).round().astype(np.uint8)
+        boxes = np.array([[0.1 * width, 0.2 * height, 0.5 * width, 0.6 * height],
+                          [0.4 * width, 0.3 * height, 0.9 * width, 0.8 * height]], dtype=np.float32)
+        samples.append((image, boxes, np.array([1, 2], dtype=np.int64)))
+
+    return samples
+
+
+def augmentation_stats(images, boxes, cropped):
+    """
+    Return the statistics of augmented images (N, 3, size, size) and their kept boxes (a list of (K, 4) arrays
+    in percent coordinates), that should match between the per-image and batched augmentations.
+    """
+    size = images.shape[-1]
+    mirrored = []
+
+    for image, image_boxes in zip(images, boxes):
+        # the max over the channels keeps increasing from left to right inside of the boxes, unless it was mirrored
+        x1, y1, x2, y2 = image_boxes[np.argmax((image_boxes[:, 2] - image_boxes[:, 0]) * (image_boxes[:, 3] - image_boxes[:, 1]))]
+        row = image.max(axis=0)[int((y1 + y2) / 2 * size), int(np.ceil(x1 * size)) + 1:int(x2 * size) - 1]
+
+        if len(row) > 2:
+            mirrored.append(np.diff(row).sum() < 0)
+
+    areas = np.concatenate([(b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) for b in boxes])
+
+    return {
+        'uncropped': 1 - np.mean(cropped),
+        'mirrored': np.mean(mirrored),
+        'count': np.mean([len(b) for b in boxes]),
+        'area': np.mean(areas),
+        'mean': images.mean(),
+        'std': images.std(),
+    }
+
+
+def test_batch_augmentation_parity():
+    samples = make_ramp_images(400)
+    size = 32
+
+    # the per-image augmentations (recording which images get cropped)
+    np.random.seed(0)
+    augmentation = TrainAugmentation(size, mean=127, std=128.0)
+    random_crop = augmentation.augment.transforms[3]
+    cropped = []
+
+    def crop(image, boxes=None, labels=None):
+        output = random_crop(image, boxes, labels)
+        cropped.append(output[0].shape != image.shape)
+        return output
+
+    augmentation.augment.transforms[3] = crop
+    outputs = [augmentation(image.copy(), boxes.copy(), labels.copy()) for image, boxes, labels in samples]
+
+    expected = augmentation_stats(np.stack([image.numpy() for image, boxes, labels in outputs]),
+                                  [boxes for image, boxes, labels in outputs], cropped)
+
+    # the batched augmentations
+    torch.manual_seed(0)
+    augmentation = BatchTrainAugmentation(size, mean=127, std=128.0)
+    sample_crops = augmentation.geometric_transform.sample_crops
+    cropped = []
+
+    def record_crops(*args):
+        rect, keep, crops = sample_crops(*args)
+        cropped.extend(crops.tolist())
+        return rect, keep, crops
+
+    augmentation.geometric_transform.sample_crops = record_crops
+    images, boxes, labels = augmentation(*batch_augmentation_collate([augmentation.load(*sample) for sample in samples]))
+
+    stats = augmentation_stats(images.numpy(), [b[l > 0].numpy() for b, l in zip(boxes, labels)], cropped)
+    tolerance = {'uncropped': 0.08, 'mirrored': 0.1, 'count': 0.15, 'area': 0.03, 'mean': 0.05, 'std': 0.05}
+
+    for key, value in expected.items():
+        assert abs(stats[key] - value) < tolerance[key], f"{key} {stats[key]:.4f} differs from {value:.4f}"
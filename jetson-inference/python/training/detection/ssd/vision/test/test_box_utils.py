@@ -0,0 +1,130 @@
+from ..utils import box_utils, box_utils_numpy
+from ..utils.box_utils import SSDSpec, SSDBoxSizes
+from ..ssd.config import mobilenetv1_ssd_config
+
+import math
+import torch
+import itertools
+import numpy as np
+
+
+def random_boxes(num_boxes, num_classes, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    centers = torch.rand(num_boxes, 2, generator=generator)
+    sizes = torch.rand(num_boxes, 2, generator=generator) * 0.3 + 0.01
+    boxes = torch.cat([centers - sizes / 2, centers + sizes / 2], dim=1)
+    scores = torch.rand(num_boxes, generator=generator)
+    labels = torch.randint(1, num_classes, (num_boxes,), generator=generator)
+    return boxes, scores, labels
+
+
+def per_class_hard_nms(boxes, scores, labels, iou_threshold, top_k, candidate_size):
+    picked = []
+    for label in labels.unique().tolist():
+        box_probs = torch.cat([boxes, scores.unsqueeze(1)], dim=1)[labels == label]
+        picked.append(box_utils.hard_nms(box_probs, iou_threshold, top_k, candidate_size))
+    return torch.cat(picked)
+
+
+def loop_ssd_priors(specs, image_size):
+    priors = []
+    for spec in specs:
+        scale = image_size / spec.shrinkage
+        for j, i in itertools.product(range(spec.feature_map_size), repeat=2):
+            x_center = (i + 0.5) / scale
+            y_center = (j + 0.5) / scale
+            size = spec.box_sizes.min / image_size
+            priors.append([x_center, y_center, size, size])
+            size = math.sqrt(spec.box_sizes.max * spec.box_sizes.min) / image_size
+            priors.append([x_center, y_center, size, size])
+            size = spec.box_sizes.min / image_size
+            for ratio in spec.aspect_ratios:
+                ratio = math.sqrt(ratio)
+                priors.append([x_center, y_center, size * ratio, size / ratio])
+                priors.append([x_center, y_center, size / ratio, size * ratio])
+    return torch.clamp(torch.tensor(priors), 0.0, 1.0)
+
+
+def test_batched_hard_nms():
+    for top_k, candidate_size in [(-1, 200), (5, 200), (-1, 20)]:
+        boxes, scores, labels = random_boxes(500, 6)
+        expected = per_class_hard_nms(boxes, scores, labels, 0.45, top_k, candidate_size)
+        picked = box_utils.batched_hard_nms(boxes, scores, labels, 0.45, top_k, candidate_size)
+        actual = torch.cat([boxes[picked], scores[picked].unsqueeze(1)], dim=1)
+        assert torch.equal(actual, expected)
+
+
+def test_batched_hard_nms_numpy():
+    for top_k, candidate_size in [(-1, 200), (5, 200), (-1, 20)]:
+        boxes, scores, labels = random_boxes(500, 6, seed=1)
+        expected = per_class_hard_nms(boxes, scores, labels, 0.45, top_k, candidate_size).numpy()
+        boxes, scores, labels = boxes.numpy(), scores.numpy(), labels.numpy()
+        picked = box_utils_numpy.batched_hard_nms(boxes, scores, labels, 0.45, top_k, candidate_size)
+        actual = np.concatenate([boxes[picked], scores[picked, np.newaxis]], axis=1)
+        assert np.array_equal(actual, expected)
+
+
+def test_batched_hard_nms_empty():
+    picked = box_utils.batched_hard_nms(torch.zeros(0, 4), torch.zeros(0), torch.zeros(0, dtype=torch.long), 0.45)
+    assert picked.size(0) == 0
+
+
+def test_generate_ssd_priors():
+    specs = [
+        SSDSpec(38, 8, SSDBoxSizes(30, 60), [2]),
+        SSDSpec(19, 16, SSDBoxSizes(60, 111), [2, 3]),
+        SSDSpec(1, 300, SSDBoxSizes(264, 315), [2])
+    ]
+    for specs, image_size in [(specs, 300), (mobilenetv1_ssd_config.specs, mobilenetv1_ssd_config.image_size)]:
+        priors = box_utils.generate_ssd_priors(specs, image_size)
+        assert torch.equal(priors, loop_ssd_priors(specs, image_size))
+        priors.zero_()  # the cached priors shouldn't be affected
+        assert torch.equal(box_utils.generate_ssd_priors(specs, image_size), loop_ssd_priors(specs, image_size))
+
+
+def test_assign_priors_batch():
+    priors = box_utils.center_form_to_corner_form(mobilenetv1_ssd_config.priors)
+    gt_boxes = []
+    gt_labels = []
+    for n, num_targets in enumerate([3, 0, 7, 1]):
+        boxes, _, labels = random_boxes(num_targets, 5, seed=n)
+        if n == 3:
+            boxes = torch.tensor([[0.0, 0.0, 0.001, 0.001]])  # a box that doesn't overlap any prior much
+        gt_boxes.append(boxes)
+        gt_labels.append(labels)
+    padded_boxes = torch.zeros(len(gt_boxes), 7, 4)
+    padded_labels = torch.zeros(len(gt_boxes), 7, dtype=torch.long)
+    for n, (boxes, labels) in enumerate(zip(gt_boxes, gt_labels)):
+        padded_boxes[n, :len(labels)] = boxes
+        padded_labels[n, :len(labels)] = labels
+    batch_boxes, batch_labels = box_utils.assign_priors_batch(padded_boxes, padded_labels, priors, 0.5)
+    for n, (boxes, labels) in enumerate(zip(gt_boxes, gt_labels)):
+        if len(labels) == 0:
+            assert torch.all(batch_labels[n] == 0)
+            continue
+        expected_boxes, expected_labels = box_utils.assign_priors(boxes, labels, priors, 0.5)
+        assert torch.equal(batch_labels[n], expected_labels)
+        assert torch.equal(batch_boxes[n], expected_boxes)
+        assert torch.all(torch.isin(labels, batch_labels[n]))  # every target gets a prior
+
+
+def sort_hard_negative_mining(loss, labels, neg_pos_ratio):
+    pos_mask = labels > 0
+    num_neg = pos_mask.long().sum(dim=1, keepdim=True) * neg_pos_ratio
+    loss[pos_mask] = -math.inf
+    _, indexes = loss.sort(dim=1, descending=True)
+    _, orders = indexes.sort(dim=1)
+    return pos_mask | (orders < num_neg)
+
+
+def test_hard_negative_mining():
+    generator = torch.Generator().manual_seed(0)
+    loss = torch.rand(6, 3000, generator=generator)
+    labels = (torch.rand(6, 3000, generator=generator) < torch.rand(6, 1, generator=generator) * 0.3).long()
+    labels[0] = 0   # no positives
+    labels[1] = 1   # no negatives
+    labels[2] = 0
+    labels[2, :750] = 1   # the most negatives that get selected (num_priors * 3/4)
+
+    expected = sort_hard_negative_mining(loss.clone(), labels, 3)
+    assert torch.equal(box_utils.hard_negative_mining(loss.clone(), labels, 3), expected)
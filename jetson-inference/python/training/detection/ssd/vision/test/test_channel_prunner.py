@@ -0,0 +1,91 @@
+from ..prunning.channel_prunner import ChannelPrunner, count_parameters, count_flops
+from ..ssd.mobilenetv1_ssd import create_mobilenetv1_ssd
+from ..ssd.mobilenet_v2_ssd_lite import create_mobilenetv2_ssd_lite
+
+import torch
+import pytest
+
+
+def zero_channels(net, group, channels):
+    """
+    Zero the weights of the channels in all the layers that produce them (so they're always zero).
+    """
+    with torch.no_grad():
+        for name, kind in group.members:
+            module = net.get_submodule(name)
+            if kind == 'in':
+                continue
+            module.weight[channels] = 0
+            if module.bias is not None:
+                module.bias[channels] = 0
+
+
+@pytest.mark.parametrize('create_net', [create_mobilenetv1_ssd, create_mobilenetv2_ssd_lite])
+def test_prune_channels(create_net, tmp_path):
+    torch.manual_seed(0)
+    net = create_net(3)
+    net.eval()
+
+    prunner = ChannelPrunner(net, concrete_args={'get_feature_map_size': False})
+    assert len(prunner.groups) > 0
+
+    # pruning channels that are always zero shouldn't change the outputs
+    for group in prunner.groups:
+        zero_channels(net, group, torch.arange(0, prunner.num_channels(group), 4))
+
+    image = torch.randn(1, 3, 300, 300)
+    params, flops = count_parameters(net), count_flops(net, image.shape)
+    confidences, locations = net(image)
+
+    for group in prunner.groups:
+        keep = torch.tensor([c for c in range(prunner.num_channels(group)) if c % 4 != 0])
+        prunner.prune_group(group, keep)
+
+    net.pruned_layers = [name for group in prunner.groups for name, kind in group.members]  # like prune_ssd.py
+
+    pruned_confidences, pruned_locations = net(image)
+
+    assert count_parameters(net) < params and count_flops(net, image.shape) < flops
+    assert torch.allclose(confidences, pruned_confidences, atol=1e-4)
+    assert torch.allclose(locations, pruned_locations, atol=1e-4)
+
+    # the pruned model can be loaded into a new model
+    net.save(str(tmp_path / 'pruned.pth'))
+    loaded_net = create_net(3)
+    loaded_net.load(str(tmp_path / 'pruned.pth'))
+    loaded_net.eval()
+
+    loaded_confidences, loaded_locations = loaded_net(image)
+    assert torch.equal(loaded_confidences, pruned_confidences) and torch.equal(loaded_locations, pruned_locations)
+
+    # but not into a model with a different number of classes
+    with pytest.raises(ValueError):
+        create_net(5).load(str(tmp_path / 'pruned.pth'))
+
+
+def test_load_wrong_classes(tmp_path):
+    create_mobilenetv1_ssd(21).save(str(tmp_path / 'model.pth'))
+
+    # checkpoints that weren't pruned never get resized
+    with pytest.raises(RuntimeError, match='size mismatch'):
+        create_mobilenetv1_ssd(5).load(str(tmp_path / 'model.pth'))
+
+
+def test_prune_ratio():
+    torch.manual_seed(0)
+    net = create_mobilenetv1_ssd(3)
+    prunner = ChannelPrunner(net, concrete_args={'get_feature_map_size': False}, round_to=8, min_channels=0.25)
+
+    confidences, locations = net(torch.randn(2, 3, 300, 300))
+    (confidences.pow(2).mean() + locations.pow(2).mean()).backward()
+    prunner.accumulate_importance()
+
+    num_channels = sum(prunner.original_channels)
+    num_pruned = prunner.prune(0.2)
+
+    assert 0 < num_pruned <= 0.2 * num_channels
+    assert sum(prunner.num_channels(group) for group in prunner.groups) == num_channels - num_pruned
+
+    for group, original_channels in zip(prunner.groups, prunner.original_channels):
+        assert prunner.num_channels(group) % 8 == 0 or prunner.num_channels(group) == original_channels
+        assert prunner.num_channels(group) >= original_channels * 0.25
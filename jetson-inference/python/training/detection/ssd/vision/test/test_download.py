@@ -0,0 +1,90 @@
+from ..utils.download import DownloadManifest, Downloader, file_md5
+
+import os
+import hashlib
+import functools
+import threading
+import http.server
+
+import pytest
+
+
+@pytest.fixture
+def server(tmp_path):
+    """
+    Serve a directory of files over HTTP on localhost, and count the requests for each file.
+    """
+    files = tmp_path / 'server'
+    files.mkdir()
+
+    requests = {}
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def do_GET(self):
+            requests[self.path] = requests.get(self.path, 0) + 1
+            return super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=str(files)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield files, f"http://127.0.0.1:{httpd.server_address[1]}", requests
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download(server, tmp_path):
+    files, url, requests = server
+    root = tmp_path / 'root'
+
+    for n in range(20):
+        (files / f"{n}.jpg").write_bytes(os.urandom(1000 + n))
+
+    manifest = DownloadManifest(str(tmp_path / 'manifest.json'))
+
+    for n in range(20):
+        manifest.add(f"images/{n}.jpg", f"{url}/{n}.jpg")
+
+    manifest.add("images/missing.jpg", f"{url}/missing.jpg")
+    manifest.add("images/0.jpg", f"{url}/0.jpg")   # duplicates only get added once
+
+    downloader = Downloader(str(root), num_workers=4, retry=2)
+    downloaded, skipped, failed = downloader.download(manifest)
+
+    assert len(downloaded) == 20 and len(skipped) == 0 and failed == ["images/missing.jpg"]
+    assert requests["/missing.jpg"] == 1   # missing files don't get retried
+    assert sorted(os.listdir(root / 'images')) == sorted(f"{n}.jpg" for n in range(20))
+
+    for n in range(20):
+        assert (root / 'images' / f"{n}.jpg").read_bytes() == (files / f"{n}.jpg").read_bytes()
+
+    # the sizes/checksums get saved, and the completed files get skipped when resuming
+    manifest = DownloadManifest(str(tmp_path / 'manifest.json'))
+    assert manifest["images/3.jpg"]['size'] == 1003
+    assert manifest["images/3.jpg"]['md5'] == hashlib.md5((files / "3.jpg").read_bytes()).hexdigest()
+
+    (root / 'images' / '5.jpg').write_bytes(b'truncated')
+    os.remove(root / 'images' / '6.jpg')
+
+    downloaded, skipped, failed = Downloader(str(root), num_workers=4, retry=2).download(manifest)
+
+    assert sorted(downloaded) == ["images/5.jpg", "images/6.jpg"] and len(skipped) == 18 and len(failed) == 1
+    assert requests["/5.jpg"] == 2 and requests["/0.jpg"] == 1
+    assert file_md5(str(root / 'images' / '5.jpg')) == manifest["images/5.jpg"]['md5']
+
+
+def test_download_checksum(server, tmp_path):
+    files, url, requests = server
+    (files / "image.jpg").write_bytes(b'image')
+
+    manifest = DownloadManifest(str(tmp_path / 'manifest.json'))
+    manifest.add("image.jpg", f"{url}/image.jpg", size=5, md5=hashlib.md5(b'other').hexdigest())
+
+    downloaded, skipped, failed = Downloader(str(tmp_path), retry=2).download(manifest)
+
+    assert failed == ["image.jpg"] and requests["/image.jpg"] == 2
+    assert sorted(os.listdir(tmp_path)) == ['manifest.json', 'server']   # no partial files get left behind
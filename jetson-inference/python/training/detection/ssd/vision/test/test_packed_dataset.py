@@ -0,0 +1,158 @@
+from ..datasets.packed_dataset import PackedDataset, ShardSampler, ShardWriter
+from ..datasets.voc_dataset import VOCDataset
+
+import os
+import cv2
+import torch
+import numpy as np
+
+
+CLASS_NAMES = ('BACKGROUND', 'cat', 'dog')
+
+
+def make_images(count, seed=0):
+    """
+    Return a list of (image_id, image, boxes, labels, is_difficult) with random images and annotations.
+    """
+    rng = np.random.default_rng(seed)
+    images = []
+
+    for n in range(count):
+        height, width = rng.integers(24, 64, size=2)
+        image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        num_boxes = rng.integers(1, 4)
+        boxes = np.sort(rng.uniform(0, min(height, width), (num_boxes, 2, 2)), axis=1).reshape(-1, 4).astype(np.float32)
+        labels = rng.integers(1, len(CLASS_NAMES), num_boxes)
+        is_difficult = (rng.uniform(size=num_boxes) < 0.3).astype(np.uint8)
+        images.append((f"image-{n}", image, boxes, labels, is_difficult))
+
+    return images
+
+
+def test_packed_dataset(tmp_path):
+    images = make_images(20)
+
+    # small shards, so that the images get split across several of them
+    with ShardWriter(str(tmp_path), 'train', CLASS_NAMES, shard_size=8000) as writer:
+        for image_id, image, boxes, labels, is_difficult in images:
+            ok, data = cv2.imencode('.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+            writer.write(image_id, data.tobytes(), image.shape[:2], boxes, labels, is_difficult)
+
+    assert len(writer.shards) > 2
+
+    dataset = PackedDataset(str(tmp_path), dataset_type='train', keep_difficult=True)
+
+    assert len(dataset) == len(images) and dataset.class_names == CLASS_NAMES
+
+    for index, (image_id, image, boxes, labels, is_difficult) in enumerate(images):
+        assert dataset.get_annotation(index)[0] == image_id
+        assert dataset.get_image_size(index) == image.shape[:2]
+
+        sample_image, sample_boxes, sample_labels = dataset[index]
+
+        np.testing.assert_array_equal(sample_image, image)   # PNG is lossless
+        np.testing.assert_array_equal(sample_boxes, boxes)
+        np.testing.assert_array_equal(sample_labels, labels)
+        np.testing.assert_array_equal(dataset.get_annotation(index)[1][2], is_difficult)
+
+    # the difficult objects get skipped by default
+    dataset = PackedDataset(str(tmp_path), dataset_type='train')
+    _, boxes, labels = dataset[0]
+    np.testing.assert_array_equal(boxes, images[0][2][images[0][4] == 0])
+
+
+def test_shard_sampler(tmp_path):
+    datasets = []
+
+    for split in ('train', 'validation'):
+        with ShardWriter(str(tmp_path), split, CLASS_NAMES, shard_size=1000) as writer:
+            for image_id, image, boxes, labels, is_difficult in make_images(15):
+                writer.write(image_id, os.urandom(300), image.shape[:2], boxes, labels)
+
+        datasets.append(PackedDataset(str(tmp_path), dataset_type=split))
+
+    dataset = torch.utils.data.ConcatDataset(datasets)
+    sampler = ShardSampler(dataset, seed=1)
+    epochs = [list(sampler) for epoch in range(3)]
+
+    assert len(sampler) == 30
+
+    for indexes in epochs:
+        assert sorted(indexes) == list(range(30))   # every index once per epoch
+
+    assert epochs[0] != epochs[1]   # reshuffled each epoch
+
+    # the records from each shard stay together
+    shards = {}
+
+    for offset, subset in ((0, datasets[0]), (15, datasets[1])):
+        for shard, records in enumerate(subset.get_shard_records()):
+            shards.update({int(record) + offset: (offset, shard) for record in records})
+
+    runs = [shards[index] for index in epochs[0]]
+    assert sum(a != b for a, b in zip(runs, runs[1:])) == len(set(runs)) - 1
+
+
+def write_voc_annotation(root, image_id, boxes):
+    objects = ''.join(f"<object><name>{name}</name><difficult>0</difficult><bndbox>"
+                      f"<xmin>{x1}</xmin><ymin>{y1}</ymin><xmax>{x2}</xmax><ymax>{y2}</ymax></bndbox></object>"
+                      for name, (x1, y1, x2, y2) in boxes)
+
+    with open(os.path.join(root, 'Annotations', f"{image_id}.xml"), 'w') as file:
+        file.write(f"<annotation>{objects}</annotation>")
+
+
+def test_voc_index_rebuilt(tmp_path):
+    root = str(tmp_path)
+
+    for subdir in ('Annotations', 'ImageSets/Main', 'JPEGImages'):
+        os.makedirs(os.path.join(root, subdir))
+
+    with open(os.path.join(root, 'labels.txt'), 'w') as file:
+        file.write('cat\ndog\n')
+
+    with open(os.path.join(root, 'ImageSets/Main/trainval.txt'), 'w') as file:
+        file.write('a\nb\n')
+
+    for image_id in ('a', 'b'):
+        cv2.imwrite(os.path.join(root, 'JPEGImages', f"{image_id}.jpg"), np.zeros((40, 50, 3), dtype=np.uint8))
+
+    write_voc_annotation(root, 'a', [('cat', (1, 2, 11, 12))])
+    write_voc_annotation(root, 'b', [('dog', (5, 5, 20, 30)), ('cat', (2, 3, 4, 5))])
+
+    dataset = VOCDataset(root)
+    index_path = os.path.join(root, '.trainval.index')
+
+    assert os.path.isfile(index_path)
+    assert dataset.ids == ['a', 'b'] and dataset.get_image_size(1) == (40, 50)
+    np.testing.assert_array_equal(dataset.get_annotation(1)[1][1], [2, 1])
+
+    # an unchanged dataset gets loaded from the index
+    mtime = os.stat(index_path).st_mtime_ns
+    dataset = VOCDataset(root)
+    assert os.stat(index_path).st_mtime_ns == mtime and dataset.ids == ['a', 'b']
+
+    # editing an annotation in-place doesn't change the directory, so it needs rebuild_index
+    write_voc_annotation(root, 'a', [('dog', (3, 4, 13, 14)), ('dog', (6, 7, 16, 17))])
+    annotations = os.path.join(root, 'Annotations')
+    stat = os.stat(annotations)
+    os.utime(annotations, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    dataset = VOCDataset(root)
+    np.testing.assert_array_equal(dataset.get_annotation(0)[1][1], [1])
+
+    dataset = VOCDataset(root, rebuild_index=True)
+    boxes, labels, _ = dataset.get_annotation(0)[1]
+
+    np.testing.assert_array_equal(labels, [2, 2])
+    np.testing.assert_array_equal(boxes[0], [2, 3, 12, 13])   # VOC coordinates are 1-based
+    assert os.stat(index_path).st_mtime_ns != mtime
+
+    # adding or removing files changes the directory's mtime, which makes the index stale
+    mtime = os.stat(index_path).st_mtime_ns
+    write_voc_annotation(root, 'a', [('cat', (1, 2, 11, 12))])
+    os.utime(annotations, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    dataset = VOCDataset(root)
+    np.testing.assert_array_equal(dataset.get_annotation(0)[1][1], [1])
+    assert os.stat(index_path).st_mtime_ns != mtime
@@ -0,0 +1,263 @@
+#
+# batched versions of the SSD training augmentations from transforms.py, which run on the
+# training device (e.g. the GPU) over whole batches instead of per-image in the data loader
+#
+import cv2
+import torch
+import numpy as np
+import torch.nn.functional as F
+
+
+class LoadBatchImage(object):
+    """
+    Data loader transform that resizes an image to a fixed size, so that the images can be batched
+    before being augmented.  The boxes get converted to percent coordinates, and the original
+    (height, width) gets returned with the image (it's needed for the aspect ratio of the crops).
+    """
+    def __init__(self, size=600):
+        self.size = size
+
+    def __call__(self, image, boxes=None, labels=None):
+        height, width, _ = image.shape
+        image = cv2.resize(image, (self.size, self.size), interpolation=cv2.INTER_AREA)
+        image = torch.from_numpy(np.ascontiguousarray(image)).permute(2, 0, 1).contiguous()
+        boxes = boxes / np.array([width, height, width, height], dtype=np.float32)
+        return (image, (height, width)), boxes, labels
+
+
+def rgb_to_hsv(image):
+    """
+    Convert a batch of float RGB images (N, 3, H, W) to HSV, the same as cv2.COLOR_RGB2HSV does for
+    float images (the hue is in degrees, and the saturation is in [0, 1])
+    """
+    eps = torch.finfo(torch.float32).eps
+    r, g, b = image.unbind(1)
+    v, _ = image.max(1)
+    diff = v - image.min(1)[0]
+    s = diff / (v.abs() + eps)
+    diff = 60.0 / (diff + eps)
+    h = torch.where(v == r, (g - b) * diff,
+        torch.where(v == g, (b - r) * diff + 120.0, (r - g) * diff + 240.0))
+    h = torch.where(h < 0, h + 360.0, h)
+    return torch.stack([h, s, v], dim=1)
+
+
+# the (r, g, b) index into [v, p, q, t] for each sector of the hue (from cv2's HSV2RGB)
+HSV_SECTORS = torch.tensor([[0, 3, 1], [2, 0, 1], [1, 0, 3], [1, 2, 0], [3, 1, 0], [0, 1, 2]])
+
+
+def hsv_to_rgb(image):
+    """
+    Convert a batch of float HSV images (N, 3, H, W) back to RGB, the same as cv2.COLOR_HSV2RGB
+    """
+    h, s, v = image.unbind(1)
+    h = torch.remainder(h / 60.0, 6.0)
+    sector = h.floor().clamp(0, 5)
+    h = h - sector
+    tab = torch.stack([v, v * (1 - s), v * (1 - s * h), v * (1 - s * (1 - h))], dim=1)
+    index = HSV_SECTORS.to(image.device)[sector.long()].permute(0, 3, 1, 2)
+    rgb = torch.gather(tab, 1, index)
+    return torch.where((s == 0).unsqueeze(1), v.unsqueeze(1).expand_as(rgb), rgb)
+
+
+class BatchPhotometricDistort(object):
+    """
+    Batched PhotometricDistort - the random brightness, contrast, saturation, hue, and channel
+    swaps get drawn independently for each image, with the same distributions as the original.
+    """
+    def __init__(self, brightness_delta=32, contrast_range=(0.5, 1.5), saturation_range=(0.5, 1.5), hue_delta=18.0):
+        self.brightness_delta = brightness_delta
+        self.contrast_range = contrast_range
+        self.saturation_range = saturation_range
+        self.hue_delta = hue_delta
+        self.perms = torch.tensor([(0, 1, 2), (0, 2, 1), (1, 0, 2), (1, 2, 0), (2, 0, 1), (2, 1, 0)])
+
+    def __call__(self, images):
+        batch_size = images.size(0)
+        device = images.device
+
+        def coin():
+            return torch.rand(batch_size, device=device) < 0.5
+
+        def uniform(lower, upper):
+            return torch.empty(batch_size, device=device).uniform_(lower, upper)
+
+        def per_image(value):
+            return value.view(batch_size, 1, 1)
+
+        images = images + per_image(torch.where(coin(), uniform(-self.brightness_delta, self.brightness_delta), 0.0)).unsqueeze(1)
+
+        contrast_first = coin()
+        contrast = torch.where(coin(), uniform(*self.contrast_range), 1.0)
+        images = images * per_image(torch.where(contrast_first, contrast, 1.0)).unsqueeze(1)
+
+        hsv = rgb_to_hsv(images)
+        h, s, v = hsv.unbind(1)
+        s = s * per_image(torch.where(coin(), uniform(*self.saturation_range), 1.0))
+        h = h + per_image(torch.where(coin(), uniform(-self.hue_delta, self.hue_delta), 0.0))
+        h = torch.where(h > 360.0, h - 360.0, h)
+        h = torch.where(h < 0.0, h + 360.0, h)
+        images = hsv_to_rgb(torch.stack([h, s, v], dim=1))
+
+        images = images * per_image(torch.where(contrast_first, 1.0, contrast)).unsqueeze(1)
+
+        perms = self.perms.to(device)
+        perm = torch.where(coin().unsqueeze(1), perms[torch.randint(len(perms), (batch_size,), device=device)], perms[0])
+        return torch.gather(images, 1, perm.view(batch_size, 3, 1, 1).expand_as(images))
+
+
+class BatchGeometricTransform(object):
+    """
+    Batched Expand, RandomSampleCrop, RandomMirror, and Resize - the random parameters get drawn per-image
+    with the same distributions as the original transforms, and then the image is resampled once through
+    the combined affine transform with grid_sample (so expanding the image doesn't allocate a bigger one).
+
+    The boxes are in percent coordinates, padded with label 0.  The area outside of the image (from
+    expanding it) is filled with zeros, and the coverage of the image at each output pixel is returned
+    too (batch_size, 1, size, size) - so that the area can be filled in with the mean afterwards.
+    """
+    def __init__(self, size, max_trials=50):
+        self.size = size
+        self.max_trials = max_trials
+
+    def __call__(self, images, image_sizes, boxes, labels):
+        batch_size = images.size(0)
+        device = images.device
+
+        # Expand:  put the image somewhere on a canvas that's 1-4x bigger
+        ratio = torch.where(torch.rand(batch_size, device=device) < 0.5,
+                            torch.empty(batch_size, device=device).uniform_(1, 4), 1.0)
+        offset = torch.rand(batch_size, 2, device=device) * (1 - 1 / ratio).unsqueeze(1)
+        boxes = boxes / ratio.view(-1, 1, 1) + offset.repeat(1, 2).unsqueeze(1)
+
+        # RandomSampleCrop
+        rect, keep, cropped = self.sample_crops(image_sizes, boxes, labels)
+        labels = torch.where(keep, labels, 0)
+        rect_size = (rect[:, 2:] - rect[:, :2]).repeat(1, 2).unsqueeze(1)
+        clipped = torch.cat([torch.max(boxes[..., :2], rect[:, None, :2]), torch.min(boxes[..., 2:], rect[:, None, 2:])], dim=2)
+        boxes = torch.where(cropped.view(-1, 1, 1), clipped, boxes)
+        boxes = (boxes - rect[:, :2].repeat(1, 2).unsqueeze(1)) / rect_size
+
+        # RandomMirror
+        mirror = torch.rand(batch_size, device=device) < 0.5
+        boxes = torch.where(mirror.view(-1, 1, 1), torch.stack([1 - boxes[..., 2], boxes[..., 1], 1 - boxes[..., 0], boxes[..., 3]], dim=2), boxes)
+
+        # Resize:  map the output pixels to the input image, through the mirror, crop, and expand
+        images_size = images.shape[2:]
+        grid = (torch.arange(self.size, device=device, dtype=torch.float32) + 0.5) / self.size
+        grid_x = torch.where(mirror.unsqueeze(1), 1 - grid, grid)
+        grid_x = (rect[:, 0:1] + grid_x * (rect[:, 2:3] - rect[:, 0:1]) - offset[:, 0:1]) * ratio.unsqueeze(1)
+        grid_y = (rect[:, 1:2] + grid * (rect[:, 3:4] - rect[:, 1:2]) - offset[:, 1:2]) * ratio.unsqueeze(1)
+        grid = torch.stack([grid_x.unsqueeze(1).expand(-1, self.size, -1),
+                            grid_y.unsqueeze(2).expand(-1, -1, self.size)], dim=3) * 2 - 1
+
+        images = F.grid_sample(images, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+
+        # the sampling is separable, so the coverage is the product of the coverage along each axis
+        coverage = self.coverage(grid_y, images_size[0]).unsqueeze(2) * self.coverage(grid_x, images_size[1]).unsqueeze(1)
+        return images, boxes, labels, coverage.unsqueeze(1)
+
+    @staticmethod
+    def coverage(grid, size):
+        """
+        Return the sum of the bilinear weights that fall inside of the image, for percent coordinates along one axis
+        """
+        position = grid * size - 0.5
+        first = position.floor()
+        weight = position - first
+        return (1 - weight) * ((first >= 0) & (first <= size - 1)) + weight * ((first >= -1) & (first <= size - 2))
+
+    def sample_crops(self, image_sizes, boxes, labels):
+        """
+        Pick the crop rectangle of each image (in percent coordinates), which boxes to keep, and
+        which of the images got cropped.
+
+        Like RandomSampleCrop, each round either leaves the image uncropped (1/6 of the time) or tries up
+        to 50 random crops, and is repeated until one of them has a box center inside of it.  The IoU modes
+        of RandomSampleCrop aren't needed, because it only rejects a crop if its IoU is both below the min
+        and above the max (and the max is unbounded) - so they can never reject a crop.
+        """
+        batch_size, num_targets = labels.shape
+        device = boxes.device
+
+        rect = torch.tensor([0.0, 0.0, 1.0, 1.0], device=device).repeat(batch_size, 1)
+        keep = labels > 0
+        cropped = torch.zeros(batch_size, dtype=torch.bool, device=device)
+        pending = torch.arange(batch_size, device=device)
+
+        aspect = image_sizes[:, 0] / image_sizes[:, 1]  # the expanded canvas has the same aspect ratio
+        centers = (boxes[..., :2] + boxes[..., 2:]) / 2
+
+        while len(pending) > 0:
+            # leave the image uncropped
+            pending = pending[torch.randint(6, (len(pending),), device=device) > 0]
+
+            size = torch.empty(len(pending), self.max_trials, 2, device=device).uniform_(0.3, 1.0)
+            left_top = torch.rand(len(pending), self.max_trials, 2, device=device) * (1 - size)
+            trials = torch.cat([left_top, left_top + size], dim=2)
+
+            # aspect ratio constraint b/t .5 & 2
+            trial_aspect = size[..., 1] / size[..., 0] * aspect[pending].unsqueeze(1)
+            valid = (trial_aspect >= 0.5) & (trial_aspect <= 2)
+
+            # keep the gt boxes that have their center in the crop (there needs to be one)
+            inside = ((trials[:, :, None, :2] < centers[pending, None]) & (trials[:, :, None, 2:] > centers[pending, None])).all(dim=3)
+            inside &= labels[pending, None] > 0
+            valid &= inside.any(dim=2)
+
+            found = valid.any(dim=1)
+            trial = valid.int().argmax(dim=1)
+            index = torch.arange(len(pending), device=device)
+
+            rect[pending[found]] = trials[index, trial][found]
+            keep[pending[found]] = inside[index, trial][found]
+            cropped[pending[found]] = True
+
+            pending = pending[~found]
+
+        return rect, keep, cropped
+
+
+class BatchTrainAugmentation(object):
+    """
+    Batched version of the TrainAugmentation transforms, that runs on the training device.
+    Use `load` as the transform of the dataset (which only resizes the images in the data loader
+    workers), `batch_augmentation_collate` as the collate function, and then call this on each batch.
+    """
+    def __init__(self, size, mean=0, std=1.0, load_size=None):
+        """
+        Args:
+            size: the size the of final image.
+            mean: mean pixel value per channel.
+            load_size: the size the images get resized to in the data loader (by default 2x the final size)
+        """
+        self.size = size
+        self.mean = torch.tensor(mean, dtype=torch.float32).reshape(-1, 1, 1).expand(3, 1, 1)
+        self.std = std
+        self.load = LoadBatchImage(load_size or size * 2)
+        self.photometric_distort = BatchPhotometricDistort()
+        self.geometric_transform = BatchGeometricTransform(size)
+
+    def __call__(self, images, boxes, labels, device=None):
+        """
+        Args:
+            images: the (uint8 images, image sizes) from batch_augmentation_collate
+            boxes: padded boxes in percent coordinates (batch_size, num_targets, 4)
+            labels: padded labels (batch_size, num_targets)
+        Returns:
+            the augmented images (batch_size, 3, size, size), boxes, and labels (with the boxes that
+            were cropped out set to label 0)
+        """
+        images, image_sizes = images
+
+        images = images.to(device, non_blocking=True).float()
+        image_sizes = image_sizes.to(device, non_blocking=True)
+        boxes = boxes.to(device, non_blocking=True)
+        labels = labels.to(device, non_blocking=True)
+
+        # the photometric distortions get applied after resampling (to the smaller images), only
+        # to the area that's covered by the image - the expanded area gets filled with the mean
+        images, boxes, labels, coverage = self.geometric_transform(images, image_sizes, boxes, labels)
+        images = self.photometric_distort(images / coverage.clamp(min=1e-6))
+        images = (images - self.mean.to(images.device)) * coverage
+        return images / self.std, boxes, labels
@@ -1,6 +1,5 @@
 import collections
 import torch
-import itertools
 from typing import List
 import math
 
@@ -29,52 +28,49 @@ def generate_ssd_priors(specs: List[SSDSpec], image_size, clamp=True) -> torch.T
         priors (num_priors, 4): The prior boxes represented as [[center_x, center_y, w, h]]. All the values
             are relative to the image size.
     """
+    key = (tuple((spec.feature_map_size, spec.shrinkage, tuple(spec.box_sizes), tuple(spec.aspect_ratios)) for spec in specs),
+           image_size, clamp)
+
+    if key not in _priors_cache:
+        _priors_cache[key] = _generate_ssd_priors(specs, image_size, clamp)
+
+    return _priors_cache[key].clone()
+
+
+_priors_cache = {}
+
+
+def _generate_ssd_priors(specs: List[SSDSpec], image_size, clamp=True) -> torch.Tensor:
+    """Generate the priors for each feature map at once (see generate_ssd_priors).
+
+    The priors of each location are ordered:  the small square box, the big square box, and then
+    the (w * sqrt(ratio), h / sqrt(ratio)) and (w / sqrt(ratio), h * sqrt(ratio)) boxes of each ratio.
+    """
     priors = []
     for spec in specs:
         scale = image_size / spec.shrinkage
-        for j, i in itertools.product(range(spec.feature_map_size), repeat=2):
-            x_center = (i + 0.5) / scale
-            y_center = (j + 0.5) / scale
-
-            # small sized square box
-            size = spec.box_sizes.min
-            h = w = size / image_size
-            priors.append([
-                x_center,
-                y_center,
-                w,
-                h
-            ])
-
-            # big sized square box
-            size = math.sqrt(spec.box_sizes.max * spec.box_sizes.min)
-            h = w = size / image_size
-            priors.append([
-                x_center,
-                y_center,
-                w,
-                h
-            ])
-
-            # change h/w ratio of the small sized box
-            size = spec.box_sizes.min
-            h = w = size / image_size
-            for ratio in spec.aspect_ratios:
-                ratio = math.sqrt(ratio)
-                priors.append([
-                    x_center,
-                    y_center,
-                    w * ratio,
-                    h / ratio
-                ])
-                priors.append([
-                    x_center,
-                    y_center,
-                    w / ratio,
-                    h * ratio
-                ])
-
-    priors = torch.tensor(priors)
+
+        # the (width, height) of each box at a location
+        size = spec.box_sizes.min / image_size
+        big_size = math.sqrt(spec.box_sizes.max * spec.box_sizes.min) / image_size
+        sizes = [[size, size], [big_size, big_size]]
+        for ratio in spec.aspect_ratios:
+            ratio = math.sqrt(ratio)
+            sizes.append([size * ratio, size / ratio])
+            sizes.append([size / ratio, size * ratio])
+        sizes = torch.tensor(sizes, dtype=torch.float64)
+
+        # the centers of the locations (in row-major order)
+        centers = (torch.arange(spec.feature_map_size, dtype=torch.float64) + 0.5) / scale
+        y_center, x_center = torch.meshgrid(centers, centers, indexing='ij')
+        centers = torch.stack([x_center.reshape(-1), y_center.reshape(-1)], dim=1)
+
+        priors.append(torch.cat([
+            centers.repeat_interleave(len(sizes), dim=0),
+            sizes.repeat(len(centers), 1)
+        ], dim=1))
+
+    priors = torch.cat(priors).float()
     if clamp:
         torch.clamp(priors, 0.0, 1.0, out=priors)
     return priors
@@ -168,8 +164,10 @@ def assign_priors(gt_boxes, gt_labels, corner_form_priors,
     # size: num_targets
     best_prior_per_target, best_prior_per_target_index = ious.max(0)
 
-    for target_index, prior_index in enumerate(best_prior_per_target_index):
-        best_target_per_prior_index[prior_index] = target_index
+    # if a prior is the best one for multiple targets, the last target gets it
+    best_target_per_prior_index.scatter_reduce_(0, best_prior_per_target_index,
+                                                torch.arange(len(gt_boxes), device=gt_boxes.device),
+                                                reduce='amax', include_self=False)
     # 2.0 is used to make sure every target has a prior assigned
     best_target_per_prior.index_fill_(0, best_prior_per_target_index, 2)
     # size: num_priors
@@ -179,6 +177,46 @@ def assign_priors(gt_boxes, gt_labels, corner_form_priors,
     return boxes, labels
 
 
+def assign_priors_batch(gt_boxes, gt_labels, corner_form_priors,
+                        iou_threshold):
+    """Assign ground truth boxes and targets to priors for a whole batch (see assign_priors).
+
+    Args:
+        gt_boxes (batch_size, num_targets, 4): ground truth boxes, padded to the same number of targets.
+        gt_labels (batch_size, num_targets): labels of targets, where the padding has label 0.
+        priors (num_priors, 4): corner form priors
+    Returns:
+        boxes (batch_size, num_priors, 4): real values for priors.
+        labels (batch_size, num_priors): labels for priors.
+    """
+    batch_size, num_targets = gt_labels.shape
+    num_priors = corner_form_priors.size(0)
+    valid = gt_labels > 0
+    # size: batch_size x num_priors x num_targets
+    ious = iou_of(gt_boxes.unsqueeze(1), corner_form_priors.unsqueeze(0).unsqueeze(2))
+    ious.masked_fill_(~valid.unsqueeze(1), -1.0)
+    # size: batch_size x num_priors
+    best_target_per_prior, best_target_per_prior_index = ious.max(2)
+    # size: batch_size x num_targets
+    best_prior_per_target, best_prior_per_target_index = ious.max(1)
+
+    # the padding gets scattered to an extra prior that's dropped afterwards
+    best_prior_per_target_index.masked_fill_(~valid, num_priors)
+    target_index = torch.arange(num_targets, device=gt_labels.device).expand(batch_size, num_targets)
+    best_target_per_prior_index = torch.cat([best_target_per_prior_index, best_target_per_prior_index.new_zeros(batch_size, 1)], dim=1)
+    best_target_per_prior_index.scatter_reduce_(1, best_prior_per_target_index, target_index, reduce='amax', include_self=False)
+    best_target_per_prior_index = best_target_per_prior_index[:, :num_priors]
+    # 2.0 is used to make sure every target has a prior assigned
+    best_target_per_prior = torch.cat([best_target_per_prior, best_target_per_prior.new_zeros(batch_size, 1)], dim=1)
+    best_target_per_prior.scatter_(1, best_prior_per_target_index, 2.0)
+    best_target_per_prior = best_target_per_prior[:, :num_priors]
+    # size: batch_size x num_priors
+    labels = torch.gather(gt_labels, 1, best_target_per_prior_index)
+    labels[best_target_per_prior < iou_threshold] = 0  # the backgournd id
+    boxes = torch.gather(gt_boxes, 1, best_target_per_prior_index.unsqueeze(2).expand(-1, -1, 4))
+    return boxes, labels
+
+
 def hard_negative_mining(loss, labels, neg_pos_ratio):
     """
     It used to suppress the presence of a large number of negative prediction.
@@ -197,10 +235,16 @@ def hard_negative_mining(loss, labels, neg_pos_ratio):
     num_pos = pos_mask.long().sum(dim=1, keepdim=True)
     num_neg = num_pos * neg_pos_ratio
 
+    # only the top num_neg losses of each image are needed, so rank the top-k instead of sorting
+    # all the priors.  k is a static bound (so it doesn't sync with the device) - an image with
+    # num_pos positives needs min(num_pos * ratio, num_priors - num_pos) negatives, which is at
+    # most num_priors * ratio / (ratio + 1)
+    k = min(math.ceil(loss.size(1) * neg_pos_ratio / (neg_pos_ratio + 1)), loss.size(1))
+
     loss[pos_mask] = -math.inf
-    _, indexes = loss.sort(dim=1, descending=True)
-    _, orders = indexes.sort(dim=1)
-    neg_mask = orders < num_neg
+    _, indexes = loss.topk(k, dim=1)
+    ranks = torch.arange(k, device=loss.device).expand_as(indexes)
+    neg_mask = torch.zeros_like(pos_mask).scatter_(1, indexes, ranks < num_neg)
     return pos_mask | neg_mask
 
 
@@ -249,6 +293,60 @@ def hard_nms(box_scores, iou_threshold, top_k=-1, candidate_size=200):
     return box_scores[picked, :]
 
 
+def batched_hard_nms(boxes, scores, labels, iou_threshold, top_k=-1, candidate_size=200):
+    """Hard NMS over all the classes at once, with the same results as calling hard_nms() per class.
+
+    The candidates of each class are laid out in a (num_classes, candidate_size) grid sorted by
+    score, so the IoU matrices of every class are computed in one batch.  The greedy suppression
+    then steps through the candidates in score order, for all the classes in parallel.
+
+    Args:
+        boxes (N, 4): boxes in corner-form.
+        scores (N): probabilities.
+        labels (N): class labels.
+        iou_threshold: intersection over union threshold.
+        top_k: keep top_k results per class. If k <= 0, keep all the results.
+        candidate_size: only consider the candidates with the highest scores (per class).
+    Returns:
+         picked: indexes of the kept boxes, ordered by class and then by descending score.
+    """
+    if boxes.size(0) == 0:
+        return torch.zeros(0, dtype=torch.long, device=boxes.device)
+
+    # sort by descending score, then by class (stable), so each class is a contiguous run
+    _, classes = torch.unique(labels, return_inverse=True)
+    _, order = torch.sort(scores, descending=True, stable=True)
+    _, class_order = torch.sort(classes[order], stable=True)
+    order = order[class_order]
+    classes = classes[order]
+
+    # the rank of each box within its class
+    counts = torch.bincount(classes)
+    starts = torch.cumsum(counts, dim=0) - counts
+    ranks = torch.arange(order.size(0), device=boxes.device) - starts[classes]
+
+    candidates = ranks < candidate_size
+    order, classes, ranks = order[candidates], classes[candidates], ranks[candidates]
+
+    size = min(candidate_size, int(counts.max()))
+    grid = torch.full((counts.size(0), size), -1, dtype=torch.long, device=boxes.device)
+    grid[classes, ranks] = order
+
+    # size: num_classes x size x size
+    grid_boxes = boxes[grid.clamp(min=0)]
+    suppress = iou_of(grid_boxes.unsqueeze(2), grid_boxes.unsqueeze(1)) > iou_threshold
+
+    keep = grid >= 0
+
+    for i in range(size - 1):
+        keep[:, i+1:] &= ~(suppress[:, i, i+1:] & keep[:, i:i+1])
+
+    if top_k > 0:
+        keep &= torch.cumsum(keep, dim=1) <= top_k
+
+    return grid[keep]
+
+
 def nms(box_scores, nms_method=None, score_threshold=None, iou_threshold=None,
         sigma=0.5, top_k=-1, candidate_size=200):
     if nms_method == "soft":
@@ -195,6 +195,55 @@ def hard_nms(box_scores, iou_threshold, top_k=-1, candidate_size=200):
     return box_scores[picked, :]
 
 
+def batched_hard_nms(boxes, scores, labels, iou_threshold, top_k=-1, candidate_size=200):
+    """Hard NMS over all the classes at once (the NumPy version of box_utils.batched_hard_nms).
+
+    Args:
+        boxes (N, 4): boxes in corner-form.
+        scores (N): probabilities.
+        labels (N): class labels.
+        iou_threshold: intersection over union threshold.
+        top_k: keep top_k results per class. If k <= 0, keep all the results.
+        candidate_size: only consider the candidates with the highest scores (per class).
+    Returns:
+         picked: indexes of the kept boxes, ordered by class and then by descending score.
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # sort by descending score, then by class (stable), so each class is a contiguous run
+    _, classes = np.unique(labels, return_inverse=True)
+    order = np.argsort(-scores, kind='stable')
+    order = order[np.argsort(classes[order], kind='stable')]
+    classes = classes[order]
+
+    # the rank of each box within its class
+    counts = np.bincount(classes)
+    starts = np.cumsum(counts) - counts
+    ranks = np.arange(len(order)) - starts[classes]
+
+    candidates = ranks < candidate_size
+    order, classes, ranks = order[candidates], classes[candidates], ranks[candidates]
+
+    size = min(candidate_size, int(counts.max()))
+    grid = np.full((len(counts), size), -1, dtype=np.int64)
+    grid[classes, ranks] = order
+
+    # size: num_classes x size x size
+    grid_boxes = boxes[np.maximum(grid, 0)]
+    suppress = iou_of(grid_boxes[:, :, np.newaxis], grid_boxes[:, np.newaxis, :]) > iou_threshold
+
+    keep = grid >= 0
+
+    for i in range(size - 1):
+        keep[:, i+1:] &= ~(suppress[:, i, i+1:] & keep[:, i:i+1])
+
+    if top_k > 0:
+        keep &= np.cumsum(keep, axis=1) <= top_k
+
+    return grid[keep]
+
+
 # def nms(box_scores, nms_method=None, score_threshold=None, iou_threshold=None,
 #         sigma=0.5, top_k=-1, candidate_size=200):
 #     if nms_method == "soft":
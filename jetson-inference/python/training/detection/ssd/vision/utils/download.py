@@ -0,0 +1,333 @@
+#
+# resumable, concurrent downloads of the files listed in a manifest (used by open_images_downloader.py)
+#
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import tempfile
+import threading
+
+from urllib import request, error
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class DownloadManifest:
+    """
+    The list of files to download, with the URL of each file and (if they're known) its size and MD5.
+    It gets saved as JSON, so that an interrupted download can be resumed - the files that already
+    exist with the expected size (and checksum, when verifying) get skipped.  The sizes and checksums
+    that weren't known up-front get filled in as the files are downloaded.
+
+    The URLs can be http://, https://, or s3://bucket/key
+    """
+    VERSION = 1
+
+    def __init__(self, path):
+        """
+        Load the manifest from the given path (if it exists).
+        """
+        self.path = path
+        self.files = {}
+        self.lock = threading.Lock()
+
+        if os.path.isfile(path):
+            with open(path) as file:
+                manifest = json.load(file)
+
+            if manifest.get('version') == self.VERSION:
+                self.files = {entry['path']: entry for entry in manifest['files']}
+            else:
+                logging.warning(f"ignoring download manifest {path} with a different version")
+
+    def add(self, path, url, size=None, md5=None):
+        """
+        Add a file to the manifest, and return its entry.  The path is relative to the download root,
+        and files with the same path only get added once.  If the file was already in the manifest
+        from the same URL, its recorded size/checksum gets kept (unless new ones are given).
+        """
+        with self.lock:
+            entry = self.files.get(path)
+
+            if entry is None or entry['url'] != url:
+                entry = self.files[path] = {'path': path, 'url': url, 'size': None, 'md5': None}
+
+            if size is not None:
+                entry['size'] = size
+            if md5 is not None:
+                entry['md5'] = md5
+
+            return entry
+
+    def update(self, path, size, md5):
+        """
+        Record the size and checksum of a file once it's been downloaded.
+        """
+        with self.lock:
+            self.files[path].update(size=size, md5=md5)
+
+    def save(self):
+        """
+        Write the manifest (through a temp file, so that it never gets left half-written).
+        """
+        with self.lock:
+            manifest = {'version': self.VERSION, 'files': list(self.files.values())}
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.manifest-', delete=False) as file:
+            json.dump(manifest, file, indent=1)
+
+        os.replace(file.name, self.path)
+
+    def __getitem__(self, path):
+        return self.files[path]
+
+    def __iter__(self):
+        return iter(list(self.files.values()))
+
+    def __len__(self):
+        return len(self.files)
+
+
+class Downloader:
+    """
+    Downloads the files in a DownloadManifest to a root directory with a pool of threads,
+    retrying failed downloads with exponential backoff.  Each file gets written to a temp file
+    next to it and then renamed, so that interrupted downloads never leave partial files behind.
+    """
+    def __init__(self, root, num_workers=32, retry=10, verify=False, timeout=60, s3_endpoint=None, save_interval=1000):
+        """
+        Parameters:
+            root (string) -- the directory that the paths in the manifest are relative to
+            num_workers (int) -- the max number of concurrent downloads
+            retry (int) -- the number of times to try each file before giving up
+            verify (bool) -- if true, check the MD5 of the existing files before skipping them
+            timeout (float) -- the socket timeout (in seconds)
+            s3_endpoint (string) -- the endpoint URL used for s3:// files (the default is AWS)
+            save_interval (int) -- save the manifest after every this many downloads
+        """
+        self.root = root
+        self.num_workers = num_workers
+        self.retry = retry
+        self.verify = verify
+        self.timeout = timeout
+        self.s3_endpoint = s3_endpoint
+        self.save_interval = save_interval
+
+        self.s3 = None
+        self.lock = threading.Lock()
+
+    def download(self, manifest, paths=None):
+        """
+        Download the files from the manifest that are missing or incomplete (or only the given paths),
+        and return the lists of (downloaded, skipped, failed) paths.
+        """
+        entries = [manifest[path] for path in paths] if paths is not None else list(manifest)
+        downloaded, skipped, failed = [], [], []
+        pending = []
+
+        for entry in entries:
+            if self.is_complete(manifest, entry):
+                skipped.append(entry['path'])
+            else:
+                pending.append(entry)
+
+        if len(pending) == 0:
+            return downloaded, skipped, failed
+
+        logging.warning(f"Downloading {len(pending)} files ({len(skipped)} already downloaded)")
+
+        # only keep num_workers downloads in-flight, instead of queueing them all at once
+        with ThreadPoolExecutor(self.num_workers) as executor:
+            futures = {}
+            queue = iter(pending)
+
+            try:
+                while True:
+                    for entry in queue:
+                        futures[executor.submit(self.fetch, manifest, entry)] = entry
+
+                        if len(futures) >= self.num_workers:
+                            break
+
+                    if len(futures) == 0:
+                        break
+
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        entry = futures.pop(future)
+
+                        try:
+                            future.result()
+                            downloaded.append(entry['path'])
+                        except Exception as e:
+                            logging.warning(f"Failed to download {entry['url']} ({e})")
+                            failed.append(entry['path'])
+
+                        num_finished = len(downloaded) + len(failed)
+
+                        if num_finished % 100 == 0:
+                            logging.warning(f"Downloaded {num_finished}/{len(pending)} files ({len(failed)} failed)")
+
+                        if self.save_interval > 0 and num_finished % self.save_interval == 0:
+                            manifest.save()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+                manifest.save()
+
+        return downloaded, skipped, failed
+
+    def is_complete(self, manifest, entry):
+        """
+        Return true if the file was already downloaded with the expected size (and MD5, if verifying).
+        The size of existing files that aren't in the manifest yet gets recorded.
+        """
+        path = os.path.join(self.root, entry['path'])
+
+        if not os.path.isfile(path):
+            return False
+
+        size = os.path.getsize(path)
+
+        if entry['size'] is not None and entry['size'] != size:
+            return False
+
+        if self.verify:
+            md5 = file_md5(path)
+
+            if entry['md5'] is not None and entry['md5'] != md5:
+                return False
+
+            manifest.update(entry['path'], size, md5)
+        elif entry['size'] is None:
+            manifest.update(entry['path'], size, entry['md5'])
+
+        return True
+
+    def fetch(self, manifest, entry):
+        """
+        Download one file (retrying it if needed), and record its size and checksum in the manifest.
+        """
+        num_attempts = max(self.retry, 1)
+
+        for attempt in range(num_attempts):
+            try:
+                return self.fetch_once(manifest, entry)
+            except FileNotFoundError:
+                raise
+            except Exception as e:
+                if attempt == num_attempts - 1:
+                    raise
+
+                delay = min(2 ** attempt, 60) * random.uniform(0.5, 1.0)
+                logging.warning(f"Retrying {entry['url']} in {delay:.1f} seconds ({e})")
+                time.sleep(delay)
+
+    def fetch_once(self, manifest, entry):
+        """
+        Download a file to a temp file, check it, and then move it into place.
+        """
+        path = os.path.join(self.root, entry['path'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        checksum = hashlib.md5()
+        size = 0
+
+        stream, content_length = self.open(entry['url'])
+
+        try:
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='.download-', delete=False) as file:
+                try:
+                    while True:
+                        data = stream.read(1024 * 1024)
+
+                        if not data:
+                            break
+
+                        file.write(data)
+                        checksum.update(data)
+                        size += len(data)
+
+                    md5 = checksum.hexdigest()
+
+                    if content_length is not None and size != content_length:
+                        raise IOError(f"received {size} bytes, expected {content_length}")
+                    if entry['size'] is not None and size != entry['size']:
+                        raise IOError(f"size mismatch ({size} bytes, expected {entry['size']})")
+                    if entry['md5'] is not None and md5 != entry['md5']:
+                        raise IOError(f"checksum mismatch ({md5}, expected {entry['md5']})")
+                except BaseException:
+                    file.close()
+                    os.remove(file.name)
+                    raise
+        finally:
+            stream.close()
+
+        os.replace(file.name, path)
+        manifest.update(entry['path'], size, md5)
+
+    def open(self, url):
+        """
+        Open a URL for streaming, and return the (stream, content length).
+        Raises FileNotFoundError if the file doesn't exist (which doesn't get retried).
+        """
+        if url.startswith('s3://'):
+            bucket, key = url[len('s3://'):].split('/', 1)
+
+            try:
+                response = self.s3_client().get_object(Bucket=bucket, Key=key)
+            except Exception as e:
+                code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+
+                if code in ('404', 'NoSuchKey'):
+                    raise FileNotFoundError(f"{url} does not exist")
+
+                raise IOError(str(e))
+
+            return response['Body'], response.get('ContentLength')
+
+        try:
+            response = request.urlopen(url, timeout=self.timeout)
+        except error.HTTPError as e:
+            if e.code == 404:
+                raise FileNotFoundError(f"{url} does not exist")
+            raise IOError(str(e))
+        except error.URLError as e:
+            raise IOError(str(e.reason))
+
+        content_length = response.headers.get('Content-Length')
+        return response, int(content_length) if content_length is not None else None
+
+    def s3_client(self):
+        """
+        Create the (unsigned) S3 client on first use - boto3 is only needed for s3:// files.
+        """
+        with self.lock:
+            if self.s3 is None:
+                import boto3
+                from botocore import UNSIGNED
+                from botocore.config import Config
+
+                self.s3 = boto3.client('s3', endpoint_url=self.s3_endpoint,
+                                       config=Config(signature_version=UNSIGNED, max_pool_connections=self.num_workers))
+
+            return self.s3
+
+
+def file_md5(path):
+    """
+    Return the MD5 hex digest of a file.
+    """
+    md5 = hashlib.md5()
+
+    with open(path, 'rb') as file:
+        for data in iter(lambda: file.read(1024 * 1024), b''):
+            md5.update(data)
+
+    return md5.hexdigest()
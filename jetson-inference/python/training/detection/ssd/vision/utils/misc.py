@@ -43,3 +43,54 @@ def freeze_net_layers(net):
 def store_labels(path, labels):
     with open(path, "w") as f:
         f.write("\n".join(labels))
+
+
+def loader_args(device, num_workers, prefetch_factor=2):
+    """
+    Return the DataLoader options used for training - the workers are kept alive between epochs,
+    and the batches get loaded into pinned memory (for async copies) when training with CUDA.
+    """
+    args = dict(num_workers=num_workers, pin_memory=device.type == 'cuda')
+
+    if num_workers > 0:
+        args.update(persistent_workers=True, prefetch_factor=prefetch_factor)
+
+    return args
+
+
+def train_step(net, criterion, optimizer, images, boxes, labels, device, matcher=None, augmentation=None, scaler=None):
+    """
+    Run one training step on a batch, and return the (loss, regression loss, classification loss)
+    as a tensor on the device (so that the caller only syncs with the CPU when it needs them).
+
+    Parameters:
+        matcher (MatchPrior) -- match the priors to a padded batch on the device (see padded_detection_collate)
+        augmentation (BatchTrainAugmentation) -- augment the batch on the device (see batch_augmentation_collate)
+        scaler (GradScaler) -- train with automatic mixed precision (or None for FP32)
+    """
+    if augmentation is not None:
+        images, boxes, labels = augmentation(images, boxes, labels, device)
+
+    images = images.to(device, non_blocking=True)
+    boxes = boxes.to(device, non_blocking=True)
+    labels = labels.to(device, non_blocking=True)
+
+    if matcher is not None:
+        boxes, labels = matcher.match_batch(boxes, labels)
+
+    optimizer.zero_grad(set_to_none=True)
+
+    with torch.autocast(device.type, enabled=scaler is not None):
+        confidence, locations = net(images)
+        regression_loss, classification_loss = criterion(confidence.float(), locations.float(), labels, boxes)
+        loss = regression_loss + classification_loss
+
+    if scaler is not None:
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
+    else:
+        loss.backward()
+        optimizer.step()
+
+    return torch.stack([loss, regression_loss, classification_loss]).detach()
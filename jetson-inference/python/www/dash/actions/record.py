@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+
+from server import Server, Action, EventFilter
+
+
+class RecordClip(Action, EventFilter):
+    """
+    Action that saves a video clip of events (including the seconds before they began)
+    and supports event filtering.  The clip gets linked from the event in the events table.
+    """
+    def __init__(self):
+        super().__init__()
+
+    def on_event(self, event):
+        if self.filter(event) and event.clip is None and event.stream.recorder is not None:
+            event.stream.recorder.trigger(event)
@@ -24,18 +24,21 @@
 import os
 import dash
 import http
+import flask
+import time
 import pprint
+import threading
 import traceback
 
 import warnings  # supress dash_auth import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
 import dash_auth
 
-from dash import dcc, Input, Output
+from dash import dcc, Input, Output, State
 from dash.exceptions import PreventUpdate
 
 from config import config, print_config
-from server import Server
+from server import Server, PushChannel
 
 from layout import create_grid, create_navbar, create_alerts, create_stream_dialog, create_model_dialog, create_actions_dialog
 
@@ -66,25 +69,90 @@ app.layout = dash.html.Div([
     create_model_dialog(),
     create_actions_dialog(),
     dcc.Store(id='server_resources'),
-    dcc.Interval(id='server_refresh_timer', interval=config['dash']['refresh'])
+    dcc.Store(id='push_resources'),   # these stores get updated from the server's push channel (see assets/push.js)
+    dcc.Store(id='push_events'),
+    dcc.Store(id='push_alerts'),
+    dcc.Store(id='push_streams'),
 ], className='dbc')
 
 
+# the browsers share one connection per process to the backend's push channel (which limits them)
+push_channel = PushChannel(interval=config['server']['push_interval'], keyed=['events'])
+push_relay = None
+push_relay_lock = threading.Lock()
+
+def relay_push():
+    """
+    Thread that re-publishes the backend server's push channel to push_channel, and reconnects if it drops.
+    """
+    while True:
+        try:
+            response = Server.request('GET', '/push', stream=True)
+            
+            try:
+                response.raise_for_status()
+                push_channel.relay(response.iter_lines())
+            finally:
+                response.close()
+        except Exception as error:
+            print(f"[dash]   lost connection to the server's push channel, retrying ({error})")
+            
+        time.sleep(1.0)
+        
+@webserver.route('/push')
+def push():
+    """
+    Relay the backend server's push channel to the browser (server-sent events)
+    """
+    global push_relay
+    
+    with push_relay_lock:
+        if push_relay is None:
+            push_relay = threading.Thread(target=relay_push, name='push-relay', daemon=True)
+            push_relay.start()
+        
+    subscriber = push_channel.subscribe()
+    
+    response = flask.Response(push_channel.stream(subscriber), mimetype='text/event-stream', 
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+                              
+    response.call_on_close(lambda: push_channel.unsubscribe(subscriber))
+    return response
+
+
+@webserver.route('/clips/<name>')
+def clip(name):
+    """
+    Relay a video clip of an event from the backend server
+    """
+    response = Server.request('GET', f"/clips/{name}", stream=True)
+    
+    if not response.ok:
+        return '', response.status_code
+        
+    return flask.Response(response.iter_content(chunk_size=65536), mimetype=response.headers.get('Content-Type'),
+                          headers={'Content-Disposition': f'attachment; filename="{name}"'})
+                          
+                          
+@webserver.route('/stats/requests')
+def request_stats():
+    """
+    Return the latency histograms of the REST requests made to the backend server
+    """
+    return Server.request_stats()
+
+
 @app.callback(Output('server_resources', 'data'),
-              Input('server_refresh_timer', 'n_intervals'),
-              Input('server_resources', 'data'))
-def on_refresh(n_intervals, previous_resources):
+              Input('push_resources', 'data'),
+              State('server_resources', 'data'))
+def on_refresh(server_resources, previous_resources):
     """
-    Get the latest resources config from the server.
+    Receive the latest resources config from the server's push channel.
     This can trigger updates to the clientside nav structure.
     """
-    try:
-        server_resources = Server.request('/resources').json()
-    except Exception as error:
-        traceback.print_exc()
-        print(f"[dash]   error refreshing server resources")
+    if server_resources is None:
         raise PreventUpdate
-
+        
     if previous_resources is not None:
         if server_resources == previous_resources:
             raise PreventUpdate   # if the config hasn't changed, skip the update
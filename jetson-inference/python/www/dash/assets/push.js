@@ -0,0 +1,37 @@
+/*
+ * clientside handler for the server-sent events (SSE) push channel
+ * each message topic gets stored in the dcc.Store with id 'push_<topic>'
+ */
+(function() {
+	var topics = ['resources', 'events', 'alerts', 'streams'];
+	var source = null;
+	
+	function connect() {
+		if( !window.dash_clientside || !window.dash_clientside.set_props ) {
+			setTimeout(connect, 100);  // wait for the dash renderer to load
+			return;
+		}
+		
+		source = new EventSource('/push');
+		
+		topics.forEach(function(topic) {
+			source.addEventListener(topic, function(event) {
+				try {
+					window.dash_clientside.set_props('push_' + topic, {data: JSON.parse(event.data)});
+				} catch (e) {
+					console.error("push channel failed to update '" + topic + "'", e);
+				}
+			});
+		});
+		
+		source.onerror = function(event) {
+			console.warn("push channel disconnected, reconnecting...");  // EventSource reconnects automatically
+			
+			if( source.readyState == EventSource.CLOSED ) {
+				setTimeout(connect, 5000);  // except after an error response (like 503 from too many clients)
+			}
+		};
+	}
+	
+	connect();
+})();
@@ -29,7 +29,6 @@ config={
         'title' : 'Hello AI World',     # title of the dash app (used in browser title bar and navbar)
         'host' : '0.0.0.0',             # hostname/IP of the frontend webserver (ignored by gunicorn)
         'port' : 8050,                  # port used for the frontend webserver (ignored by gunicorn)
-        'refresh' : 2500,               # the interval at which the server state is refreshed
         'users' : {                     # to enable basic authentication logins, add username/password pairs here
             # 'username' : 'password',
         },
@@ -43,6 +42,22 @@ config={
         'ssl_cert' : None,              # path to PEM-encoded SSL/TLS certificate file for enabling HTTPS
         'ssl_key' : None,               # path to PEM-encoded SSL/TLS key file for enabling HTTPS
         'stun_server' : None,           # override the default WebRTC STUN server (stun.l.google.com:19302)
+        'action_workers' : 2,           # number of threads that run actions (0 runs them inline from the processing loop)
+        'action_queue_size' : 256,      # max number of pending events queued for actions before the oldest get dropped
+        'action_timeout' : 5.0,         # number of seconds an action can run for before it's flagged as stalled
+        'rest_threads' : 16,            # size of the REST server's thread pool (each push channel client holds one)
+        'push_interval' : 0.25,         # minimum number of seconds between updates sent to push channel clients
+        'push_clients' : 4,             # max number of push channel clients (the dash app shares one per process)
+        'startup_timeout' : 300.0,      # max number of seconds to wait for the server process to load and become ready
+        'clips' : {                     # options for recording event clips from the streams (set to None to disable)
+            'path' : os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data/clips'),
+            'preroll' : 5.0,            # number of seconds of video to keep from before an event begins
+            'postroll' : 10.0,          # number of seconds to record after an event begins
+            'max_bytes' : 16777216,     # max size of each stream's buffer of encoded frames (16MB)
+            'width' : 640,              # width that the frames get downscaled to for recording
+            'fps' : 15,                 # max framerate to record at
+            'quality' : 75,             # JPEG quality (1-100)
+        },
     }
 }
 
@@ -26,7 +26,6 @@ import dash_bootstrap_components as dbc
 from dash import dcc, html, Input, Output, State
 from dash.exceptions import PreventUpdate
 
-from server import Server
 from datetime import datetime
 
 
@@ -41,7 +40,6 @@ def create_alerts():
     return html.Div([
         dbc.Alert('Placeholder Text', color='#444444', style=style, dismissable=True, is_open=False, id='alerts'),
         dcc.Store(id='alert_count', data=0),
-        dcc.Interval(id='alert_timer', interval=1000)
     ])
 
 
@@ -49,13 +47,10 @@ def create_alerts():
                Output('alerts', 'is_open'),
                Output('alerts', 'duration'),
                Output('alert_count', 'data'),
-               Input('alert_timer', 'n_intervals'),
+               Input('push_alerts', 'data'),
                State('alert_count', 'data'))
-def refresh_alerts(n_intervals, alert_count):
-    request = Server.request('/status')
-    alerts = request.json()['alerts']
-    
-    if len(alerts) <= alert_count:
+def refresh_alerts(alerts, alert_count):
+    if alerts is None or len(alerts) <= alert_count:
         raise PreventUpdate
 
     children = []
@@ -22,7 +22,7 @@
 
 import dash
 
-from dash import dcc, html, dash_table, Input, Output
+from dash import dcc, html, dash_table, Input, Output, State
 from .card import create_card, card_callback
 
 from server import Server
@@ -40,7 +40,8 @@ def create_event_table():
         dict(id='6', name='Class', hideable=True, type='numeric'),
         dict(id='7', name='Label', hideable=True),
         dict(id='8', name='Score', hideable=True, type='numeric', format=dash_table.FormatTemplate.percentage(1)),
-        dict(id='9', name='Max Score', hideable=True, type='numeric', format=dash_table.FormatTemplate.percentage(1))
+        dict(id='9', name='Max Score', hideable=True, type='numeric', format=dash_table.FormatTemplate.percentage(1)),
+        dict(id='10', name='Clip', hideable=True, presentation='markdown'),
     ]
     
     """
@@ -73,7 +74,6 @@ def create_event_table():
             style_table={'overflowX': 'auto'},
             style_data={'font-size': 14},  #'font-family': 'monospace'
         ),
-        dcc.Interval(id='event_refresh_timer', interval=500)
     ]
     
     return create_card(
@@ -85,11 +85,9 @@ def create_event_table():
     )
 
 @dash.callback(Output('event_table', 'data'),
-               Input('event_refresh_timer', 'n_intervals'))
-def refresh_events(n_intervals):
-    request = Server.request('/events')
-    records = request.json()
-    
+               Input('push_events', 'data'),
+               State('event_table', 'data'))
+def refresh_events(push_events, table):
     #date_format = '%Y-%m-%d %H:%M:%S'
     #date_format = '%-I:%M:%S %p'
     date_format = '%H:%M:%S'
@@ -103,10 +101,24 @@ def refresh_events(n_intervals):
         
         for n in range(3, 10):
             d[str(n)] = event[n]
-        
+            
+        if event[10]:
+            d['10'] = f"[clip](/clips/{event[10]})"
+            
         return d
         
-    return [event_to_dict(event) for event in records]
+    # the push channel sends the rows of the events that changed, so merge those into the table
+    if table and push_events:
+        rows = {row['id']: row for row in table}
+        
+        for event in push_events.values():
+            rows[event[0]] = event_to_dict(event)
+            
+        if len(rows) == max(rows) + 1:   # otherwise an update was missed (the IDs are sequential)
+            return list(rows.values())
+        
+    request = Server.request('/events?history=0')
+    return [event_to_dict(event) for event in request.json()]
            
 @card_callback(Input('navbar_event_table', 'n_clicks'))
 def open_events(n_clicks):
@@ -20,7 +20,9 @@
 # DEALINGS IN THE SOFTWARE.
 #
 
+import re
 import dash
+import numpy as np
 import plotly.graph_objects as go
 
 from dash import dcc, html, Input, Output
@@ -29,16 +31,17 @@ from dash_bootstrap_templates import load_figure_template
 from .card import create_card, card_callback
 
 from server import Server
-from datetime import datetime
+from datetime import datetime, timezone
 
 
 load_figure_template('darkly')
 
+TIMELINE_WIDTH=1000   # the number of points per label requested from the server (roughly the plot width in pixels)
+
 
 def create_event_timeline():  
     children = [
         dcc.Graph(id='event_timeline_graph'), #, animate=True),
-        dcc.Interval(id='event_timeline_timer', interval=500)
     ]
     
     return create_card(
@@ -51,42 +54,62 @@ def create_event_timeline():
    
    
 @dash.callback(Output('event_timeline_graph', 'figure'),
-               Input('event_timeline_timer', 'n_intervals'))
-def refresh_timeline(n_intervals):
-    request = Server.request('/events')
-    records = request.json()
-    classes = {}
-
-    for event in records:
-        label = event[7]
+               Input('push_events', 'data'),
+               Input('event_timeline_graph', 'relayoutData'))
+def refresh_timeline(push_events, relayout_data):
+    # the x-axis is plotted in local time, so shift the epoch timestamps by the UTC offset
+    utc_offset = datetime.now().astimezone().utcoffset().total_seconds()
+    params = {'width': TIMELINE_WIDTH}
+    
+    # when zoomed in, only request the visible time range
+    if relayout_data and 'xaxis.range[0]' in relayout_data:
+        begin = axis_to_epoch(relayout_data['xaxis.range[0]'], utc_offset)
+        end = axis_to_epoch(relayout_data.get('xaxis.range[1]'), utc_offset)
         
-        if label not in classes:
-            classes[label] = {'x': [], 'y': []}
-            
-        for timestamp, score in event[10]:
-            classes[label]['x'].append(datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f'))
-            classes[label]['y'].append(score * 100)
-
-        classes[label]['x'].append(None)
-        classes[label]['y'].append(None)
+        if begin is not None and end is not None:   # otherwise fall back to the full range
+            params['begin'] = begin
+            params['end'] = end
+        
+    request = Server.request('/events/timeline', params=params)
+    timeline = request.json()
 
     fig = go.Figure()
     
     def short_label(label, length=15):
         return f"{label[0:length]}..." if len(label) > length else label
     
-    for label, data in classes.items():
-        fig.add_trace(go.Scatter(name=short_label(label), x=data['x'], y=data['y'], connectgaps=False))
+    for label, data in timeline.items():
+        x = (np.array(data['time'], dtype=np.float64) + utc_offset) * 1000   # None -> NaN for the gaps
+        y = np.array(data['score'], dtype=np.float64) * 100
+        fig.add_trace(go.Scatter(name=short_label(label), x=x, y=y, connectgaps=False))
 
     fig.update_layout(
         template='darkly',
         margin={'l': 0, 'r': 0, 't': 0, 'b': 0},
-        #'uirevision': 0,  # https://community.plotly.com/t/preserving-ui-state-like-zoom-in-dcc-graph-with-uirevision-with-dash/15793
+        xaxis={'type': 'date'},
+        uirevision='event_timeline',  # preserve the zoom between updates (https://community.plotly.com/t/preserving-ui-state-like-zoom-in-dcc-graph-with-uirevision-with-dash/15793)
     )
     
     return fig
 
            
+def axis_to_epoch(value, utc_offset):
+    """
+    Convert a value from the plot's date axis (in local time) to epoch seconds.
+    Returns None if the value can't be parsed.
+    """
+    if isinstance(value, (int, float)):
+        return value / 1000 - utc_offset
+        
+    # before Python 3.11, fromisoformat() only accepts 3 or 6 digits of fractional seconds,
+    # but plotly can use any number of them - so pad/truncate the fraction to 6 digits
+    try:
+        value = re.sub(r'\.(\d+)', lambda match: '.' + match.group(1)[:6].ljust(6, '0'), value.strip(), count=1)
+        return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp() - utc_offset
+    except (ValueError, TypeError, AttributeError):
+        return None
+    
+    
 @card_callback(Input('navbar_event_timeline', 'n_clicks'))
 def open_timeline(n_clicks):
     if n_clicks > 0:
@@ -2,7 +2,11 @@
 from .server import Server
 from .stream import Stream
 from .action import Action
-from .filter import EventFilter
+from .filter import EventFilter, EventFilterIndex
+from .executor import ActionExecutor
+from .push import PushChannel
+from .timeline import event_timeline
+from .recorder import ClipRecorder
 
 from .event import Event
 from .model import Model
@@ -29,13 +29,15 @@ class Action:
     Users should inherit from this class and implement their own logic in on_event()
     Any @property attributes are automatically configurable from the webpage UI.
     """
-    def __init__(self, name=None, enabled=False, **kwargs):
+    def __init__(self, name=None, enabled=False, timeout=None, **kwargs):
         super(Action, self).__init__()
         
         self.id = -1
         self.type = None 
         self.name = name 
         self.enabled = enabled
+        self.timeout = timeout   # max seconds on_event() may run for (None uses the server's default)
+        self.stats = {'runs': 0, 'errors': 0, 'timeouts': 0, 'runtime': 0.0}
 
     def on_event(self, event):
         pass
@@ -46,6 +48,7 @@ class Action:
             'name': self.name,
             'type': self.type['name'],
             'enabled': self.enabled,
+            'stats': self.stats,
             'properties': {} #copy.deepcopy(self.type['properties'])  # Python 3.6:  TypeError: can't pickle property objects
         }
         
@@ -21,15 +21,27 @@
 #
 
 from time import time
+from array import array
 from server import Server
+from jetson_utils import Log
 
+import numpy as np
 import traceback
 
 
 class Event:
     """
     Represents a classification/detection event.
+    
+    The score history is kept in two growable arrays of doubles (times and scores) instead of
+    a list of tuples.  They're stored together in the history tuple, which gets replaced with a
+    single assignment when it's decimated, so that readers on other threads see a matching pair.  When compression is enabled, runs of equal scores only keep their first 
+    and last samples, and once the history reaches max_history samples it gets decimated by 2
+    (after which only every other update is recorded, and so on).
     """
+    max_history = 8192    # the max number of samples kept in the score history of each event
+    compress = True       # merge runs of equal scores (this doesn't change the plotted line)
+    
     def __init__(self, stream, model, classID, label, score):
         """
         Create a new event
@@ -45,10 +57,13 @@ class Event:
         self.begin = time()
         self.end = self.begin
         self.frames = 0
-        self.scores = [(self.begin,score)]
+        self.stride = 1   # record every Nth update (this doubles each time the history is decimated)
+        self.history = (array('d', [self.begin]), array('d', [score]))   # (times, scores)
+        self.clip = None   # the filename of the video clip recorded for this event (see ClipRecorder)
         
         Server.instance.events.append(self)
         self.dispatch()
+        self.publish()
                     
     def update(self, score):
         """
@@ -57,26 +72,90 @@ class Event:
         self.end = time()
         self.score = score
         self.maxScore = max(self.maxScore, score)
-        self.scores.append((self.end, score))
         self.frames += 1
+        self.add_score(self.end, score)
         self.dispatch()
+        self.publish()
+        
+    def add_score(self, time, score):
+        """
+        Append a sample to the score history.
+        """
+        times, scores = self.history
+        count = len(scores)
+        
+        # extend a run of equal scores by moving it's last sample
+        if Event.compress and count >= 2 and scores[-1] == score and scores[-2] == score:
+            times[-1] = time
+            return
+            
+        # between the recorded updates, the last sample tracks the latest score
+        if self.frames % self.stride != 0 and count >= 2:
+            times[-1] = time
+            scores[-1] = score
+            return
+            
+        times.append(time)
+        scores.append(score)
+        
+        if len(scores) >= Event.max_history:
+            self.decimate()
+            
+    def decimate(self):
+        """
+        Halve the resolution of the score history (the first and last samples are always kept).
+        """
+        times, scores = self.history
+        decimated = (times[::2], scores[::2])
+        
+        if (len(scores) - 1) % 2 != 0:
+            decimated[0].append(times[-1])
+            decimated[1].append(scores[-1])
+            
+        self.history = decimated   # swap both arrays at once
+        self.stride *= 2
+        
+    def get_scores(self):
+        """
+        Return a copy of the score history as a pair of (times, scores) NumPy arrays.
+        This is safe to call while the event is being updated from another thread.
+        """
+        times, scores = self.history   # read once, so the arrays always come from the same history
+        count = min(len(times), len(scores))   # a sample may be getting appended
+        return np.frombuffer(times[:count], dtype=np.float64), np.frombuffer(scores[:count], dtype=np.float64)
         
     def dispatch(self):
         """
-        Send this event to actions for processing
+        Send this event to actions for processing.  If the server has an action executor,
+        the actions get run asynchronously on it's worker threads, otherwise they run inline.
+        """
+        if Server.instance.action_executor is not None:
+            Server.instance.action_executor.submit(self)
+            return
+            
+        for action in Server.instance.action_index.match(self):
+            try:
+                action.on_event(self)
+            except Exception as error:
+                Log.Error(f"[{Server.instance.name}] failed to run action {action.name}")
+                traceback.print_exc()
+        
+    def publish(self):
+        """
+        Mark the events as changed and send the event's row to clients of the push channel
+        (they get merged by ID, so the clients don't need to request all the events again)
         """
-        for action in Server.instance.actions:
-            if action.enabled:
-                try:
-                    action.on_event(self)
-                except Exception as error:
-                    Log.Error(f"[{Server.instance.name}] failed to run action {action.name}")
-                    traceback.print_exc()
+        Server.instance.events_version += 1
         
+        if Server.instance.push is not None:
+            Server.instance.push.publish('events', self.to_list(history=False), key=self.id)
+            
     def to_dict(self):
         """
         Return a dict representation of the event
         """
+        times, scores = self.get_scores()
+        
         return {
             'id': self.id,
             'begin': self.begin,
@@ -88,14 +167,15 @@ class Event:
             'label': self.label,
             'score': self.score,
             'maxScore': self.maxScore,
-            'scores': self.scores,
+            'clip': self.clip,
+            'scores': [times.tolist(), scores.tolist()],
         }
       
-    def to_list(self):
+    def to_list(self, history=True):
         """
-        Return a list representation of the event
+        Return a list representation of the event (the score history is omitted if history=False)
         """
-        return [
+        event = [
             self.id,
             self.begin,
             self.end,
@@ -106,5 +186,11 @@ class Event:
             self.label,
             self.score,
             self.maxScore,
-            self.scores
+            self.clip,
         ]
+        
+        if history:
+            times, scores = self.get_scores()
+            event.append([times.tolist(), scores.tolist()])
+            
+        return event
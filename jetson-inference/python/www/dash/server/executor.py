@@ -0,0 +1,302 @@
+#
+# Copyright (c) 2022, NVIDIA CORPORATION. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+from jetson_utils import Log
+
+from collections import deque
+from time import time, sleep
+
+import traceback
+import threading
+
+
+class ActionExecutor:
+    """
+    Runs actions on a pool of worker threads so that Event.dispatch() never blocks
+    the inferencing loop.  Each (action, event) pair is queued at most once - if an
+    event gets updated again before the action has processed it, the pending entry
+    is coalesced and the action only sees the latest state of the event.
+
+    When the queue is full, the oldest pending entry is dropped (backpressure).
+    Actions that run longer than their timeout are flagged and their worker is
+    replaced, so that one stalled action can't starve the others.  Dispatch to a
+    stalled action is suspended (its entries stay deferred) until its thread
+    actually returns, so an action that hangs on every event only holds one
+    thread, and at most max_stalled workers get replaced at once.
+    """
+    def __init__(self, server, workers=2, queue_size=256, timeout=5.0, max_stalled=8):
+        """
+        Create the executor and start the worker threads.
+
+        Parameters:
+            server (Server) -- the backend server instance
+            workers (int) -- the number of worker threads that run actions
+            queue_size (int) -- the maximum number of pending (action, event) pairs
+            timeout (float) -- the default number of seconds an action may run for
+            max_stalled (int) -- the max number of timed-out threads to replace with new workers
+        """
+        self.server = server
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.num_workers = workers
+        self.max_stalled = max_stalled
+
+        self.pending = {}        # (action.id, event.id) -> enqueue time
+        self.order = deque()     # FIFO of pending keys
+        self.deferred = {}       # (action.id, event.id) -> enqueue time, for pairs that are already running
+        self.running = {}        # worker thread -> (action, event, start time)
+        self.stalled = {}        # timed-out worker thread -> (action, event, start time)
+        self.condition = threading.Condition()
+
+        self.stats = {
+            'submitted': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'processed': 0,
+            'errors': 0,
+            'timeouts': 0,
+            'suspended': 0,
+            'lag_max': 0.0,
+            'lag_avg': 0.0,
+        }
+
+        self.workers = []
+        self.run_flag = True
+
+        for n in range(workers):
+            self._add_worker()
+
+        self.watchdog = threading.Thread(target=self._watchdog, name=f"{self.server.name}-actions-watchdog", daemon=True)
+        self.watchdog.start()
+
+    def submit(self, event):
+        """
+        Queue an event to be processed by each of the enabled actions whose filters match it.
+        This returns immediately and is safe to call from the processing loop.
+        """
+        now = time()
+
+        with self.condition:
+            for action in self.server.action_index.match(event):
+                key = (action.id, event.id)
+                self.stats['submitted'] += 1
+
+                if key in self.pending or key in self.deferred:
+                    self.stats['coalesced'] += 1
+                    continue
+
+                if len(self.order) >= self.queue_size:
+                    self.pending.pop(self.order.popleft(), None)
+                    self.stats['dropped'] += 1
+
+                self.pending[key] = now
+                self.order.append(key)
+
+            self.condition.notify_all()
+
+    def stop(self):
+        """
+        Signal the worker threads to exit.
+        """
+        with self.condition:
+            self.run_flag = False
+            self.condition.notify_all()
+
+    def get_stats(self):
+        """
+        Return a dict of the executor's queue and lag metrics.
+        """
+        now = time()
+
+        with self.condition:
+            stats = dict(self.stats)
+            stats['queued'] = len(self.order)
+            stats['queue_size'] = self.queue_size
+            stats['workers'] = len(self.workers)
+            stats['busy'] = len(self.running)
+            stats['stalled'] = len(self.stalled)
+            stats['lag'] = (now - self.pending[self.order[0]]) if len(self.order) > 0 else 0.0
+
+        return stats
+
+    def _add_worker(self):
+        """
+        Start a new worker thread.
+        """
+        worker = threading.Thread(target=self._run_worker, name=f"{self.server.name}-actions-{len(self.workers)}", daemon=True)
+        self.workers.append(worker)
+        worker.start()
+
+    def _next(self):
+        """
+        Block until there's a pending (action, event) pair and return it (or None when stopped).
+        """
+        with self.condition:
+            while self.run_flag:
+                while len(self.order) > 0:
+                    key = self.order.popleft()
+                    enqueued = self.pending.pop(key)
+                    action_id, event_id = key
+
+                    if action_id >= len(self.server.actions) or event_id >= len(self.server.events):
+                        continue
+
+                    action = self.server.actions[action_id]
+                    event = self.server.events[event_id]
+
+                    if not action.enabled:
+                        continue
+
+                    if self._is_running(action, event):
+                        self.deferred[key] = enqueued  # an action never runs concurrently on the same event
+                        continue
+
+                    if self._is_stalled(action):
+                        self.deferred[key] = enqueued  # wait until the stalled action returns
+                        self.stats['suspended'] += 1
+                        continue
+
+                    lag = time() - enqueued
+                    self.stats['lag_max'] = max(self.stats['lag_max'], lag)
+                    self.stats['lag_avg'] = self.stats['lag_avg'] * 0.9 + lag * 0.1
+                    self.running[threading.current_thread()] = (action, event, time())
+
+                    return action, event
+
+                self.condition.wait()
+
+        return None
+
+    def _is_running(self, action, event):
+        """
+        Return true if the action is currently being run on the event
+        (including by a worker that timed out, but hasn't returned yet).
+        """
+        for running_action, running_event, start in (*self.running.values(), *self.stalled.values()):
+            if running_action is action and running_event is event:
+                return True
+        return False
+
+    def _is_stalled(self, action):
+        """
+        Return true if the action timed out on an event, and hasn't returned yet.
+        """
+        for stalled_action, stalled_event, start in self.stalled.values():
+            if stalled_action is action:
+                return True
+        return False
+
+    def _requeue_action(self, action):
+        """
+        Move all of an action's deferred entries back into the queue (once it's no longer stalled).
+        """
+        for key in [key for key in self.deferred if key[0] == action.id]:
+            self.pending[key] = self.deferred.pop(key)
+            self.order.append(key)
+
+        self.condition.notify_all()
+
+    def _requeue_deferred(self, action, event):
+        """
+        Move a deferred (action, event) pair back into the queue once it's no longer running.
+        """
+        key = (action.id, event.id)
+
+        if key in self.deferred:
+            self.pending[key] = self.deferred.pop(key)
+            self.order.append(key)
+            self.condition.notify()
+
+    def _run_worker(self):
+        """
+        Worker thread loop that runs actions.
+        """
+        thread = threading.current_thread()
+
+        while True:
+            job = self._next()
+
+            if job is None:
+                return
+
+            action, event = job
+            start = time()
+            failed = False
+
+            try:
+                action.on_event(event)
+            except Exception as error:
+                Log.Error(f"[{self.server.name}] failed to run action {action.name}")
+                traceback.print_exc()
+                failed = True
+
+            runtime = time() - start
+
+            with self.condition:
+                self.stats['processed'] += 1
+                self.stats['errors'] += int(failed)
+                action.stats['runs'] += 1
+                action.stats['errors'] += int(failed)
+                action.stats['runtime'] = action.stats['runtime'] * 0.9 + runtime * 0.1
+
+                if self.running.pop(thread, None) is None:
+                    self.stalled.pop(thread, None)
+
+                    if not self._is_stalled(action):
+                        Log.Info(f"[{self.server.name}] action {action.name} returned after timing out, resuming it")
+                        self._requeue_action(action)
+
+                    if len(self.workers) < self.num_workers:
+                        self.workers.append(thread)  # rejoin the pool if this worker wasn't replaced
+                        continue
+
+                    return  # this worker timed out and was already replaced
+
+                self._requeue_deferred(action, event)
+
+    def _watchdog(self):
+        """
+        Periodically check for actions that have exceeded their timeout.
+        """
+        while self.run_flag:
+            sleep(max(min(self.timeout * 0.25, 1.0), 0.05))
+            now = time()
+
+            with self.condition:
+                for thread, (action, event, start) in list(self.running.items()):
+                    timeout = getattr(action, 'timeout', None) or self.timeout
+
+                    if now - start < timeout:
+                        continue
+
+                    Log.Warning(f"[{self.server.name}] action {action.name} timed out after {now-start:.1f} seconds processing event {event.id}")
+
+                    # the action stays suspended until the stalled thread returns (in _run_worker)
+                    self.stalled[thread] = self.running.pop(thread)
+                    self.workers.remove(thread)
+                    self.stats['timeouts'] += 1
+                    action.stats['timeouts'] += 1
+
+                    if len(self.stalled) <= self.max_stalled:
+                        self._add_worker()
+                    else:
+                        Log.Warning(f"[{self.server.name}] {len(self.stalled)} actions are stalled, not replacing their workers (max_stalled={self.max_stalled})")
@@ -31,7 +31,7 @@ class EventFilter:
         Initialize a new filter.
         """
         super(EventFilter, self).__init__()
-        self._labels = labels
+        self.labels = labels
         self._min_frames = min_frames
         self._min_score = min_score
         
@@ -39,7 +39,7 @@ class EventFilter:
         """
         Return true if an event passes the filter, otherwise false.
         """
-        if len(self._labels) > 0 and event.label not in self._labels:
+        if len(self._label_set) > 0 and event.label not in self._label_set:
             return False
             
         if self._min_frames and event.frames < self._min_frames:
@@ -58,9 +58,11 @@ class EventFilter:
     def labels(self, labels):
         if isinstance(labels, str):
             self._labels = labels.split(';')
-            self._labels = [label.strip() for label in self._labels]
+            self._labels = [label.strip() for label in self._labels if label.strip()]
         else:
-            self._labels = labels
+            self._labels = list(labels)
+            
+        self._label_set = frozenset(self._labels)
         
     @property
     def min_frames(self) -> int:
@@ -74,6 +76,63 @@ class EventFilter:
     def min_score(self) -> float:
         return self._min_score
         
-    @min_frames.setter
+    @min_score.setter
     def min_score(self, min_score):
-        self._min_score = float(min_score)       
\ No newline at end of file
+        self._min_score = float(min_score)
+        
+
+class EventFilterIndex:
+    """
+    Inverted index from event labels to the enabled actions that can match them.
+    Actions that inherit from EventFilter are only dispatched events with one of their
+    labels (and that meet their thresholds), while other actions receive every event.
+    This keeps the per-event dispatch cost independent of the number of unrelated actions.
+    
+    The index is rebuilt with build() whenever actions get added or reconfigured.
+    """
+    def __init__(self, actions=[]):
+        self.build(actions)
+        
+    def build(self, actions):
+        """
+        Compile the filters of the enabled actions into the index.
+        """
+        labels = {}     # label -> [(action, min_frames, min_score)]
+        wildcard = []   # [(action, min_frames, min_score)] for actions that match any label
+        
+        for action in actions:
+            if not action.enabled:
+                continue
+                
+            if isinstance(action, EventFilter):
+                entry = (action, action._min_frames, action._min_score)
+                
+                if len(action._label_set) == 0:
+                    wildcard.append(entry)
+                    
+                for label in action._label_set:
+                    labels.setdefault(label, []).append(entry)
+            else:
+                wildcard.append((action, None, None))
+        
+        # swap in the new index all at once so that match() never sees a partial one
+        self._index = (labels, wildcard)
+        
+    def match(self, event):
+        """
+        Return the list of actions whose filters can match the event.
+        """
+        labels, wildcard = self._index
+        actions = []
+        
+        for entries in (labels.get(event.label, ()), wildcard):
+            for action, min_frames, min_score in entries:
+                if min_frames and event.frames < min_frames:
+                    continue
+                    
+                if min_score and event.maxScore < min_score:
+                    continue
+                    
+                actions.append(action)
+                
+        return actions       
\ No newline at end of file
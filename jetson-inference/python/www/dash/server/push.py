@@ -0,0 +1,158 @@
+#
+# Copyright (c) 2022, NVIDIA CORPORATION. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+from time import time, sleep
+
+import json
+import threading
+
+
+class PushChannel:
+    """
+    Server-Sent Events (SSE) channel that pushes state changes (events, alerts, stream stats)
+    to the clients, so that the frontend doesn't need to poll the REST API on timers.
+
+    Messages are published under a topic, and only the latest message for each topic is kept
+    per-subscriber until it gets sent - so a slow client never backs up the processing loop,
+    and high-rate updates get coalesced down to at most one message per topic every interval.
+    Messages published with a key get merged into a {key: data} dict instead, so that updates
+    to different keys (like the rows of the events table) don't get coalesced away.  These are
+    only sent to the clients that were connected at the time (new clients should get the full
+    state from the REST API).
+    
+    Each client holds a thread of the webserver while it's connected, so the number of them
+    is limited to max_subscribers (subscribe() returns None past that).
+    """
+    def __init__(self, interval=0.25, keepalive=15.0, max_subscribers=None, keyed=()):
+        """
+        Parameters:
+            interval (float) -- the minimum number of seconds between messages sent to a client
+            keepalive (float) -- send an SSE comment after this many seconds of no messages
+            max_subscribers (int) -- the max number of clients connected at once (None for unlimited)
+            keyed (list[str]) -- topics that get published with keys (only needed for relay())
+        """
+        self.interval = interval
+        self.keepalive = keepalive
+        self.max_subscribers = max_subscribers
+        self.subscribers = []
+        self.latest = {}   # topic -> the last message, sent to new subscribers when they connect (except keyed topics)
+        self.keyed = set(keyed)  # the topics that get published with keys
+        self.lock = threading.Lock()
+
+    def publish(self, topic, data, key=None):
+        """
+        Publish a message to all subscribers.  This never blocks on the clients.
+        If a key is given, the message gets merged with the other keys of the topic.
+        """
+        with self.lock:
+            if key is None:
+                self.latest[topic] = data
+            else:
+                self.keyed.add(topic)
+
+            for subscriber in self.subscribers:
+                with subscriber['condition']:
+                    self._merge(subscriber['pending'], topic, data, key)
+                    subscriber['condition'].notify()
+
+    @staticmethod
+    def _merge(messages, topic, data, key):
+        if key is None:
+            messages[topic] = data
+        else:
+            messages.setdefault(topic, {})[key] = data
+            
+    def subscribe(self):
+        """
+        Register a new client and return it's subscriber (or None if there are already max_subscribers).
+        Then stream() it as the body of the response, and unsubscribe() it when the response closes.
+        """
+        with self.lock:
+            if self.max_subscribers is not None and len(self.subscribers) >= self.max_subscribers:
+                return None
+                
+            subscriber = {
+                'pending': dict(self.latest),
+                'condition': threading.Condition()
+            }
+            
+            self.subscribers.append(subscriber)
+            return subscriber
+            
+    def unsubscribe(self, subscriber):
+        """
+        Remove a client (this can safely be called more than once)
+        """
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+                
+    def stream(self, subscriber):
+        """
+        Generator that yields SSE-formatted messages for one client until it disconnects.
+        Use it as the body of a streaming response with mimetype='text/event-stream'.
+        """
+        try:
+            yield f"retry: 1000\n\n"
+
+            while True:
+                with subscriber['condition']:
+                    if len(subscriber['pending']) == 0:
+                        subscriber['condition'].wait(self.keepalive)
+
+                    pending = subscriber['pending']
+                    subscriber['pending'] = {}
+
+                if len(pending) == 0:
+                    yield f": keepalive {time()}\n\n"
+                    continue
+
+                for topic, data in pending.items():
+                    yield f"event: {topic}\ndata: {json.dumps(data)}\n\n"
+
+                sleep(self.interval)  # rate-limit (updates get coalesced in the meantime)
+        finally:
+            self.unsubscribe(subscriber)
+            
+    def relay(self, lines):
+        """
+        Re-publish the messages read from another push channel's SSE stream (an iterator over it's lines),
+        so that many clients can share one connection to it.  This returns when the stream ends.
+        """
+        topic = None
+        
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+                
+            if line.startswith('event:'):
+                topic = line[6:].strip()
+            elif line.startswith('data:') and topic is not None:
+                data = json.loads(line[5:])
+                
+                if topic in self.keyed:
+                    for key, value in data.items():
+                        self.publish(topic, value, key=key)
+                else:
+                    self.publish(topic, data)
+            elif len(line) == 0:
+                topic = None
@@ -0,0 +1,284 @@
+#
+# Copyright (c) 2022, NVIDIA CORPORATION. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+from jetson_utils import cudaAllocMapped, cudaResize, cudaToNumpy, cudaDeviceSynchronize, Log
+
+from collections import deque
+from time import time
+
+import os
+import queue
+import threading
+import traceback
+
+
+class ClipRecorder:
+    """
+    Keeps a ring buffer of the most recent frames of a stream (JPEG-encoded and bounded by size),
+    so that when an event gets triggered, a video clip can be saved that starts before the event.
+
+    The frames are downscaled on the GPU from the processing loop and then encoded and written on
+    a background thread.  If the recorder thread falls behind, frames get dropped instead of
+    blocking the stream.  Clips are saved as Motion JPEG files (concatenated JPEG frames).
+    """
+    def __init__(self, stream, path, preroll=5.0, postroll=10.0, max_bytes=16*1024*1024,
+                 width=640, fps=15, quality=75, **kwargs):
+        """
+        Parameters:
+            stream (Stream) -- the stream to record
+            path (string) -- the directory to save the clips under
+            preroll (float) -- the number of seconds to keep before an event
+            postroll (float) -- the number of seconds to record after an event begins
+            max_bytes (int) -- the max size of the ring buffer of encoded frames
+            width (int) -- the width to downscale the frames to (the aspect ratio is kept)
+            fps (float) -- the max framerate to record at
+            quality (int) -- the JPEG quality (1-100)
+        """
+        import cv2
+
+        self.cv2 = cv2
+        self.stream = stream
+        self.path = path
+        self.preroll = preroll
+        self.postroll = postroll
+        self.max_bytes = max_bytes
+        self.width = width
+        self.interval = 1.0 / fps if fps else 0
+        self.quality = quality
+
+        self.ring = deque()      # (timestamp, jpeg bytes)
+        self.ring_bytes = 0
+        self.clips = []          # clips that are being recorded
+        self.lock = threading.Lock()
+
+        self.pool = []           # downscaled images, reused round-robin
+        self.pool_index = 0
+        self.queue = queue.Queue(maxsize=2)  # must be smaller than the pool, so images aren't reused while queued
+        self.last_frame = 0
+        self.dropped = 0
+        self.run_flag = True
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self.thread = threading.Thread(target=self.run, name=f"{stream.server.name}-recorder{stream.name.replace('/', '-')}", daemon=True)
+        self.thread.start()
+
+    def add_frame(self, img):
+        """
+        Add a frame to the recording (this gets called from the processing loop and never blocks)
+        """
+        now = time()
+
+        if now - self.last_frame < self.interval:
+            return
+
+        if len(self.pool) == 0:
+            height = int(img.height * min(self.width, img.width) / img.width) // 2 * 2
+            width = min(self.width, img.width)
+            self.pool = [cudaAllocMapped(width=width, height=height, format=img.format) for n in range(self.queue.maxsize + 2)]
+
+        if self.queue.full():
+            self.dropped += 1
+            return
+
+        resized = self.pool[self.pool_index]
+        self.pool_index = (self.pool_index + 1) % len(self.pool)
+
+        cudaResize(img, resized)
+
+        self.queue.put_nowait((now, resized))
+        self.last_frame = now
+
+    def trigger(self, event):
+        """
+        Start recording a clip for an event, including the pre-roll.  Returns the path to the clip.
+        """
+        filename = f"{self.stream.name.strip('/').replace('/', '-')}-{event.id}-{int(event.begin)}.mjpeg"
+
+        clip = {
+            'event': event,
+            'path': os.path.join(self.path, filename),
+            'begin': event.begin - self.preroll,
+            'end': event.begin + self.postroll,
+            'file': None,
+        }
+
+        with self.lock:
+            self.clips.append(clip)
+
+        event.clip = filename
+        event.publish()
+        return clip['path']
+
+    def stop(self, timeout=5.0):
+        """
+        Stop the recorder thread, and close the clips that are still recording.
+        """
+        self.run_flag = False
+
+        try:
+            self.queue.put_nowait(None)   # wake up the thread
+        except queue.Full:
+            pass
+
+        self.thread.join(timeout)
+
+    def run(self):
+        """
+        Recorder thread that encodes the frames and writes the clips
+        """
+        try:
+            while self.run_flag:
+                self.process()
+        finally:
+            self.close_clips()
+
+    def process(self):
+        """
+        Encode the next frame from the queue and write it to the clips.  If the stream stops
+        sending frames, the clips that are past their end time get closed anyway.
+        """
+        try:
+            job = self.queue.get(timeout=1.0)
+        except queue.Empty:
+            self.close_clips(time())
+            return
+
+        if job is None:
+            return
+
+        timestamp, img = job
+
+        try:
+            cudaDeviceSynchronize()
+            array = cudaToNumpy(img)
+
+            if img.format.startswith('rgb'):
+                array = self.cv2.cvtColor(array, self.cv2.COLOR_RGBA2BGR if img.format == 'rgba8' else self.cv2.COLOR_RGB2BGR)
+
+            ok, jpeg = self.cv2.imencode('.jpg', array, [self.cv2.IMWRITE_JPEG_QUALITY, self.quality])
+
+            if not ok:
+                return
+
+            jpeg = jpeg.tobytes()
+
+            self.ring.append((timestamp, jpeg))
+            self.ring_bytes += len(jpeg)
+
+            while len(self.ring) > 1 and (self.ring_bytes > self.max_bytes or (timestamp - self.ring[0][0]) > self.preroll):
+                self.ring_bytes -= len(self.ring.popleft()[1])
+
+            self.write_clips(timestamp, jpeg)
+        except Exception as error:
+            Log.Error(f"[{self.stream.server.name}] failed to record frame from stream {self.stream.name}")
+            traceback.print_exc()
+
+    def write_clips(self, timestamp, jpeg):
+        """
+        Write the latest frame to the clips that are recording (or the pre-roll if they just started)
+        """
+        with self.lock:
+            clips = self.clips[:]
+
+        for clip in clips:
+            try:
+                if clip['file'] is None:
+                    clip['file'] = open(clip['path'], 'wb')
+
+                    for frame_timestamp, frame in self.ring:   # this includes the latest frame
+                        if frame_timestamp >= clip['begin']:
+                            clip['file'].write(frame)
+                else:
+                    clip['file'].write(jpeg)
+            except Exception as error:
+                Log.Error(f"[{self.stream.server.name}] failed to write clip {clip['path']} for event {clip['event'].id} ({error})")
+                self.discard_clip(clip)
+                continue
+
+            if timestamp >= clip['end']:
+                self.close_clip(clip)
+
+    def close_clip(self, clip):
+        """
+        Finish recording a clip and close its file.
+        """
+        with self.lock:
+            self.clips.remove(clip)
+
+        if clip['file'] is None:   # no frames were recorded for it
+            self.discard_clip(clip, remove=False)
+            return
+
+        try:
+            clip['file'].close()
+        except Exception as error:
+            Log.Error(f"[{self.stream.server.name}] failed to save clip {clip['path']} for event {clip['event'].id} ({error})")
+            self.discard_clip(clip, remove=False)
+            return
+
+        Log.Verbose(f"[{self.stream.server.name}] saved clip {clip['path']} for event {clip['event'].id} ({clip['event'].label})")
+
+    def close_clips(self, timestamp=None):
+        """
+        Close the clips that end before the timestamp (or all of them if it's None)
+        """
+        with self.lock:
+            clips = [clip for clip in self.clips if timestamp is None or timestamp >= clip['end']]
+
+        for clip in clips:
+            self.close_clip(clip)
+
+    def discard_clip(self, clip, remove=True):
+        """
+        Stop recording a clip that failed, delete its partial file, and unlink it from the event.
+        """
+        if remove:
+            with self.lock:
+                if clip in self.clips:
+                    self.clips.remove(clip)
+
+        if clip['file'] is not None:
+            try:
+                clip['file'].close()
+            except Exception:
+                pass
+
+        try:
+            os.remove(clip['path'])
+        except OSError:
+            pass
+
+        if clip['event'].clip == os.path.basename(clip['path']):
+            clip['event'].clip = None
+            clip['event'].publish()
+
+    def get_stats(self):
+        """
+        Return a dict with the status of the recorder
+        """
+        return {
+            'frames': len(self.ring),
+            'bytes': self.ring_bytes,
+            'dropped': self.dropped,
+            'recording': len(self.clips),
+        }
@@ -23,8 +23,10 @@
 import os
 import sys
 import time
-import random
+import fcntl
 import pprint
+import tempfile
+import contextlib
 
 import ssl
 import json
@@ -34,6 +36,7 @@ import urllib3
 import requests
 
 import psutil
+import hashlib
 import inspect
 import importlib
 import traceback
@@ -41,6 +44,9 @@ import threading
 import multiprocessing
 import setproctitle
 
+from urllib.parse import urlparse
+from collections import OrderedDict
+
 from jetson_utils import Log
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -74,10 +80,21 @@ class Server:
     instance = None   # singleton instance
     api = None        # flask REST server
     
+    session = None       # pooled keep-alive HTTP client used by Server.request()
+    session_pid = None   # the process the session was created in (sessions aren't shared across forks)
+    session_lock = threading.Lock()
+    
+    etag_cache = OrderedDict()   # URL -> last response, for conditional GET requests (If-None-Match)
+    etag_cache_size = 32         # the max number of responses kept in the cache (least-recently used get evicted)
+    latency = {}         # 'METHOD /path' -> latency histogram of Server.request()
+    latency_buckets = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0]  # seconds
+    
     def __init__(self, name='server-backend', host='0.0.0.0', 
                  rest_port=49565, webrtc_port=49567, 
                  ssl_cert=None, ssl_key=None, stun_server=None, 
-                 resources=None):
+                 resources=None, action_workers=2, action_queue_size=256, 
+                 action_timeout=5.0, rest_threads=16, push_interval=0.25, push_clients=4,
+                 startup_timeout=300.0, clips=None):
         """
         Create a new instance of the backend server.
         
@@ -90,6 +107,14 @@ class Server:
             ssl_key (string) -- path to PEM-encoded SSL/TLS key file for enabling HTTPS
             stun_server (string) -- override the default WebRTC STUN server (stun.l.google.com:19302)
             resources (string or dict) -- either a path a json config file or dict containing resources to load
+            action_workers (int) -- number of threads that run actions (0 runs them inline from the processing loop)
+            action_queue_size (int) -- max number of pending events queued for actions before the oldest get dropped
+            action_timeout (float) -- default number of seconds an action can run for before it's flagged as stalled
+            rest_threads (int) -- size of the REST server's thread pool (each push channel client holds one)
+            push_interval (float) -- minimum number of seconds between the updates sent to push channel clients
+            push_clients (int) -- max number of push channel clients at once (more get 503 Service Unavailable)
+            startup_timeout (float) -- max number of seconds to wait for the server process to load and become ready
+            clips (dict) -- options for recording event clips from the streams (see ClipRecorder), or None to disable
         """
         Server.instance = self
         self.name = name
@@ -99,7 +124,12 @@ class Server:
         self.webrtc_port = webrtc_port
         self.ssl_cert = ssl_cert
         self.ssl_key = ssl_key
+        self.rest_threads = rest_threads
         self.os_process = None  
+        self.ready_pipe = None           # the server process sends it's PID over this when it's ready (see start())
+        self.instance_lock = None        # lock file held by the server process while it's running
+        self.startup_timeout = startup_timeout
+        self.clips = clips
         self.run_flag = False            # this gets set to true when initialized successfully
         self.init_resources = resources  # these resources get loaded during init()
         self.resources = {
@@ -111,6 +141,17 @@ class Server:
         self.alerts = []
         self.actions = []
         self.action_types = {}
+        self.action_index = None
+        self.action_workers = action_workers
+        self.action_queue_size = action_queue_size
+        self.action_timeout = action_timeout
+        self.action_executor = None
+        self.events_version = 0   # incremented when events are created or updated (used for ETags)
+        self.push = None
+        self.push_interval = push_interval
+        self.push_clients = push_clients
+        self.stream_stats = {}
+        self.stream_stats_time = 0
         
     def init(self):
         """
@@ -120,12 +161,27 @@ class Server:
             setproctitle.setproctitle(multiprocessing.current_process().name)
             Log.Verbose(f"[{self.name}] started {self.name} process (pid={self.os_process.pid})")
 
+        # take the instance lock so that other processes can find this one
+        self.instance_lock = open(lock_file_path(self.name), 'a+')
+        
+        try:
+            fcntl.flock(self.instance_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(f"[{self.name}] another instance of the server is already running (pid={find_instance_pid(self.name)})")
+            
+        self.instance_lock.truncate(0)
+        self.instance_lock.write(str(os.getpid()))
+        self.instance_lock.flush()
+
         # create the REST server
         Server.api = flask.Flask(__name__)
         
         Server.api.add_url_rule('/status', view_func=self._get_status, methods=['GET'])
         Server.api.add_url_rule('/resources', view_func=self._get_resources, methods=['GET'])
         Server.api.add_url_rule('/events', view_func=self._get_events, methods=['GET'])
+        Server.api.add_url_rule('/events/timeline', view_func=self._get_events_timeline, methods=['GET'])
+        Server.api.add_url_rule('/clips/<name>', view_func=self._get_clip, methods=['GET'])
+        Server.api.add_url_rule('/push', view_func=self._get_push, methods=['GET'])
         
         Server.api.add_url_rule('/streams', view_func=self._get_streams, methods=['GET'])
         Server.api.add_url_rule('/streams', view_func=self._add_stream, methods=['POST'])
@@ -138,6 +194,7 @@ class Server:
         Server.api.add_url_rule('/actions', view_func=self._get_actions, methods=['GET'])
         Server.api.add_url_rule('/actions', view_func=self._add_action, methods=['POST'])
         Server.api.add_url_rule('/actions/types', view_func=self._get_action_types, methods=['GET'])
+        Server.api.add_url_rule('/actions/stats', view_func=self._get_action_stats, methods=['GET'])
         Server.api.add_url_rule('/actions/<int:id>', view_func=self._get_action, methods=['GET'])
         Server.api.add_url_rule('/actions/<int:id>', view_func=self._set_action, methods=['PUT'])
         
@@ -156,56 +213,98 @@ class Server:
         Server.api.json_encoder = MyJSONEncoder
         
         # start the REST server
-        self.api_thread = threading.Thread(target=lambda: Server.api.run(host=self.host, port=self.rest_port,
-                                           ssl_context=(self.ssl_cert, self.ssl_key) if self.ssl_cert else None),
-                                           name=f"{self.name}-rest")
+        from server import PushChannel
+        self.push = PushChannel(interval=self.push_interval, max_subscribers=self.push_clients)
+        
+        self.api_ready = threading.Event()
+        self.api_error = None
+        self.api_thread = threading.Thread(target=self.run_api, name=f"{self.name}-rest")
         self.api_thread.start()
         
+        if not self.api_ready.wait(timeout=10.0) or self.api_error is not None or not self.api_thread.is_alive():
+            Log.Error(f"[{self.name}] failed to start the REST server @ {self.rest_url} ({self.api_error or 'timed out'})")
+            raise RuntimeError(f"[{self.name}] failed to start the REST server @ {self.rest_url}")
+            
         Log.Info(f"[{self.name}] REST server is running @ {self.rest_url}")
         
+        # compile the action filters used to dispatch events
+        from server import EventFilterIndex
+        self.action_index = EventFilterIndex(self.actions)
+        
+        # start the threads that run actions asynchronously from the processing loop
+        if self.action_workers > 0:
+            from server import ActionExecutor
+            self.action_executor = ActionExecutor(self, workers=self.action_workers, 
+                                                  queue_size=self.action_queue_size,
+                                                  timeout=self.action_timeout)
+                                                  
         # load resources and extensions
         self.load_actions()
         self.load_resources(self.init_resources)
+        self.push.publish('resources', self.list_resources())
         
         # indicate that server is ready to run
         self.run_flag = True
         
-    def connect(self, autostart=True, retries=10):
+        if self.ready_pipe is not None:
+            self.ready_pipe.send(os.getpid())
+            self.ready_pipe.close()
+            self.ready_pipe = None
+            
+    def connect(self, autostart=True):
         """
         Attempt to connect to an existing instance of the server process.
         If one is not running, start it when autostart=True
+        
+        The server process is found from the lock file it holds while running, and the
+        lookup is serialized with a startup lock file so that when multiple processes
+        connect at once (like gunicorn workers), only one of them starts the server.
         """
-        if self.os_process is None:
-            time.sleep(random.uniform(0.5, 5.0))
+        with startup_lock(self.name):
+            pid = find_instance_pid(self.name)
+            
+            if pid is None:
+                if not autostart:
+                    raise RuntimeError(f"[{self.name}] couldn't find existing server process running")
+                    
+                Log.Verbose(f"[{self.name}] couldn't find existing server process running")
+                return self.start()
 
-        if autostart and not is_process_running(self.name):
-            Log.Verbose(f"[{self.name}] couldn't find existing server process running")
-            return self.start()
-        
-        # run a rest status query
-        retry_count = 0
-        
-        for retry_count in range(retries):
-            time.sleep(0.5)
+        # the server might have been launched separately and still be loading
+        status = self.wait_ready()
+        Log.Verbose(f"[{self.name}] {multiprocessing.current_process().name} (pid={os.getpid()}) connected to {self.name} process (pid={status['pid']})")
+     
+    def wait_ready(self, timeout=None):
+        """
+        Wait for the server to report that it's running from the /status query, and return the status.
+        """
+        if timeout is None:
+            timeout = self.startup_timeout
             
+        time_begin = time.monotonic()
+        delay = 0.01
+        
+        while True:
             try:
                 response = Server.request('GET', '/status')
                 status = response.json()
-                print(f"[{self.name}] server status:  {status}")
+                
                 if response.ok and status['running']:
-                    break
-                else:
-                    if retry_count == retries - 1:
-                        raise Exception(f"[{self.name}] failed to start running")
+                    return status
             except Exception as error:
-                traceback.print_exc()
+                if time.monotonic() - time_begin > timeout:
+                    raise
+                    
+            if time.monotonic() - time_begin > timeout:
+                raise RuntimeError(f"[{self.name}] timed out waiting for the server to start running")
                 
-        Log.Verbose(f"[{self.name}] {psutil.Process(os.getpid()).name()} (pid={os.getpid()}) connected to {self.name} process (pid={status['pid']})")
-     
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            
     def start(self):
         """
-        Launch the server running in a new process.
-        Returns the RPC proxy object for clients to call.
+        Launch the server running in a new process, and wait until it's ready.
+        The new process signals when it's finished initializing over a pipe.
         """  
         # we don't need the dash/webserver stuff, so use spawn instead of fork
         # TODO look into the memory savings/implications of this
@@ -213,11 +312,26 @@ class Server:
         # multiprocessing.set_start_method("spawn")  
     
         # start the process
+        ready_recv, self.ready_pipe = multiprocessing.Pipe(duplex=False)
+        
         self.os_process = multiprocessing.Process(target=self.run, name=self.name, daemon=True)  # use daemon=True so process automatically exits when parent process exits
         self.os_process.start()
-        time.sleep(1.0)
         
-        return self.connect(autostart=False)
+        self.ready_pipe.close()   # close this process's end so that recv() fails if the server process exits
+        self.ready_pipe = None
+        
+        # wait for the server to send it's PID when it's ready
+        if not ready_recv.poll(self.startup_timeout):
+            raise RuntimeError(f"[{self.name}] timed out waiting for the server process to start")
+            
+        try:
+            pid = ready_recv.recv()
+        except EOFError:
+            raise RuntimeError(f"[{self.name}] server process exited during startup (exitcode={self.os_process.exitcode})")
+        finally:
+            ready_recv.close()
+            
+        Log.Verbose(f"[{self.name}] {multiprocessing.current_process().name} (pid={os.getpid()}) connected to {self.name} process (pid={pid})")
         
     def stop(self):
         """
@@ -230,6 +344,44 @@ class Server:
         self.rpc_server.server_close()
         #self.process.join()
         
+    def run_api(self):
+        """
+        Run the REST server (this blocks, so it gets called from a thread by init()).
+        It uses the multi-threaded cheroot WSGI server when it's installed, and 
+        otherwise falls back to the Flask/Werkzeug development server.
+        
+        api_ready gets set once the socket is bound, or if the server failed to
+        start (in which case api_error is set to the exception).
+        """
+        try:
+            try:
+                from cheroot import wsgi
+            except ImportError:
+                Log.Warning(f"[{self.name}] cheroot isn't installed, falling back to the Flask development server (pip3 install cheroot)")
+                from werkzeug.serving import make_server
+                self.api_server = make_server(self.host, self.rest_port, Server.api, threaded=True,
+                                              ssl_context=(self.ssl_cert, self.ssl_key) if self.ssl_cert else None)
+                self.api_ready.set()
+                self.api_server.serve_forever()
+                return
+                
+            self.api_server = wsgi.Server((self.host, self.rest_port), Server.api, 
+                                          numthreads=self.rest_threads, server_name=self.name)
+            
+            if self.ssl_cert and self.ssl_key:
+                from cheroot.ssl.builtin import BuiltinSSLAdapter
+                self.api_server.ssl_adapter = BuiltinSSLAdapter(self.ssl_cert, self.ssl_key)
+                
+            self.api_server.prepare()   # bind the socket before signalling that the REST server is ready
+            self.api_ready.set()
+            self.api_server.serve()
+        except (Exception, SystemExit) as error:   # werkzeug exits when it can't bind
+            if self.api_ready.is_set():
+                raise
+            traceback.print_exc()
+            self.api_error = error
+            self.api_ready.set()
+        
     def run(self):
         """
         Run forever - this automatically gets called by the process when it starts.
@@ -240,6 +392,10 @@ class Server:
         while self.run_flag:
             self.process()
           
+        for stream in self.resources['streams'].values():
+            if stream.recorder is not None:
+                stream.recorder.stop()   # close the clips that are still recording
+                
         Log.Info(f"[{self.name}] stopped")
         
     def is_running(self):
@@ -257,12 +413,41 @@ class Server:
                 stream.process()
         else:
             time.sleep(1.0)
+            
+        if time.time() - self.stream_stats_time >= 1.0:
+            self.publish_stream_stats()
+            
+    def publish_stream_stats(self):
+        """
+        Compute the framerate of each stream and send it to the push channel.
+        """
+        now = time.time()
+        elapsed = now - self.stream_stats_time
+        stats = {}
+        
+        for name, stream in self.resources['streams'].items():
+            last_frames = self.stream_stats.get(name, {}).get('frames', stream.frame_count)
+            stats[name] = {
+                'frames': stream.frame_count,
+                'fps': (stream.frame_count - last_frames) / elapsed,
+            }
+            
+            if stream.recorder is not None:
+                stats[name]['recorder'] = stream.recorder.get_stats()
+            
+        self.stream_stats = stats
+        self.stream_stats_time = now
+        self.push.publish('streams', stats)
 
     @staticmethod
     def request(*args, **kwargs):
         """
         Wrapper around requests.request() that appends the server's address to the request URL.
         This can be used to make JSON REST API requests to the server without needing it's URL.
+        
+        Requests are made through a pooled keep-alive session, and GET requests for resources
+        that have an ETag are made conditional - if the server responds with 304 Not Modified,
+        the previously received response is returned instead.
         """
         args = list(args)
         
@@ -277,9 +462,104 @@ class Server:
                 args[1] = '/' + args[1]
             args[1] = f"{Server.instance.rest_url}{args[1]}"
 
-        kwargs['verify'] = False
+        method = args[0].upper()
+        url = args[1]
+        cached = None
+        conditional = (method == 'GET' and not kwargs.get('stream') and 'headers' not in kwargs)
+        
+        if conditional:
+            with Server.session_lock:
+                cached = Server.etag_cache.get(url)
+                
+                if cached is not None:
+                    Server.etag_cache.move_to_end(url)
+                    
+            if cached is not None:
+                kwargs['headers'] = {'If-None-Match': cached.headers['ETag']}
+                
+        time_begin = time.perf_counter()
+        response = Server.get_session().request(*args, **kwargs)
+        Server.record_latency(f"{method} {urlparse(url).path}", time.perf_counter() - time_begin)
         
-        return requests.request(*args, **kwargs)
+        if not conditional:
+            return response
+            
+        if cached is not None and response.status_code == http.HTTPStatus.NOT_MODIFIED:
+            return cached
+            
+        if response.ok and 'ETag' in response.headers:
+            with Server.session_lock:
+                Server.etag_cache[url] = response
+                Server.etag_cache.move_to_end(url)
+                
+                while len(Server.etag_cache) > Server.etag_cache_size:
+                    Server.etag_cache.popitem(last=False)
+                    
+        return response
+        
+    @staticmethod
+    def get_session():
+        """
+        Return the pooled HTTP session used by Server.request(), creating it if needed.
+        """
+        pid = os.getpid()
+        
+        if Server.session is not None and Server.session_pid == pid:
+            return Server.session
+            
+        with Server.session_lock:
+            if Server.session is None or Server.session_pid != pid:
+                session = requests.Session()
+                session.verify = False   # self-signed SSL certificates
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                Server.etag_cache = OrderedDict()
+                Server.session = session
+                Server.session_pid = pid
+                
+        return Server.session
+        
+    @staticmethod
+    def record_latency(endpoint, latency):
+        """
+        Add a request's latency (in seconds) to the endpoint's histogram.
+        """
+        with Server.session_lock:
+            stats = Server.latency.get(endpoint)
+            
+            if stats is None:
+                stats = {'count': 0, 'total': 0.0, 'max': 0.0, 'histogram': [0] * (len(Server.latency_buckets) + 1)}
+                Server.latency[endpoint] = stats
+                
+            bucket = 0
+            
+            while bucket < len(Server.latency_buckets) and latency > Server.latency_buckets[bucket]:
+                bucket += 1
+                
+            stats['count'] += 1
+            stats['total'] += latency
+            stats['max'] = max(stats['max'], latency)
+            stats['histogram'][bucket] += 1
+      
+    @staticmethod
+    def request_stats():
+        """
+        Return the latency histograms of the requests made with Server.request() from this process.
+        The histogram keys are the upper bound of each bucket in milliseconds.
+        """
+        labels = [f"{bucket*1000:g}ms" for bucket in Server.latency_buckets] + ['inf']
+        
+        with Server.session_lock:
+            return {
+                endpoint: {
+                    'count': stats['count'],
+                    'mean': stats['total'] / stats['count'],
+                    'max': stats['max'],
+                    'histogram': dict(zip(labels, stats['histogram'])),
+                }
+                for endpoint, stats in Server.latency.items()
+            }
         
     def add_resource(self, group, name, *args, **kwargs):
         """
@@ -312,6 +592,7 @@ class Server:
             return
         
         self.resources[group][name] = resource
+        self.push.publish('resources', self.list_resources())
         return resource.get_config()
     
     def get_resource(self, group, name):
@@ -453,10 +734,13 @@ class Server:
         Add alert text which gets displayed on the front-end page
         """
         if level == 'error':
-            Log.Error(f"[{self.name}] {text}")
+            Log.Error(f"[{Server.instance.name}] {text}")
             
         Server.instance.alerts.append((text, level, time.time(), duration))
         
+        if Server.instance.push is not None:
+            Server.instance.push.publish('alerts', Server.instance.alerts)
+        
     def _get_status(self):
         """
         /status REST GET request handler
@@ -467,13 +751,13 @@ class Server:
         """
         /resources REST GET request handler
         """
-        return self.list_resources()
+        return self._hashed_response(self.list_resources())
 
     def _get_models(self):
         """
         /models REST GET request handler
         """
-        return self.list_resources('models')
+        return self._hashed_response(self.list_resources('models'))
         
     def _get_model(self, name):
         """
@@ -497,6 +781,7 @@ class Server:
             return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
             
         self.resources['models'][model.name] = model
+        self.push.publish('resources', self.list_resources())
         self.alert(f"Loaded {model.type} model {model.model}", level="success")
         
         return model.get_config(), http.HTTPStatus.CREATED       
@@ -505,7 +790,7 @@ class Server:
         """
         /streams REST GET request handler
         """
-        return self.list_resources('streams')
+        return self._hashed_response(self.list_resources('streams'))
         
     def _get_stream(self, name):
         """
@@ -529,6 +814,7 @@ class Server:
             return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
             
         self.resources['streams'][stream.name] = stream
+        self.push.publish('resources', self.list_resources())
         self.alert(f"Created stream {stream.name}", level="success")
         
         return stream.get_config(), http.HTTPStatus.CREATED
@@ -536,8 +822,104 @@ class Server:
     def _get_events(self):
         """
         /events REST GET request handler
+        The ETag is the events version, so unchanged events are never re-serialized.
+        The score histories can be omitted with the ?history=0 query parameter.
+        """
+        history = flask.request.args.get('history', 1, type=int)
+        etag = f"{self.events_version}-{history}"
+        
+        if flask.request.if_none_match.contains(etag):
+            return self._not_modified(etag)
+        
+        if history:
+            response = flask.jsonify(self.events)
+        else:
+            response = flask.jsonify([event.to_list(history=False) for event in self.events[:]])
+            
+        response.set_etag(etag)
+        return response
+        
+    def _get_events_timeline(self):
         """
-        return flask.jsonify(self.events)
+        /events/timeline REST GET request handler
+        
+        Returns the score history of the events grouped by label and downsampled for plotting.
+        These optional query parameters are supported (see server/timeline.py for more info):
+        
+            width (int) -- the number of horizontal pixels in the plot (default 1000)
+            begin (float) -- the start of the time range in epoch seconds (default is the first event)
+            end (float) -- the end of the time range in epoch seconds (default is the last event)
+            method (string) -- the downsampling method, 'minmax' (default) or 'lttb'
+        """
+        from server import event_timeline
+        
+        args = flask.request.args
+        etag = hashlib.md5(f"{self.events_version}?{flask.request.query_string.decode()}".encode()).hexdigest()
+        
+        if flask.request.if_none_match.contains(etag):
+            return self._not_modified(etag)
+            
+        try:
+            timeline = event_timeline(self.events[:], 
+                                      width=args.get('width', 1000, type=int),
+                                      begin=args.get('begin', None, type=float),
+                                      end=args.get('end', None, type=float),
+                                      method=args.get('method', 'minmax'))
+        except ValueError as error:
+            return str(error), http.HTTPStatus.BAD_REQUEST
+            
+        response = flask.jsonify(timeline)
+        response.set_etag(etag)
+        return response
+        
+    def _get_clip(self, name):
+        """
+        /clips/<name> REST GET request handler
+        """
+        if not self.clips:
+            flask.abort(http.HTTPStatus.NOT_FOUND)
+            
+        return flask.send_from_directory(os.path.abspath(self.clips['path']), name, mimetype='video/x-motion-jpeg')
+        
+    def _hashed_response(self, config):
+        """
+        Return a JSON response with an ETag computed from it's contents, or 304 Not Modified
+        if it matches the client's If-None-Match header.  This is used for the resource configs,
+        which are small but can change from inside the resources (like the video options).
+        """
+        body = json.dumps(config, sort_keys=True)
+        etag = hashlib.md5(body.encode()).hexdigest()
+        
+        if flask.request.if_none_match.contains(etag):
+            return self._not_modified(etag)
+            
+        response = flask.Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        return response
+        
+    def _not_modified(self, etag):
+        """
+        Return an empty 304 Not Modified response with the ETag.
+        """
+        response = flask.Response(status=http.HTTPStatus.NOT_MODIFIED)
+        response.set_etag(etag)
+        return response
+     
+    def _get_push(self):
+        """
+        /push server-sent events (SSE) stream handler
+        """
+        subscriber = self.push.subscribe()
+        
+        if subscriber is None:  # the clients would otherwise tie up all the REST threads
+            return flask.Response(f"too many push channel clients (max {self.push_clients})", 
+                                  status=http.HTTPStatus.SERVICE_UNAVAILABLE, headers={'Retry-After': '5'})
+                                  
+        response = flask.Response(self.push.stream(subscriber), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+                              
+        response.call_on_close(lambda: self.push.unsubscribe(subscriber))  # in case the stream never started
+        return response
      
     def _add_action(self):
         """
@@ -560,6 +942,8 @@ class Server:
             return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
         
         self.actions.append(action)
+        self.action_index.build(self.actions)
+        
         return action.to_dict(), http.HTTPStatus.CREATED    
         
     def _get_actions(self):
@@ -574,6 +958,15 @@ class Server:
         """
         return self.action_types
         
+    def _get_action_stats(self):
+        """
+        /actions/stats REST GET request handler
+        """
+        if self.action_executor is None:
+            return {}
+            
+        return self.action_executor.get_stats()
+        
     def _get_action(self, id):
         """
         /actions/<int:id> REST GET request handler
@@ -588,10 +981,53 @@ class Server:
         
         for key, value in msg.items():
             setattr(self.actions[id], key, value)
-            
+        
+        self.action_index.build(self.actions)
+        
         return '', http.HTTPStatus.OK
         
         
+def lock_file_path(name, type='lock'):
+    """
+    Return the path to the lock file used for finding/starting the server process.
+    """
+    return os.path.join(tempfile.gettempdir(), f"{name}.{type}")
+    
+    
+def find_instance_pid(name):
+    """
+    Return the PID of the server process that holds the instance lock file, or None if it isn't running.
+    """
+    path = lock_file_path(name)
+    
+    if not os.path.exists(path):
+        return None
+        
+    with open(path, 'r') as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            pid = file.read().strip()
+            return int(pid) if pid else -1  # the server may not have written it's PID yet
+            
+        fcntl.flock(file, fcntl.LOCK_UN)
+        return None
+        
+        
+@contextlib.contextmanager
+def startup_lock(name):
+    """
+    Context manager that holds an exclusive lock file while checking for/starting the server process.
+    """
+    with open(lock_file_path(name, 'startup'), 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)  # explicit unlock, since a forked server process shares this file
+            
+            
 def is_process_running(name):
     """
     Check if there is any running process that contains the given name processName.
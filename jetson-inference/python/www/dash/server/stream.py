@@ -45,6 +45,7 @@ class Stream:
         self.server = server
         self.name = name
         self.frame_count = 0
+        self.recorder = None
         
         # create video interfaces
         self.source = videoSource(source, argv=video_args)
@@ -64,6 +65,15 @@ class Stream:
                 self.models.append(server.resources['models'][model].clone(stream=self))
             else:
                 Log.Verbose(f"[{self.server.name}] model '{model}' was not loaded on server")
+                
+        # buffer the recent frames for saving event clips
+        if server.clips:
+            try:
+                from server import ClipRecorder
+                self.recorder = ClipRecorder(self, **server.clips)
+            except Exception as error:
+                Log.Error(f"[{self.server.name}] failed to create clip recorder for stream {self.name}")
+                traceback.print_exc()
 
     def process(self):
         """
@@ -80,6 +90,9 @@ class Stream:
                 
             for model in self.models:
                 model.visualize(img)
+                
+            if self.recorder is not None:
+                self.recorder.add_frame(img)
         except:
             # TODO check if stream is still open, if not reconnect?
             traceback.print_exc()
@@ -0,0 +1,153 @@
+#
+# Copyright (c) 2022, NVIDIA CORPORATION. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+
+import math
+import numpy as np
+
+
+def event_timeline(events, width=1000, begin=None, end=None, method='minmax'):
+    """
+    Return the score history of the events grouped by label, downsampled so that each label
+    has roughly as many points as there are pixels across the requested time range.
+
+    Parameters:
+        events (list[Event]) -- the events to plot
+        width (int) -- the number of horizontal pixels (i.e. time buckets) across the range
+        begin (float) -- the start of the time range (epoch seconds), or None for the first event
+        end (float) -- the end of the time range (epoch seconds), or None for the last event
+        method (string) -- 'minmax' keeps the first/last/min/max points of each bucket so that
+                           the plotted line is unchanged, 'lttb' keeps one point per bucket
+                           using the Largest-Triangle-Three-Buckets algorithm
+
+    Returns a dict of {label: {'time': [...], 'score': [...]}} where the times are in epoch seconds
+    and the points of different events are separated by None, so that they're plotted with gaps.
+    """
+    if method not in ('minmax', 'lttb'):
+        raise ValueError(f"invalid downsampling method '{method}' (should be 'minmax' or 'lttb')")
+
+    if len(events) == 0:
+        return {}
+
+    if begin is None:
+        begin = min(event.begin for event in events)
+
+    if end is None:
+        end = max(event.end for event in events)
+
+    duration = max(end - begin, 1e-6)
+    width = max(int(width), 1)
+    series = {}
+
+    for event in events:
+        if event.end < begin or event.begin > end:
+            continue
+
+        time, score = event.get_scores()
+
+        # crop to the time range (the scores are in chronological order)
+        first = np.searchsorted(time, begin, side='left')
+        last = np.searchsorted(time, end, side='right')
+        time, score = time[first:last], score[first:last]
+
+        if len(time) == 0:
+            continue
+
+        buckets = max(1, math.ceil(width * (time[-1] - time[0]) / duration))
+
+        if method == 'minmax':
+            time, score = downsample_minmax(time, score, buckets)
+        else:
+            time, score = downsample_lttb(time, score, buckets)
+
+        label = series.setdefault(event.label, {'time': [], 'score': []})
+
+        label['time'].extend(time.tolist())
+        label['score'].extend(score.tolist())
+
+        label['time'].append(None)
+        label['score'].append(None)
+
+    return series
+
+
+def downsample_minmax(time, value, buckets):
+    """
+    Downsample a series into evenly-spaced time buckets, keeping the first, last, min, and max
+    points of each bucket (M4 aggregation).  This returns at most 4 points per bucket, and
+    the line plotted from them is the same as the original at that resolution.
+    """
+    if len(time) <= buckets * 4:
+        return time, value
+
+    span = max(time[-1] - time[0], 1e-9)
+    bucket = np.minimum(((time - time[0]) / span * buckets).astype(np.int64), buckets - 1)
+
+    # the buckets are non-decreasing because the time is, so each bucket is a contiguous run
+    starts = np.flatnonzero(np.diff(bucket)) + 1
+    firsts = np.concatenate(([0], starts))
+    lasts = np.concatenate((starts - 1, [len(time) - 1]))
+
+    # sort by value within each bucket to find the min/max indices
+    order = np.lexsort((value, bucket))
+    mins = order[firsts]
+    maxs = order[lasts]
+
+    keep = np.unique(np.concatenate((firsts, lasts, mins, maxs)))
+    return time[keep], value[keep]
+
+
+def downsample_lttb(time, value, threshold):
+    """
+    Downsample a series to the given number of points using the Largest-Triangle-Three-Buckets
+    algorithm (Steinarsson 2013), which selects the points that best preserve the visual shape.
+    """
+    count = len(time)
+
+    if threshold >= count or threshold < 3:
+        return time, value
+
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = count - 1
+
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.int64)  # threshold-2 buckets between the endpoints
+    selected = 0
+
+    for n in range(threshold - 2):
+        bucket_begin, bucket_end = edges[n], edges[n+1]
+
+        # average of the next bucket (or the last point)
+        if n < threshold - 3:
+            next_begin, next_end = edges[n+1], edges[n+2]
+            avg_time = time[next_begin:next_end].mean()
+            avg_value = value[next_begin:next_end].mean()
+        else:
+            avg_time, avg_value = time[-1], value[-1]
+
+        # pick the point in this bucket that forms the largest triangle
+        area = np.abs((time[selected] - avg_time) * (value[bucket_begin:bucket_end] - value[selected]) -
+                      (time[selected] - time[bucket_begin:bucket_end]) * (avg_value - value[selected]))
+
+        selected = bucket_begin + int(np.argmax(area))
+        keep[n+1] = selected
+
+    return time[keep], value[keep]
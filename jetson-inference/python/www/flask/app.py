@@ -48,6 +48,7 @@ parser.add_argument("--labels", default='', type=str, help="path to labels.txt f
 parser.add_argument("--colors", default='', type=str, help="path to colors.txt for loading a custom model")
 parser.add_argument("--input-layer", default='', type=str, help="name of input layer for loading a custom model")
 parser.add_argument("--output-layer", default='', type=str, help="name of output layer(s) for loading a custom model (comma-separated if multiple)")
+parser.add_argument("--intervals", default='', type=str, help="process models every N frames and reuse their results in between (e.g. 'segmentation=4,pose=2')")
 
 args = parser.parse_known_args()[0]
     
@@ -57,6 +58,12 @@ app = flask.Flask(__name__)
 stream = Stream(args)
 
 # Flask routes
+@app.route('/<model>/interval', methods=['GET', 'PUT'])
+def model_interval(model):
+    if model not in stream.models:
+        flask.abort(404)
+    return rest_property(stream.models[model].GetInterval, stream.models[model].SetInterval, int)
+    
 @app.route('/')
 def index():
     return flask.render_template('index.html', title=args.title, send_webrtc=args.input.startswith('webrtc'),
@@ -28,7 +28,7 @@ class Model:
     """
     Represents DNN models for classification, detection, pose, ect.
     """
-    def __init__(self, type, model, labels='', colors='', input_layer='', output_layer='', **kwargs):
+    def __init__(self, type, model, labels='', colors='', input_layer='', output_layer='', interval=1, **kwargs):
         """
         Load the model, either from a built-in pre-trained model or from a user-provided model.
         
@@ -39,10 +39,12 @@ class Model:
             labels (string) -- path to the model's labels.txt file (optional)
             input_layer (string or dict) -- the model's input layer(s)
             output_layer (string or dict) -- the model's output layers()
+            interval (int) -- process every N frames, and reuse the last results in between
         """
         self.type = type
         self.model = model
         self.enabled = True
+        self.interval = max(int(interval), 1)
         self.results = None
         self.frames = 0
         
@@ -116,6 +118,9 @@ class Model:
             
         if results is None:
             results = self.results
+            
+        if results is None and self.type != 'background' and self.type != 'segmentation':
+            return img  # hasn't been processed yet
                 
         if self.type == 'classification' or self.type == 'action':
             if results[0] >= 0:
@@ -147,6 +152,27 @@ class Model:
         """
         self.enabled = enabled
         
+    def GetInterval(self):
+        """
+        Returns the number of frames between each time the model gets processed.
+        """
+        return self.interval
+        
+    def SetInterval(self, interval):
+        """
+        Set the model to be processed every N frames (the last results get reused in between).
+        """
+        self.interval = max(int(interval), 1)
+        
+    def IsDue(self, frame):
+        """
+        Returns true if the model should process this frame (or if it hasn't been processed yet).
+        """
+        if self.type == 'background':
+            return False  # background removal gets applied in Visualize()
+            
+        return self.enabled and (frame % self.interval == 0 or self.frames == 0)
+        
     @staticmethod
     def Usage():
         """
@@ -24,6 +24,8 @@ import sys
 import threading
 import traceback
 
+from concurrent.futures import ThreadPoolExecutor
+
 from model import Model
 from jetson_utils import videoSource, videoOutput
 
@@ -43,6 +45,15 @@ class Stream(threading.Thread):
         self.output = videoOutput(args.output, argv=sys.argv)
         self.frames = 0
         self.models = {}
+        self.executor = None
+        
+        # parse the per-model processing intervals, like 'segmentation=4,pose=2'
+        intervals = {}
+        
+        for interval in args.intervals.split(','):
+            if interval.strip():
+                key, value = interval.split('=')
+                intervals[key.strip()] = int(value)
         
         # these are in the order that the overlays should be composited
         model_types = {
@@ -56,11 +67,15 @@ class Stream(threading.Thread):
         
         for key, model in model_types.items():
             if model:
-                self.models[key] = Model(key, model=model, labels=args.labels, colors=args.colors, input_layer=args.input_layer, output_layer=args.output_layer)
+                self.models[key] = Model(key, model=model, labels=args.labels, colors=args.colors, input_layer=args.input_layer, output_layer=args.output_layer, interval=intervals.get(key, 1))
             
         if args.action and args.classification:
             self.models['action'].fontLine = 1
         
+        # models get processed concurrently on worker threads
+        if len(self.models) > 1:
+            self.executor = ThreadPoolExecutor(max_workers=len(self.models), thread_name_prefix='model')
+            
     def process(self):
         """
         Capture one image from the stream, process it, and output it.
@@ -70,9 +85,17 @@ class Stream(threading.Thread):
         if img is None:  # timeout
             return
             
-        for model in self.models.values():
-            model.Process(img)
-            
+        # run the models that are due this frame (the others reuse their last results)
+        models = [model for model in self.models.values() if model.IsDue(self.frames)]
+        
+        if len(models) > 1 and self.executor is not None:
+            # the models only read the image, so they can run concurrently - then wait for them all before compositing
+            for future in [self.executor.submit(model.Process, img) for model in models]:
+                future.result()
+        else:
+            for model in models:
+                model.Process(img)
+                
         for model in self.models.values():
             img = model.Visualize(img)
 
@@ -50,7 +50,15 @@ parser.add_argument('--batch-size', default=1, type=int, metavar='N', help="trai
 parser.add_argument("--workers", default=2, type=int, metavar='N', help="number of training data loading workers (default: 2)")
 parser.add_argument("--optimizer", default='adam', type=str, choices=['adam', 'sgd'], help="training optimizer to use (default: adam)")
 parser.add_argument('--learning-rate', default=0.001, type=float, metavar='LR', help="initial training learning rate (default: 0.001)")     
+parser.add_argument('--amp', action='store_true', help="use automatic mixed precision (FP16) training on the GPU")
+parser.add_argument('--channels-last', action='store_true', help="use the channels-last (NHWC) memory format for training")
 parser.add_argument('--no-augmentation', action='store_false', dest='augmentation', help="disable training data image augmentation")
+parser.add_argument('--no-image-cache', action='store_false', dest='image_cache', help="disable caching the resized training images under --data (uses net-width*net-height*3 bytes per image)")
+parser.add_argument('--export-threshold', default=1.0, type=float, metavar='N', help="minimum improvement in accuracy (%%) before the model gets re-exported for inference (default: 1.0)")
+parser.add_argument('--record-rate', default=5.0, type=float, metavar='FPS', help="max number of frames per second to record into the dataset (0 for every frame, default: 5)")
+parser.add_argument('--record-distance', default=4, type=int, metavar='N', help="skip recording frames whose perceptual hash differs by fewer than N of 64 bits from the last recorded frame (0 to disable, default: 4)")
+parser.add_argument('--record-queue', default=8, type=int, metavar='N', help="max number of frames waiting to be saved when recording (default: 8)")
+parser.add_argument('--record-drop', default='oldest', type=str, choices=['oldest', 'newest'], help="which frames to drop when the recording queue is full (default: oldest)")
 parser.add_argument('--print-freq', default=10, type=int, metavar='N', help="print training progress info every N steps")
 
 args = parser.parse_known_args()[0]
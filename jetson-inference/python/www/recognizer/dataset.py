@@ -22,7 +22,10 @@
 #
 import os
 import json
+import time
+import fcntl
 import queue
+import hashlib
 import datetime
 import threading
 import traceback
@@ -31,7 +34,7 @@ import torch
 import numpy as np
 import PIL
 
-from jetson_utils import cudaMemcpy, saveImage
+from jetson_utils import cudaMemcpy, cudaAllocMapped, cudaResize, cudaToNumpy, cudaDeviceSynchronize, saveImage
 from utils import alert
 
 
@@ -39,22 +42,39 @@ class Dataset(threading.Thread, torch.utils.data.Dataset):
     """
     Class for saving multi-label image tagging datasets.
     """
-    def __init__(self, args):
+    def __init__(self, args, compact_interval=1000):
         """
         Create dataset object.
+        
+        New tags get appended to a journal file (tags.jsonl) instead of rewriting tags.json every
+        time an image is recorded.  The journal is merged back into tags.json (compacted) once it
+        has more than compact_interval entries and has grown to the size of the dataset, so that
+        the cost of rewriting tags.json stays amortized over the number of images being added.
         """
         super().__init__()
 
         self.args = args
         self.classes = []             # list of class names
+        self.class_index = {}         # dict mapping class name => index in self.classes
         self.tags = {}                # dict mapping image filename => tags
+        self.keys = []                # list of image filenames in the order they were added (for indexing)
         self.num_tags = 0             # total number of labels/tags
+        self.num_multi_tags = 0       # number of images with more than one tag
         self.active_tags = []         # list of tags to be applied to new images
         self.multi_label = False      # true if there are multiple tags (labels) per image
         self.class_distribution = []  # number of tags for each class
         
-        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.journal = None           # file handle to the tags journal (opened on first write)
+        self.journal_size = 0         # number of entries in the journal since it was compacted
+        self.compact_interval = compact_interval
+        
+        self.queue = queue.Queue(maxsize=self.args.record_queue)
         self.recording = False
+        self.record_time = 0          # the time that the last frame was recorded
+        self.record_hash = None       # the perceptual hash of the last frame that was recorded
+        self.record_stats = {'recorded': 0, 'skipped': 0, 'dropped': 0}
+        self.thumbnail = None         # downscaled image used for computing the perceptual hash
         self.transform = None
         self.target_transform = None
         
@@ -64,16 +84,32 @@ class Dataset(threading.Thread, torch.utils.data.Dataset):
         
         os.makedirs(self.image_dir, exist_ok=True)
         
+        self.cache = None  # cache of resized images (created below once the size of the dataset is known)
+        
         # load existing annotations
         self.tags_path = os.path.join(self.root_dir, 'tags.json')
+        self.journal_path = os.path.join(self.root_dir, 'tags.jsonl')
         
         if os.path.exists(self.tags_path):
             with open(self.tags_path, 'r') as file:
                 self.tags = json.load(file)
-                self.update_class_labels()
-                self.update_class_distribution()
-                print(f"dataset -- loaded tags for {len(self.tags)} images, {len(self.classes)} from {self.tags_path}")
+                
+        if os.path.exists(self.journal_path):
+            self.load_journal()
+            
+        self.keys = list(self.tags.keys())
         
+        if len(self.tags) > 0:
+            self.update_class_labels()
+            self.update_class_distribution()
+            print(f"dataset -- loaded tags for {len(self.tags)} images, {len(self.classes)} classes from {self.tags_path}")
+            
+        if self.journal_size > 0:
+            self.SaveTags()
+            
+        if self.args.image_cache:
+            self.cache = ImageCache(os.path.join(self.root_dir, 'cache'), self.args.net_width, self.args.net_height, capacity=len(self.keys))
+            
         # create a default class if necessary
         if len(self.classes) == 0:
             self.classes = ['background']
@@ -85,26 +121,23 @@ class Dataset(threading.Thread, torch.utils.data.Dataset):
         """
         Return the size of the dataset (the number of images)
         """
-        return len(self.tags)    
+        return len(self.keys)    
         
     def __getitem__(self, index):
         """
         Return (image, labels) tensors for training
         """
-        key = list(self.tags.keys())[index]
+        key = self.keys[index]
         tags = self.tags[key]
+        class_index = self.class_index  # this gets replaced (not modified) when new classes are added
         
-        image = PIL.Image.open(os.path.join(self.image_dir, key)).convert('RGB')
+        image = torch.from_numpy(self.load_image(index)).permute(2, 0, 1)  # HWC uint8 => CHW uint8
         
         if self.multi_label:
-            labels = [0] * len(self.classes)
-            
-            for tag in tags:
-                labels[self.classes.index(tag)] = 1
-                
-            labels = torch.FloatTensor(labels)
+            labels = torch.zeros(len(class_index))
+            labels[[class_index[tag] for tag in tags]] = 1
         else:
-            labels = torch.tensor(self.classes.index(self.tags[key][0]), dtype=torch.int64)
+            labels = torch.tensor(class_index[tags[0]], dtype=torch.int64)
             
         if self.transform:
             image = self.transform(image)
@@ -114,6 +147,27 @@ class Dataset(threading.Thread, torch.utils.data.Dataset):
             
         return image, labels
         
+    def load_image(self, index):
+        """
+        Return an image from the dataset as a uint8 numpy array that's been resized to the network
+        resolution (with shape HxWx3).  If the image isn't in the cache yet, it gets decoded and cached.
+        """
+        key = self.keys[index]
+        
+        if self.cache is not None:
+            image = self.cache.get(index, key)
+            
+            if image is not None:
+                return image
+                
+        image = PIL.Image.open(os.path.join(self.image_dir, key)).convert('RGB')
+        image = np.array(image.resize((self.args.net_width, self.args.net_height), PIL.Image.BILINEAR))
+        
+        if self.cache is not None:
+            self.cache.put(index, key, image)
+            
+        return image
+        
     def record(self):
         """
         Record the queue of incoming images.
@@ -128,6 +182,7 @@ class Dataset(threading.Thread, torch.utils.data.Dataset):
 
             saveImage(filepath, img, quality=85)
             self.ApplyTags(filename)
+            self.record_stats['recorded'] += 1
             
             del img
              
@@ -143,14 +198,71 @@ class Dataset(threading.Thread, torch.utils.data.Dataset):
     
     def AddImage(self, img):
         """
-        Adds an image to the queue to be saved to the dataset.
+        Adds an image to the queue to be saved to the dataset.  Frames are sampled so that only
+        informative ones get copied and encoded:  they're limited to --record-rate, and skipped if
+        their perceptual hash differs by less than --record-distance bits from the last recorded frame.
+        If the recorder falls behind, the oldest (or newest) frames get dropped per --record-drop.
         """
         if not self.recording or len(self.active_tags) == 0:
             return
             
+        now = time.time()
+        
+        if self.args.record_rate > 0 and now - self.record_time < 1.0 / self.args.record_rate:
+            return
+            
+        image_hash = None
+        
+        if self.args.record_distance > 0:
+            image_hash = self.image_hash(img)
+            
+            if self.record_hash is not None and np.count_nonzero(image_hash != self.record_hash) < self.args.record_distance:
+                self.record_stats['skipped'] += 1
+                return
+        
+        if self.queue.full():
+            self.record_stats['dropped'] += 1
+            
+            if self.args.record_drop == 'newest':
+                return
+                
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+                
         timestamp = datetime.datetime.now()
         img_copy = cudaMemcpy(img)
-        self.queue.put((img_copy, timestamp))
+        
+        try:
+            self.queue.put_nowait((img_copy, timestamp))
+        except queue.Full:
+            self.record_stats['dropped'] += 1
+            return
+            
+        self.record_time = now
+        self.record_hash = image_hash
+        
+    def image_hash(self, img, hash_size=8):
+        """
+        Compute the difference hash (dHash) of an image from a downscaled grayscale thumbnail.
+        Returns an array of hash_size * hash_size bools, which can be compared by Hamming distance.
+        """
+        block = 8  # the thumbnail gets box-filtered by this much to reduce aliasing
+        
+        if self.thumbnail is None or self.thumbnail.format != img.format:
+            self.thumbnail = cudaAllocMapped(width=(hash_size+1)*block, height=hash_size*block, format=img.format)
+            
+        cudaResize(img, self.thumbnail)
+        cudaDeviceSynchronize()
+        
+        thumbnail = cudaToNumpy(self.thumbnail).astype(np.float32)
+        
+        if thumbnail.ndim == 3:
+            thumbnail = thumbnail[..., :3].mean(axis=-1)
+            
+        thumbnail = thumbnail.reshape(hash_size, block, hash_size+1, block).mean(axis=(1,3))
+        return thumbnail[:, 1:] > thumbnail[:, :-1]
         
     def Upload(self, file):
         path = os.path.join(self.image_dir, file.filename)
@@ -186,60 +298,253 @@ class Dataset(threading.Thread, torch.utils.data.Dataset):
         if len(tags) == 0:
             return
             
-        self.tags[filename] = self.active_tags
-        
-        self.update_class_labels()
-        self.update_class_distribution()
+        tags = list(tags)
         
-        if flush:
-            self.SaveTags()
+        with self.lock:
+            if filename in self.tags:
+                self.remove_tags(self.tags[filename])
+                index = None
+            else:
+                index = len(self.keys)
+                self.keys.append(filename)
+                
+            self.tags[filename] = tags
+            self.add_tags(tags)
+            
+            if flush:
+                self.journal_tags(filename, tags)
         
+        # resize new images into the cache now, so that training doesn't need to decode them
+        if self.cache is not None and index is not None:
+            self.load_image(index)
+            
         alert(f"Dataset has {len(self.tags)} images, {len(self.classes)} classes", category='dataset')
         
     def SaveTags(self, path=''):
         """
         Flush the image tags to the JSON annotations file on disk.
+        When saving to the dataset's tags.json, the journal gets compacted (cleared).
         """
         if not path:
             path = self.tags_path
             
-        with open(path, 'w') as file:
+        tmp_path = path + '.tmp'
+        
+        with open(tmp_path, 'w') as file:
             json.dump(self.tags, file, indent=4)
             
+        os.replace(tmp_path, path)  # so that tags.json is never left partially-written
+        
+        if path == self.tags_path:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+                
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+                
+            self.journal_size = 0
+          
+    def journal_tags(self, filename, tags):
+        """
+        Append an image's tags to the journal, and compact it into tags.json if it's gotten large.
+        """
+        if self.journal is None:
+            self.journal = open(self.journal_path, 'a')
+            
+        self.journal.write(json.dumps({'image': filename, 'tags': tags}) + '\n')
+        self.journal.flush()
+        self.journal_size += 1
+        
+        if self.journal_size >= max(self.compact_interval, len(self.tags)):
+            self.SaveTags()
+            
+    def load_journal(self):
+        """
+        Replay the entries from the journal that haven't been compacted into tags.json yet.
+        """
+        with open(self.journal_path, 'r') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"dataset -- skipping invalid entry in {self.journal_path}:  {line.strip()}")
+                    continue
+
+                self.tags[entry['image']] = entry['tags']
+                self.journal_size += 1
+                
+        print(f"dataset -- loaded {self.journal_size} journal entries from {self.journal_path}")
+        
+    def add_tags(self, tags):
+        """
+        Incrementally update the class labels and distribution with the tags from a new image.
+        The class labels only get re-sorted when one of the tags is a new class.
+        """
+        new_classes = [tag for tag in tags if tag not in self.class_index]
+        
+        if len(new_classes) > 0:
+            classes = sorted(set(self.class_index).union(new_classes))
+            class_index = {tag: n for n, tag in enumerate(classes)}
+            class_distribution = [0] * len(classes)
+            
+            for tag, n in self.class_index.items():
+                class_distribution[class_index[tag]] = self.class_distribution[n]
+                
+            self.class_index = class_index
+            self.class_distribution = class_distribution
+            self.classes = classes
+            
+            print(f'dataset -- class labels:  {self.classes}')
+            
+        for tag in tags:
+            self.class_distribution[self.class_index[tag]] += 1
+            
+        self.num_tags += len(tags)
+        
+        if len(tags) > 1:
+            self.num_multi_tags += 1
+            self.multi_label = True
+            
+    def remove_tags(self, tags):
+        """
+        Incrementally remove the tags of an image that's being re-tagged from the class distribution.
+        Classes that no longer have any tags are kept until the next time the dataset is loaded,
+        so that the class indices don't change.
+        """
+        for tag in tags:
+            self.class_distribution[self.class_index[tag]] -= 1
+            
+        self.num_tags -= len(tags)
+        
+        if len(tags) > 1:
+            self.num_multi_tags -= 1
+            self.multi_label = self.num_multi_tags > 0
+            
     def update_class_labels(self):
         """
         Sync the list of class labels from the tag annotations.
         """
-        classes = []
-        multi_label = False
+        classes = set()
+        num_multi_tags = 0
         
         for tags in self.tags.values():
             if len(tags) > 1:
-                multi_label = True
+                num_multi_tags += 1
                 
-            for tag in tags:
-                if tag not in classes:
-                    classes.append(tag)
+            classes.update(tags)
                     
         self.classes = sorted(classes)
-        self.multi_label = multi_label
+        self.class_index = {tag: n for n, tag in enumerate(self.classes)}
+        self.num_multi_tags = num_multi_tags
+        self.multi_label = num_multi_tags > 0
         
         print(f'dataset -- class labels:  {self.classes}')
      
     def update_class_distribution(self):
         """
         Update the class distribution and total tag count.
-        TODO add optional 'tags' param to incremently add at runtime.
+        This does a full recount - add_tags() and remove_tags() update them incrementally at runtime.
         """
         num_tags = 0
         class_distribution = [0] * len(self.classes)
         
         for tags in self.tags.values():
             for tag in tags:
-                class_distribution[self.classes.index(tag)] += 1
-                num_tags += 1
+                class_distribution[self.class_index[tag]] += 1
+                
+            num_tags += len(tags)
 
         self.num_tags = num_tags
         self.class_distribution = class_distribution
         
-        
\ No newline at end of file
+        
+
+
+class ImageCache:
+    """
+    Cache of the dataset's images that have already been decoded and resized to the network resolution.
+    The images are stored in a memory-mapped uint8 array (one slot per image index) under the data dir,
+    so that it persists between runs and is shared with the DataLoader worker processes.
+
+    Each slot is tagged with a hash of the image filename, so stale entries never get used if the
+    dataset changes.  The cache is specific to the resolution, and gets discarded if that changes.
+    """
+    def __init__(self, path, width, height, capacity=1024):
+        """
+        Open or create the cache under the given directory.
+        """
+        self.path = path
+        self.width = width
+        self.height = height
+        self.lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+
+        name = f'images_{width}x{height}'
+
+        for file in os.listdir(self.path):
+            if file.startswith('images_') and not file.startswith(name + '.'):
+                print(f"dataset -- removing cached images with a different resolution ({file})")
+                os.remove(os.path.join(self.path, file))
+
+        self.images_path = os.path.join(self.path, name + '.u8')
+        self.keys_path = os.path.join(self.path, name + '.keys')
+
+        self.open(capacity)
+        print(f"dataset -- opened image cache {self.images_path} ({width}x{height}, capacity={len(self.keys)})")
+
+    def open(self, capacity):
+        """
+        Map the cache files, growing them first if they're smaller than the requested capacity.
+        The files are shared between processes, so they only ever grow, and that's done while
+        holding a file lock on the keys (the images get grown first, so they're never smaller).
+        """
+        with open(self.keys_path, 'ab') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                capacity = max(capacity, os.fstat(lock.fileno()).st_size // 8, 1)
+
+                for path, size in ((self.images_path, capacity * self.height * self.width * 3), (self.keys_path, capacity * 8)):
+                    with open(path, 'ab') as file:
+                        if os.fstat(file.fileno()).st_size < size:
+                            file.truncate(size)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        self.images = np.memmap(self.images_path, dtype=np.uint8, mode='r+', shape=(capacity, self.height, self.width, 3))
+        self.keys = np.memmap(self.keys_path, dtype=np.uint64, mode='r+', shape=(capacity,))
+
+    def get(self, index, key):
+        """
+        Return a copy of the cached image, or None if it's not in the cache.
+        """
+        images, keys = self.images, self.keys  # these get replaced when the cache grows
+
+        if index >= len(keys) or keys[index] != self.hash(key):
+            return None
+
+        return np.array(images[index])
+
+    def put(self, index, key, image):
+        """
+        Store a resized image (HxWx3 uint8) in the cache.
+        """
+        if index >= len(self.keys):
+            with self.lock:
+                if index >= len(self.keys):
+                    self.open(max(index + 1, len(self.keys) * 2))
+
+        images, keys = self.images, self.keys
+
+        keys[index] = 0   # invalidate the slot while it's being written
+        images[index] = image
+        keys[index] = self.hash(key)
+
+    @staticmethod
+    def hash(key):
+        """
+        Return a non-zero 64-bit hash of an image filename (zero is used for empty slots).
+        """
+        return np.uint64(int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'little') or 1)
@@ -20,10 +20,16 @@
 # DEALINGS IN THE SOFTWARE.
 #
 import os
+import io
+import sys
+import glob
 import time
 import shutil
+import hashlib
+import argparse
 import threading
 import traceback
+import subprocess
 
 import torch
 import torchvision
@@ -56,7 +62,14 @@ class Model(threading.Thread):
         self.dataloader = None      # PyTorch dataloader
         
         self.model_train = None     # PyTorch training model
-        self.model_infer = None     # TensorRT inference model
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.use_amp = args.amp and self.device.type == 'cuda'  # mixed precision is only used on GPU
+        self.scaler = torch.cuda.amp.GradScaler(enabled=self.use_amp)
+        self.model_infer = None     # TensorRT inference model (gets swapped by the EngineBuilder)
+        
+        self.results = []           # the last classification results
+        self.results_model = None   # the model that produced the results (in case it gets swapped)
+        self.exported_accuracy = None  # the accuracy of the last model exported for inference
 
         self.input_layer = 'input_0'
         self.output_layer = 'output_0'
@@ -70,12 +83,16 @@ class Model(threading.Thread):
         # setup model directory
         self.model_dir = os.path.join(self.args.data, 'models')
         self.best_path = os.path.join(self.model_dir, 'model_best.pth')
-        self.onnx_path = os.path.join(self.model_dir, f'{args.network}.onnx')
+        self.engine_dir = os.path.join(self.model_dir, 'engines')
+        self.onnx_path = os.path.join(self.model_dir, f'{args.network}.onnx')  # gets updated to the loaded model
         
         self.labels_path = os.path.join(self.model_dir, 'labels.txt')
         self.checkpoint_path = os.path.join(self.model_dir, 'checkpoint.pth')
         
-        os.makedirs(self.model_dir, exist_ok=True)
+        os.makedirs(self.engine_dir, exist_ok=True)
+        
+        # start the thread that builds and swaps the TensorRT models
+        self.builder = EngineBuilder(self)
         
         # start training thread
         self.start()
@@ -84,11 +101,14 @@ class Model(threading.Thread):
         """
         Run classification inference and return the results.
         """
-        if not self.inference_enabled or self.model_infer is None:
+        model = self.model_infer  # the model can get swapped by the builder thread in the meantime
+        
+        if not self.inference_enabled or model is None:
             return
             
         # returns a list of (classID, confidence) tuples
-        self.results = self.model_infer.Classify(img, topK=0 if self.dataset.multi_label else 1)
+        self.results = model.Classify(img, topK=0 if self.dataset.multi_label else 1)
+        self.results_model = model
 
         # to trigger custom actions/processing, add them here:
         # for classID, confidence in self.results:
@@ -101,14 +121,16 @@ class Model(threading.Thread):
         """
         Visualize the results on an image.
         """
-        if not self.inference_enabled or self.model_infer is None:
+        model = self.results_model
+        
+        if not self.inference_enabled or model is None:
             return
             
         if results is None:
             results = self.results
         
         for i, (classID, confidence) in enumerate(results):
-            str = f"{confidence * 100:05.2f}% {self.model_infer.GetClassLabel(classID)}"
+            str = f"{confidence * 100:05.2f}% {model.GetClassLabel(classID)}"
             self.font.OverlayText(img, img.width, img.height, str, 5, 5+(i*37), self.font.White, self.font.Gray40)
         
         return img
@@ -124,7 +146,7 @@ class Model(threading.Thread):
         if os.path.isfile(self.checkpoint_path):
             print(f"[torch]  loading checkpoint {self.checkpoint_path}")
             
-            checkpoint = torch.load(self.checkpoint_path)
+            checkpoint = torch.load(self.checkpoint_path, map_location=self.device)
             
             self.model_train.load_state_dict(checkpoint['state_dict'])
             self.optimizer.load_state_dict(checkpoint['optimizer'])
@@ -134,18 +156,16 @@ class Model(threading.Thread):
         # load TensorRT model
         self.load_inference()
 
-        # setup data transforms
-        transforms = []
+        # setup data transforms (the dataset returns uint8 tensors already resized to the network resolution)
+        transforms = [torchvision.transforms.ConvertImageDtype(torch.float32)]
         
         if self.args.augmentation:
-            transforms = [
+            transforms += [
                 torchvision.transforms.ColorJitter(0.2, 0.2, 0.2, 0.2),
                 torchvision.transforms.RandomHorizontalFlip()
             ]
             
         transforms += [
-            torchvision.transforms.Resize((self.args.net_height, self.args.net_width)),
-            torchvision.transforms.ToTensor(),
             torchvision.transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
         ]
         
@@ -153,9 +173,9 @@ class Model(threading.Thread):
         
         # create loss function
         if self.dataset.multi_label:
-            self.criterion = torch.nn.BCEWithLogitsLoss().cuda()
+            self.criterion = torch.nn.BCEWithLogitsLoss().to(self.device)
         else:
-            self.criterion = torch.nn.CrossEntropyLoss().cuda()
+            self.criterion = torch.nn.CrossEntropyLoss().to(self.device)
         
         # detect if the dataset changed
         num_images = len(self.dataset)
@@ -184,6 +204,11 @@ class Model(threading.Thread):
                 num_images = len(self.dataset)
                 self.best_accuracy = 0.0
                 
+                # the accuracy isn't comparable on the new data, so measure the export threshold from whichever
+                # is lower (growing the dataset alone shouldn't re-export the model, but it still needs to be possible)
+                if self.exported_accuracy is not None:
+                    self.exported_accuracy = min(self.exported_accuracy, self.accuracy)
+                
             # save the model checkpoints
             is_best = self.accuracy >= self.best_accuracy
             self.best_accuracy = max(self.accuracy, self.best_accuracy)
@@ -207,12 +232,14 @@ class Model(threading.Thread):
 
     def train_epoch(self):
         """
-        Train the model for one epoch.
+        Train the model for one epoch.  The metrics are accumulated on the device,
+        and only get synchronized with the CPU every print_freq steps.
         """
         self.model_train.train()
         
-        acc_sum = 0.0
-        loss_sum = 0.0
+        acc_sum = torch.zeros((), device=self.device)
+        loss_sum = torch.zeros((), device=self.device)
+        num_images = 0
         self.epoch_images = 0
 
         for i, (images, target) in enumerate(self.dataloader):
@@ -220,36 +247,53 @@ class Model(threading.Thread):
             if self.model_train.num_classes != len(self.dataset.classes):
                 self.model_train = self.reshape(len(self.dataset.classes))
                 self.best_accuracy = 0.0
+                self.exported_accuracy = None
                 alert(f"Restarting training epoch {self.epoch} (change in number of classes)")
                 return self.train_epoch()
             
             # move the tensors to GPU
-            images = images.cuda(non_blocking=True)
-            target = target.cuda(non_blocking=True)
+            images = images.to(self.device, non_blocking=True)
+            target = target.to(self.device, non_blocking=True)
             
+            if self.args.channels_last:
+                images = images.contiguous(memory_format=torch.channels_last)
+                
             # train the image(s)
-            output = self.model_train(images)
-            loss = self.criterion(output, target)
+            with torch.autocast(device_type=self.device.type, enabled=self.use_amp):
+                output = self.model_train(images)
+                loss = self.criterion(output, target)
 
             self.optimizer.zero_grad()
-            loss.backward()
-            self.optimizer.step()
+            self.scaler.scale(loss).backward()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
            
-            # update metrics
-            loss_sum += loss.item() * images.size(0)
+            # update metrics (without syncing)
+            loss_sum += loss.detach() * images.size(0)
             acc_sum += self.compute_accuracy(output, target) * images.size(0)
-            
-            self.epoch_images += images.size(0)
-            self.accuracy = acc_sum / self.epoch_images
-            self.loss = loss_sum / self.epoch_images
+            num_images += images.size(0)
+            self.epoch_images = num_images
 
             # log updates every N steps (and the last step)
             if (i % self.args.print_freq == 0) or (i == len(self.dataloader)-1):
+                self.update_metrics(loss_sum, acc_sum, num_images)
                 print(f"[torch]  epoch {self.epoch}  [{i}/{len(self.dataloader)}]  loss={self.loss:.4e}  accuracy={self.accuracy:.2f}  {'(multi-tag)' if self.dataset.multi_label else ''}")
               
             # the user could disable training mid-epoch
             if not self.training_enabled:
                 break
+                
+        self.update_metrics(loss_sum, acc_sum, num_images)
+        
+    def update_metrics(self, loss_sum, acc_sum, num_images):
+        """
+        Update the epoch's loss and accuracy from the sums accumulated on the device.
+        """
+        if num_images == 0:
+            return
+            
+        self.loss = loss_sum.item() / num_images
+        self.accuracy = acc_sum.item() / num_images
         
     def reshape(self, num_classes):
         """
@@ -262,11 +306,16 @@ class Model(threading.Thread):
         elif self.args.optimizer == 'sgd':
             self.optimizer = torch.optim.SGD(self.model_train.parameters(), lr=self.args.learning_rate, momentum=0.9, weight_decay=1e-4)
             
-        return self.model_train.cuda()
+        self.model_train = self.model_train.to(self.device)
+        
+        if self.args.channels_last:
+            self.model_train = self.model_train.to(memory_format=torch.channels_last)
+            
+        return self.model_train
   
     def compute_accuracy(self, output, target, multi_label_threshold=0.5):
         """
-        Computes the accuracy of predictions vs groundtruth
+        Computes the accuracy of predictions vs groundtruth (as a tensor on the device)
         """
         with torch.no_grad():
             if self.dataset.multi_label:
@@ -282,64 +331,61 @@ class Model(threading.Thread):
                 _, preds = torch.max(output, dim=-1)
                 preds = (preds == target)
 
-            return preds.float().mean().cpu().item() * 100.0
+            return preds.float().mean() * 100.0
           
     def save_checkpoint(self, state, is_best):
         """
-        Save a PyTorch model checkpoint, and refresh ONNX/TensorRT if it has the best accuracy so far.
+        Save a PyTorch model checkpoint, and refresh ONNX/TensorRT if the accuracy improved enough.
         """
         torch.save(state, self.checkpoint_path)
         
         if is_best:
             shutil.copyfile(self.checkpoint_path, self.best_path)
             print(f"[torch]  saved best model to {self.best_path}")
-            self.export_onnx()
-            self.load_inference()
+            
+            if self.exported_accuracy is None or self.accuracy >= self.exported_accuracy + self.args.export_threshold:
+                self.export_inference(state)
         else:
             print(f"[torch]  saved checkpoint {self.epoch} to {self.checkpoint_path}")
 
-    def export_onnx(self):
+    def export_inference(self, state):
         """
-        Export the PyTorch model to ONNX.
+        Save a snapshot of the model weights to the engine cache (keyed by their hash),
+        and queue it to be exported to ONNX/TensorRT and swapped in by the builder thread.
         """
-        print(f"[torch]  exporting ONNX to {self.onnx_path}")
-        alert(f"Exporting trained model to {self.onnx_path} (epoch {self.epoch}, {self.accuracy:.1f}% accuracy)")
+        state = {key: value for key, value in state.items() if key != 'optimizer'}
         
-        if self.dataset.multi_label:
-            model = torch.nn.Sequential(self.model_train, torch.nn.Sigmoid())
-        else:
-            model = torch.nn.Sequential(self.model_train, torch.nn.Softmax(1))
-            
-        model.eval()
+        buffer = io.BytesIO()
+        torch.save(state, buffer)
+        buffer = buffer.getvalue()
+        
+        path = os.path.join(self.engine_dir, hashlib.md5(buffer).hexdigest()[:16])
+        os.makedirs(path, exist_ok=True)
         
-        torch.onnx.export(
-            model,
-            torch.ones((1, 3, self.args.net_height, self.args.net_width)).cuda(),
-            self.onnx_path,
-            input_names=[self.input_layer],
-            output_names=[self.output_layer],
-            verbose=True)
-   
-        with open(self.labels_path, 'w') as file:
-            file.write('\n'.join(self.dataset.classes))
+        if not os.path.isfile(os.path.join(path, 'model.pth')):
+            with open(os.path.join(path, 'model.pth'), 'wb') as file:
+                file.write(buffer)
         
-        alert(f"Exported trained model to {self.onnx_path} (epoch {self.epoch}, {self.accuracy:.1f}% accuracy)", level='success')
+        self.exported_accuracy = state.get('accuracy', 0.0)
+        self.builder.submit(path, self.exported_accuracy)
         
     def load_inference(self):
         """
-        Load the TensorRT model from ONNX.
+        Queue the best checkpoint (or the current model if there isn't one yet) to be loaded for inference.
         """
-        if not os.path.isfile(self.onnx_path):
-            self.export_onnx()
+        if os.path.isfile(self.best_path):
+            state = torch.load(self.best_path, map_location=self.device)
+        else:
+            state = {
+                'network': self.args.network,
+                'resolution': (self.args.net_height, self.args.net_width),
+                'classes': self.dataset.classes,
+                'num_classes': len(self.dataset.classes),
+                'multi_label': self.dataset.multi_label,
+                'state_dict': self.model_train.state_dict(),
+            }
             
-        alert(f"Loading inference model from {self.onnx_path}")    
-        
-        self.model_infer = imageNet(model=self.onnx_path, labels=self.labels_path, input_blob=self.input_layer, output_blob=self.output_layer)
-                                 
-        self.model_infer.SetThreshold(self.inference_threshold)
-        self.model_infer.SetSmoothing(self.inference_smoothing)
-
-        alert(f"Loaded inference model from {self.onnx_path}", level='success')  
+        self.export_inference(state)
         
     def run(self):
         """
@@ -408,4 +454,152 @@ class Model(threading.Thread):
         Return help text for when the app is started with -h or --help
         """
         return imageNet.Usage()
+        
+        
+class EngineBuilder(threading.Thread):
+    """
+    Exports model checkpoints to ONNX and builds their TensorRT engines in a separate process,
+    then loads the new engine and swaps it into the model between frames.  Inference keeps
+    running with the previous model in the meantime (or if the build fails).
+    
+    Each checkpoint is cached in its own directory under models/engines (named by its hash),
+    along with the ONNX model and serialized engine, so they don't get rebuilt on restart.
+    If more checkpoints get submitted while an engine is being built, only the latest is kept.
+    """
+    def __init__(self, model, max_engines=4):
+        """
+        Start the builder thread for the given Model (keeping up to max_engines cached)
+        """
+        super().__init__(daemon=True)
+        
+        self.model = model
+        self.max_engines = max_engines
+        self.pending = None
+        self.condition = threading.Condition()
+        
+        self.start()
+        
+    def submit(self, path, accuracy=0.0):
+        """
+        Queue the checkpoint directory to be built and swapped in (this returns immediately)
+        """
+        with self.condition:
+            self.pending = (path, accuracy)
+            self.condition.notify()
+            
+    def run(self):
+        """
+        Builder thread main loop
+        """
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                    
+                path, accuracy = self.pending
+                self.pending = None
+                
+            try:
+                self.build(path, accuracy)
+            except:
+                exc = traceback.format_exc()
+                alert(exc, level='error', category='exception', duration=0)
+                Log.Error(exc)
+                
+    def build(self, path, accuracy):
+        """
+        Build the engine for a checkpoint directory (if it isn't cached) and swap it into the model.
+        """
+        onnx_path = os.path.join(path, f'{self.model.args.network}.onnx')
+        labels_path = os.path.join(path, 'labels.txt')
+        
+        if len(glob.glob(onnx_path + '.*.engine')) == 0:
+            alert(f"Building TensorRT engine for {onnx_path} ({accuracy:.1f}% accuracy)")
+            
+            result = subprocess.run([
+                sys.executable, os.path.abspath(__file__), path,
+                '--input-layer', self.model.input_layer,
+                '--output-layer', self.model.output_layer
+            ], cwd=os.path.dirname(os.path.abspath(__file__)))
+            
+            if result.returncode != 0:
+                raise RuntimeError(f"failed to build TensorRT engine for {onnx_path} (exit code {result.returncode})")
+        else:
+            print(f"[trt]  using cached TensorRT engine for {onnx_path}")
+            
+        model_infer = imageNet(model=onnx_path, labels=labels_path, input_blob=self.model.input_layer, output_blob=self.model.output_layer)
+        
+        model_infer.SetThreshold(self.model.inference_threshold)
+        model_infer.SetSmoothing(self.model.inference_smoothing)
+
+        self.model.model_infer = model_infer
+        self.model.onnx_path = onnx_path
+        self.model.labels_path = labels_path
+        
+        os.utime(path)  # mark it as the most recently used
+        self.prune()
+        
+        alert(f"Loaded inference model from {onnx_path} ({accuracy:.1f}% accuracy)", level='success')
+        
+    def prune(self):
+        """
+        Remove the least-recently used checkpoints from the cache.
+        """
+        paths = [os.path.join(self.model.engine_dir, path) for path in os.listdir(self.model.engine_dir)]
+        paths = sorted([path for path in paths if os.path.isdir(path)], key=os.path.getmtime, reverse=True)
+        
+        for path in paths[self.max_engines:]:
+            print(f"[trt]  removing cached engine {path}")
+            shutil.rmtree(path, ignore_errors=True)
+            
+            
+def export_onnx(path, input_layer='input_0', output_layer='output_0'):
+    """
+    Export the checkpoint (model.pth) in a directory to ONNX, along with its labels.txt
+    """
+    checkpoint = torch.load(os.path.join(path, 'model.pth'), map_location='cpu')
+    
+    network = checkpoint['network']
+    onnx_path = os.path.join(path, f'{network}.onnx')
+    
+    print(f"[torch]  exporting ONNX to {onnx_path}")
+    
+    model = torchvision.models.__dict__[network]()
+    model = reshape_model(model, network, checkpoint['num_classes'])
+    model.load_state_dict(checkpoint['state_dict'])
+    
+    if checkpoint['multi_label']:
+        model = torch.nn.Sequential(model, torch.nn.Sigmoid())
+    else:
+        model = torch.nn.Sequential(model, torch.nn.Softmax(1))
+        
+    model.eval()
+    
+    torch.onnx.export(
+        model,
+        torch.ones((1, 3, *checkpoint['resolution'])),
+        onnx_path,
+        input_names=[input_layer],
+        output_names=[output_layer])
+
+    with open(os.path.join(path, 'labels.txt'), 'w') as file:
+        file.write('\n'.join(checkpoint['classes']))
+        
+    return onnx_path
+    
+    
+if __name__ == '__main__':
+    # this gets run by EngineBuilder in a separate process, so that inference keeps running while the engine builds
+    parser = argparse.ArgumentParser(description="Export a checkpoint to ONNX and build its TensorRT engine")
+    
+    parser.add_argument("path", type=str, help="directory containing the model.pth checkpoint")
+    parser.add_argument("--input-layer", default='input_0', type=str, help="name of the input layer")
+    parser.add_argument("--output-layer", default='output_0', type=str, help="name of the output layer")
+    
+    args = parser.parse_args()
+    
+    onnx_path = export_onnx(args.path, args.input_layer, args.output_layer)
+    
+    # loading it serializes the engine next to the ONNX model, which the app then loads from the cache
+    imageNet(model=onnx_path, labels=os.path.join(args.path, 'labels.txt'), input_blob=args.input_layer, output_blob=args.output_layer)
         
\ No newline at end of file